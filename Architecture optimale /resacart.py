@@ -11,149 +11,6 @@ import pandas as pd
 import matplotlib.pyplot as plt
 #from   matplotlib  import cm
 from   resacartdef import *
-#
-def load_resac_data(npz_data_file) :
-    """
-    Exemple d'usage:
-        FdataAllVar,varlue = load_resac_data("natl60_htuv_01102012_01102013.npz")
-
-    Lecture des données RESAC.  La function s'attend à trouver le repertoire
-    des données dans la variable d'environnement RESAC_DATASETS_DIR.
-
-    Retourne l'array 4D des donnees ([nb.variable, np.time steps, y size, x size])
-    et la liste des noms de variables dans l'array.
-    """
-    # ---- datasets location
-
-    datasets_dir = os.getenv('RESAC_DATASETS_DIR', False)
-    if datasets_dir is False:
-        print('\n# ATTENTION !!\n#')
-        print('#  Le dossier contenant les datasets est introuvable !\n#')
-        print('#  Pour que les notebooks et programmes puissent le localiser, vous')
-        print("#  devez préciser la localisation de ce dossier datasets via la")
-        print("#  variable d'environnement : RESAC_DATASETS_DIR.\n#")
-        print('#  Exemple :')
-        print("#    Dans votre fichier .bashrc :")
-        print('#    export RESAC_DATASETS_DIR=~/mon/datasets/folder\n')
-        print('#')
-        print('# Valeurs typiques :')
-        print('# - Au Locean, toute machine (acces lent):')
-        print('#     export RESAC_DATASETS_DIR="/net/pallas/usr/neuro/com/carlos/Clouds/SUnextCloud/Labo/Stages-et-Projets-long/Resac/donnees"')
-        print('#')
-        print('# - Au Locean, uniquement Acratopotes (accès rapide, disque SSD):')
-        print('#     export RESAC_DATASETS_DIR="/datatmp/home/carlos/Projets/Resac/donnees"')
-        print('#')
-        print('# - Dans le cluster GPU Hal (accès rapide, disque SSD):')
-        print('#     export RESAC_DATASETS_DIR="/net/nfs/ssd3/cmejia/Travaux/Resac/donnees"')
-        assert False, 'datasets folder not found, please set RESAC_DATASETS_DIR env var.'
-    # Resolve tilde...
-    datasets_dir=os.path.expanduser(datasets_dir)
-    #
-    # join dataset dir with filename
-    data_set_filename = os.path.join(datasets_dir,npz_data_file)
-
-    # Lecture Des Donnees
-    print(f"Lecture Des Donnees du fichier {npz_data_file} ... ", end='', flush=True)
-    #Data_       = np.load(data_set_filename)
-    Data_       = np.load("../../donnees/natl60_htuv_01102012_01102013.npz")
-    FdataAllVar = Data_['FdataAllVar']
-    varlue      = list(Data_['varlue'])
-    varlue      = ['U' if i==b'SSU' else 'V' if i==b'SSV' else i.decode() for i in varlue] # Pour enlever les b devant les chaines de caracteres lors de la lecture et pour le conversion de 'SSU','SSV' en 'U','V'
-    print(f'\nArray avec {len(varlue)} variables: {varlue}')
-    print(f'contenant des images de taille {FdataAllVar.shape[2:]} pixels')
-    print(f'et {FdataAllVar.shape[1]} pas de temps (une image par jour).')
-    print(f'Dimensions de l\'array: {np.shape(FdataAllVar)}')
-    #
-    _, Nimg_, Nlig_, Ncol_ = np.shape(FdataAllVar) #(4L, 366L, 1296L, 1377L)
-    #
-    dimensions = {}
-    # Coordonnees : TIME
-    dimensions['time'] = pd.date_range("2012-10-01", periods=Nimg_)
-    # Limites absoluts NATL60 de la zone geographique (au centre des pixels)
-    nav_lat = [ 26.57738495,  44.30360031]
-    nav_lon = [-64.41895294, -40.8841095 ]
-    # Coordonnees : Lat / Lon (au centre du pixel)
-    all_lat = np.linspace(nav_lat[0],nav_lat[1],num=Nlig_) # latitude of center of the pixel
-    all_lon = np.linspace(nav_lon[0],nav_lon[1],num=Ncol_)
-    delta_lat = (all_lat[1]-all_lat[0])
-    delta_lon = (all_lon[1]-all_lon[0])
-    # Bords inferieur et supperieur des pixels
-    dimensions['lat'] = all_lat
-    dimensions['lon'] = all_lon
-    dimensions['lat_border'] = [nav_lat[0] - delta_lat/2, nav_lat[1] + delta_lat/2] # latitude border inf and sup for the zone
-    dimensions['lon_border'] = [nav_lon[0] - delta_lon/2, nav_lon[1] + delta_lon/2] # longitude border inf and sup for the zone
-    #
-    return FdataAllVar,varlue,dimensions
-#
-def load_resac_by_var_and_resol(varIn,varOut,ResoIn,ResoOut, subdir='NATL60byVar'):
-    """
-    Exemple d'usage:
-        V_data_list, couple_var_reso_list = load_resac_by_var_and_resol(varIn,varOut,ResoIn,ResoOut)
-
-    Lecture des données RESAC par variable/résolution.  La function s'attend à trouver
-    le répertoire des données dans la variable d'environnement RESAC_DATASETS_DIR.
-
-    Les données par Variable/résolution se trouvent normalement dans un sous-dossier
-    appelé 'NATL60byVar'. Il est posisble de spécifier un autre nom avec l'option 
-    subdir='DOSSIER'.
-    
-    Retourne deux éléments:
-        
-        - une liste d'array 3D ([np.time steps, y size, x size]) des données contenant
-          les arrays individuels par variable et résolution nécessaires au cas (selon
-          les variables d'entrée varIn, varOut, ResoIn, ResoOut)
-          
-        - une liste de couples (Variable, Résolution) intervenant dans le cas.
-    """
-    # ---- datasets location
-    #
-    datasets_dir = os.getenv('RESAC_DATASETS_DIR', False)
-    if datasets_dir is False:
-        print('\n# ATTENTION !!\n#')
-        print('#  Le dossier contenant les datasets est introuvable !\n#')
-        print('#  Pour que les notebooks et programmes puissent le localiser, vous')
-        print("#  devez préciser la localisation de ce dossier datasets via la")
-        print("#  variable d'environnement : RESAC_DATASETS_DIR.\n#")
-        print('#  Exemple :')
-        print("#    Dans votre fichier .bashrc :")
-        print('#    export RESAC_DATASETS_DIR=~/mon/datasets/folder\n')
-        print('#')
-        print('# Valeurs typiques :')
-        print('# - Au Locean, toute machine (acces lent):')
-        print('#     export RESAC_DATASETS_DIR="/net/pallas/usr/neuro/com/carlos/Clouds/SUnextCloud/Labo/Stages-et-Projets-long/Resac/donnees"')
-        print('#')
-        print('# - Au Locean, uniquement Acratopotes (accès rapide, disque SSD):')
-        print('#     export RESAC_DATASETS_DIR="/datatmp/home/carlos/Projets/Resac/donnees"')
-        print('#')
-        print('# - Dans le cluster GPU Hal (accès rapide, disque SSD):')
-        print('#     export RESAC_DATASETS_DIR="/net/nfs/ssd3/cmejia/Travaux/Resac/donnees"')
-        assert False, 'datasets folder not found, please set RESAC_DATASETS_DIR env var.'
-    # Resolve tilde...
-    datasets_dir=os.path.expanduser(datasets_dir)
-    #
-    couple_var_reso_list = []
-    for v,r in zip(varIn+varOut,ResoIn+ResoOut):
-        if not (v,r) in couple_var_reso_list :
-            couple_var_reso_list.append((v,r))
-    #
-    # Lecture Des Donnees    
-    V_data_list = []; D_dico_list = []
-    for v,r in couple_var_reso_list:
-        print(f"loading data: '{v}' at R{r}")
-        #data_tmp = np.load(os.path.join(datasets_dir,subdir,f"NATL60_{v.upper()}_R{r:02d}.npy"))
-        #dimension_tmp = np.load(os.path.join(datasets_dir,subdir,f"NATL60_coords_R{r:02d}.npz"))
-        data_tmp = np.load(os.path.join(datasets_dir,subdir,f"SAT_{v.upper()}_R{r:02d}s.npy"))
-        dimension_tmp = np.load(os.path.join(datasets_dir,subdir,f"SAT_coords_R{r:02d}s.npz"))
-        dico_dim = { 'time': dimension_tmp['time'],
-                     'lat' : dimension_tmp['latitude'],
-                     'lon' : dimension_tmp['longitude'],
-                     'lat_border' : dimension_tmp['latitude_border'],
-                     'lon_border' : dimension_tmp['longitude_border'] }
-        V_data_list.append(data_tmp)
-        D_dico_list.append(dico_dim)
-    #
-    return V_data_list, couple_var_reso_list, D_dico_list
-
 #
 #%%
 #======================================================================
@@ -169,8 +26,52 @@ def load_resac_by_var_and_resol(varIn,varOut,ResoIn,ResoOut, subdir='NATL60byVar
 # ----------------------------------------------------------------------------
 # Lecture des donnees Resac
 print("Lecture Des Données en cours ...");
-if LOAD_DATA_BY_VAR_AND_RESOL :
-    V_data_list, couple_var_reso_list, D_dico_list = load_resac_by_var_and_resol(varIn,varOut,ResoIn,ResoOut, subdir='Satellite/SatbyVar')# Enlever subdir si données NATL60 classique desirées
+# Cache des tenseurs codés (USE_SCENARIO_CACHE): un run avec les memes parametres
+# et les memes fichiers sources les relit (memory-map) et va directement au modele.
+# Pas de cache si des figures ou stats sur les données brutes sont demandées. Le
+# bruit de TEST (SIGT_NOISE, graine fixe) est dans les tenseurs codés mis en cache.
+DATA_BRUTE_NEEDED = (VisuBA+VisuBV+VisuBT > 0 or FLAG_STAT_BASE_BRUTE or
+                     FLAG_STAT_BASE_BRUTE_SET or FLAG_HISTO_VAR_BRUTE_SET or FLAG_DAILY_MOY_EE)
+SCENARIO_CACHE_ON = USE_SCENARIO_CACHE and TEST_ON and VALID_ON and not DATA_BRUTE_NEEDED
+# Options de lecture, communes aux chargeurs et a la clé du cache. zone, lat, lon
+# et itime: zone de selection et sous-echantillonnage en temps (tout par defaut).
+if LOAD_DATA_BY_VAR_AND_RESOL and not LOAD_DATA_NPZ_STREAM :
+    # Enlever subdir, data_prefix et data_suffix si données NATL60 classique desirées
+    load_kw = dict(subdir='Satellite/SatbyVar', data_prefix='SAT', data_suffix='s')
+else :
+    load_kw = {}
+load_kw.update(zone=None, lat=None, lon=None, itime=None)
+scenario = None
+if SCENARIO_CACHE_ON :
+    # meme clé que get_resac_scenario (resac_scenario_name, scenario_sources), plus
+    # les options propres a ce script (lecture npz par flux, morceaux, bruit de TEST)
+    cache_key = resac_cache_key(resac_scenario_name(varIn, varOut, ResoIn, ResoOut, "fit01",
+                                                    False, DATA_DTYPE, **load_kw),
+                                "resacart", LOAD_DATA_NPZ_STREAM, LOAD_DATA_CHUNKED,
+                                SIGT_NOISE, NOISE_CORR_LENGTH, NOISE_COVARIANCE,
+                                sources=scenario_sources(False, npz_stream=LOAD_DATA_NPZ_STREAM, **load_kw))
+    scenario = load_scenario_cache(cache_key)
+if scenario is not None :
+    print(f"tenseurs codés relus du cache '{cache_key}'")
+    x_train, y_train = scenario['x_train'], scenario['y_train']
+    x_valid, y_valid = scenario['x_valid'], scenario['y_valid']
+    x_test,  y_test  = scenario['x_test'],  scenario['y_test']
+    VAout_brute, VTout_brute = scenario['VAout_brute'], scenario['VTout_brute']
+    coparmAin, coparmAout = scenario['coparmAin'], scenario['coparmAout']
+    indA, indV, indT = scenario['indA'], scenario['indV'], scenario['indT']
+    time_axis = scenario['time_axis']
+    Din_dico_list, Dout_dico_list = scenario['Din_dico_list'], scenario['Dout_dico_list']
+    NcanIn  = len(x_train)
+    NensA, NensV, NensT = len(y_train[0]), len(y_valid[0]), len(y_test[0])
+elif LOAD_DATA_BY_VAR_AND_RESOL :
+    if LOAD_DATA_NPZ_STREAM :
+        # arrays par variable/resolution construits a partir du grand array R01
+        V_data_list, couple_var_reso_list, D_dico_list = load_resac_data_by_var_and_resol("natl60_htuv_01102012_01102013.npz",
+                                                                                          varIn,varOut,ResoIn,ResoOut,
+                                                                                          **load_kw)
+    else:
+        V_data_list, couple_var_reso_list, D_dico_list = load_resac_by_var_and_resol(varIn,varOut,ResoIn,ResoOut,
+                                                                                     **load_kw)
     #
     time_axis = D_dico_list[0]['time']
     Nimg_ = V_data_list[0].shape[0]       # nombre de patterns ou images (ou jours)
@@ -188,11 +89,12 @@ if LOAD_DATA_BY_VAR_AND_RESOL :
                                                              varOut, ResoOut, indA, indV, indT)
     VAin_brute, VVin_brute, VTin_brute = data_repartition(V_data_list, couple_var_reso_list,
                                                           varIn, ResoIn, indA, indV, indT)
+    del V_data_list # les ensembles sont des vues IndexedSet (ou des copies, DATA_SET_VIEWS)
     # Liste de dictionnaires de dimensions ('time','lat','lat_border', ...) separés pour OUT et pour IN
     Din_dico_list = dic_dimension_repartition(D_dico_list, couple_var_reso_list, varIn, ResoIn) 
     Dout_dico_list = dic_dimension_repartition(D_dico_list, couple_var_reso_list, varOut, ResoOut) 
 else:
-    FdataAllVar,varlue,diccoord = load_resac_data("natl60_htuv_01102012_01102013.npz")
+    FdataAllVar,varlue,diccoord = load_resac_data("natl60_htuv_01102012_01102013.npz", **load_kw)
     #
     time_axis = diccoord['time']    
     Nvar_, Nimg_, _, _ = np.shape(FdataAllVar) #(4L, 366L, 1296L, 1377L)
@@ -212,15 +114,14 @@ else:
     # Splitset Ens App - Val - Test
     print("Splitset Ens App - Val - Test ...", end='')
     indA, indV, indT = isetalea(Nimg_, pcentSet)
-    VA_brute = []
-    VV_brute = []
-    VT_brute = []
-    for i in np.arange(Nvar_) : # Pour chaque variable (i.e. liste) (dans l'ordre de tvwmm ...)
-        VA_brute.append(FdataAllVar[i][indA])
-        VV_brute.append(FdataAllVar[i][indV])
-        VT_brute.append(FdataAllVar[i][indT])
-    #
-    del FdataAllVar #<<<<<<<
+    if FLAG_STAT_BASE_BRUTE_SET or FLAG_HISTO_VAR_BRUTE_SET :
+        VA_brute = []
+        VV_brute = []
+        VT_brute = []
+        for i in np.arange(Nvar_) : # Pour chaque variable (i.e. liste) (dans l'ordre de tvwmm ...)
+            VA_brute.append(FdataAllVar[i][indA])
+            VV_brute.append(FdataAllVar[i][indV])
+            VT_brute.append(FdataAllVar[i][indT])
     #
     if FLAG_STAT_BASE_BRUTE_SET :
         # Stats de base en donnï¿½es brute par ensemble
@@ -253,9 +154,15 @@ else:
             plt.title("TEST")
         #plt.show()
     #
-    # Make resolution for IN and OUT
-    VAout_brute, VVout_brute, VTout_brute, VAin_brute, VVin_brute, VTin_brute \
-    = setresolution(VA_brute,VV_brute,VT_brute,varlue,ResoIn,ResoOut)
+    # Make resolution for IN and OUT: chaque couple (Variable, Résolution) une
+    # seule fois sur tout l'axe de Time, puis repartition App/Val/Test
+    V_data_list, couple_var_reso_list = setresolution_couples(FdataAllVar,varlue,varIn,varOut,ResoIn,ResoOut)
+    del FdataAllVar #<<<<<<<
+    VAout_brute, VVout_brute, VTout_brute = data_repartition(V_data_list, couple_var_reso_list,
+                                                             varOut, ResoOut, indA, indV, indT)
+    VAin_brute, VVin_brute, VTin_brute = data_repartition(V_data_list, couple_var_reso_list,
+                                                          varIn, ResoIn, indA, indV, indT)
+    del V_data_list
 #%%
 if CALENDAR_FROM_DATA :
     calA_ = np.array([pd.to_datetime(str(t)).strftime('%d-%b-%Y') for t in time_axis[indA]])
@@ -315,63 +222,62 @@ if FLAG_DAILY_MOY_EE and IS_UVout :
     del Uall_, Vall_
 #%%
 #::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
-print("# Mise en forme")
-for i in np.arange(NvarIn) :  # App In
-    NdonA, pixlinA, pixcinA  = np.shape(VAin_brute[i])   # Nombre de donnï¿½es et tailles
-    VAin_brute[i] = VAin_brute[i].reshape(NdonA,1,pixlinA,pixcinA)
-for i in np.arange(NvarOut) : # App Out
-    NoutA, pixloutA, pixcoutA = np.shape(VAout_brute[i])
-    VAout_brute[i] = VAout_brute[i].reshape(NdonA,1,pixloutA,pixcoutA)
-if NdonA != NoutA :
-    raise ValueError("Problï¿½me A") # ce n'est pas suffisant
+if scenario is None : # sinon les tenseurs codés sont deja relus du cache
+    print("# Mise en forme")
+    for i in np.arange(NvarIn) :  # App In
+        NdonA, pixlinA, pixcinA  = np.shape(VAin_brute[i])   # Nombre de donnï¿½es et tailles
+        VAin_brute[i] = VAin_brute[i].reshape(NdonA,1,pixlinA,pixcinA)
+    for i in np.arange(NvarOut) : # App Out
+        NoutA, pixloutA, pixcoutA = np.shape(VAout_brute[i])
+        VAout_brute[i] = VAout_brute[i].reshape(NdonA,1,pixloutA,pixcoutA)
+    if NdonA != NoutA :
+        raise ValueError("Problï¿½me A") # ce n'est pas suffisant
 
-if TEST_ON :
-    for i in np.arange(NvarIn) :  # Tst In
-        NdonT, pixlinT, pixcinT  = np.shape(VTin_brute[i])     # Nombre de donnï¿½es et tailles
-        VTin_brute[i] = VTin_brute[i].reshape(NdonT,1,pixlinT,pixcinT)
-    for i in np.arange(NvarOut) : # Tst Out
-        NoutT, pixloutT, pixcoutT = np.shape(VTout_brute[i])
-        VTout_brute[i] = VTout_brute[i].reshape(NdonT,1,pixloutT,pixcoutT)
-    if NdonT != NoutT :
-        raise ValueError("Problï¿½me T") # ce n'est pas suffisant
-if VALID_ON :
-    for i in np.arange(NvarIn) :  # Val In
-        NdonV, pixlinV, pixcinV  = np.shape(VVin_brute[i]) # Nombre de donnï¿½es et tailles
-        VVin_brute[i] = VVin_brute[i].reshape(NdonV,1,pixlinV,pixcinV)
-    for i in np.arange(NvarOut) : # Val Out
-        NoutV, pixloutV, pixcoutV = np.shape(VVout_brute[i])
-        VVout_brute[i] = VVout_brute[i].reshape(NdonV,1,pixloutV,pixcoutV)
-    if NdonV != NoutV :
-        raise ValueError("Problï¿½me V") # ce n'est pas suffisant
+    if TEST_ON :
+        for i in np.arange(NvarIn) :  # Tst In
+            NdonT, pixlinT, pixcinT  = np.shape(VTin_brute[i])     # Nombre de donnï¿½es et tailles
+            VTin_brute[i] = VTin_brute[i].reshape(NdonT,1,pixlinT,pixcinT)
+        for i in np.arange(NvarOut) : # Tst Out
+            NoutT, pixloutT, pixcoutT = np.shape(VTout_brute[i])
+            VTout_brute[i] = VTout_brute[i].reshape(NdonT,1,pixloutT,pixcoutT)
+        if NdonT != NoutT :
+            raise ValueError("Problï¿½me T") # ce n'est pas suffisant
+    if VALID_ON :
+        for i in np.arange(NvarIn) :  # Val In
+            NdonV, pixlinV, pixcinV  = np.shape(VVin_brute[i]) # Nombre de donnï¿½es et tailles
+            VVin_brute[i] = VVin_brute[i].reshape(NdonV,1,pixlinV,pixcinV)
+        for i in np.arange(NvarOut) : # Val Out
+            NoutV, pixloutV, pixcoutV = np.shape(VVout_brute[i])
+            VVout_brute[i] = VVout_brute[i].reshape(NdonV,1,pixloutV,pixcoutV)
+        if NdonV != NoutV :
+            raise ValueError("Problï¿½me V") # ce n'est pas suffisant
 #
 #======================================================================
 # Ajout de bruit sur l'input SSH brute pour l'ensemble de TEST uniquement
-if SIGT_NOISE > 0 :
+# (deja dans x_test si les tenseurs codés sont relus du cache)
+if scenario is None and SIGT_NOISE > 0 :
     for i in np.arange(NvarIn) :
         if varIn[i] == "SSH" :
             STAT_ON_NOISE = True
-            if STAT_ON_NOISE :
-                X0_ = VTin_brute[i]  # H avant bruitage
-            #
-            np.random.seed(0)
-            N_,M_,L_,C_ = np.shape(VTin_brute[i])
-            #sigma = 0.050 #1.=8ï¿½, 10=42ï¿½, 100=45ï¿½(0ï¿½-180ï¿½)
-            noise_ = np.random.randn(N_,M_,L_,C_) * SIGT_NOISE
-            VTin_brute[i] = VTin_brute[i] + noise_     # TEST set only
+            # bruit tiré par bloc d'images et par image (add_sample_noise, graine
+            # 0): reproductible et sans array de bruit de la taille de l'ensemble.
+            # Bruit spatialement correlé si NOISE_CORR_LENGTH > 0 (input_noises)
+            noisef_ = input_noises(varIn, ResoIn, VTin_brute, sigma=SIGT_NOISE)[i]
+            VTin_brute[i], nstat_, nabsstat_, sumabsX0_ = add_sample_noise(VTin_brute[i], SIGT_NOISE,
+                                                                           seed=0, stats=True,
+                                                                           noisefunc=noisef_) # TEST set only
             #
             if STAT_ON_NOISE :
-                noiseabs_ = np.abs(noise_)
                 print("SSH : noise %.3f (min=%.3f, max=%.3f, moy=%.4e, std=%.3f moyabs=%.4e, stdabs=%.3f)"
-                      %(SIGT_NOISE, np.min(noise_), np.max(noise_), np.mean(noise_),
-                        np.std(noise_), np.mean(noiseabs_), np.std(noiseabs_)))
-                rmsi, Nnan, inan = nanrms(VTin_brute[i], X0_)
+                      %(SIGT_NOISE, nstat_.min, nstat_.max, nstat_.mean,
+                        nstat_.std, nabsstat_.mean, nabsstat_.std))
+                rmsi = np.sqrt(nstat_.var + nstat_.mean**2)
                 print("noiseRMSE : %f "%(rmsi))
                 #
-                print("noiseErrRelAbs : %f "%( np.sum(noiseabs_) / np.sum(np.abs(X0_))))
+                print("noiseErrRelAbs : %f "%( nabsstat_.mean * nabsstat_.n / sumabsX0_))
                 print("Stat noiseAbs perturbation (sur H en m): min=%.4e, max=%.4f, moy=%.4f, std=%.4f"
-                      %(np.min(noiseabs_), np.max(noiseabs_),np.mean(noiseabs_), np.std(noiseabs_)))
-                del noiseabs_, X0_
-            del noise_
+                      %(nabsstat_.min, nabsstat_.max, nabsstat_.mean, nabsstat_.std))
+            del nstat_, nabsstat_, sumabsX0_, noisef_
 #======================================================================
 if VisuBA+VisuBV+VisuBT > 0 :
     print("# Visualisation des donnees brutes")
@@ -540,78 +446,86 @@ if VisuBstop or SCENARCHI==0 :
 #======================================================================
 #                   CODIFICATION / NORMALISATION
 #======================================================================
-print("# Codification / Normalisation")
-# PLM, CE DOIT ETRE OBLIGATOIRE car la sauvegarde des paramï¿½tres n'est
-# pas faite, Il faut repasser ici pour les recalculer ï¿½ chaque fois
-VAin = []
-coparmAin = []
-for i in np.arange(NvarIn) :
-    VAin_,  coparmAin_  = codage(VAin_brute[i],  "fit01")
-    print(coparmAin_)
-    VAin.append(VAin_)
-    coparmAin.append(coparmAin_)
-del VAin_, coparmAin_
-x_train = VAin
-NcanIn  = len(x_train)
-#
-VAout = []
-coparmAout = []
-for i in np.arange(NvarOut) :
-    VAout_,  coparmAout_  = codage(VAout_brute[i],  "fit01")
-    print(coparmAout_)
-    VAout.append(VAout_)
-    coparmAout.append(coparmAout_)
-del VAout_, coparmAout_
-y_train = VAout
-NensA   = len(y_train[0])
-#
-if TEST_ON : # Il faut appliquer le mï¿½me codage et dans les mï¿½mes conditions
-    # (i.e. avec les mï¿½mes paramï¿½tres) que ceux de l'apprentissage.
-    VTin = []
+if scenario is None : # sinon les tenseurs codés sont deja relus du cache
+    print("# Codification / Normalisation")
+    # Codage en place directement en channel last (N,H,W,1) float32 (codage_nhwc).
+    # PLM, CE DOIT ETRE OBLIGATOIRE car la sauvegarde des paramï¿½tres n'est
+    # pas faite, Il faut repasser ici pour les recalculer ï¿½ chaque fois
+    VAin = []
+    coparmAin = []
     for i in np.arange(NvarIn) :
-        VTin_ = recodage(VTin_brute[i], coparmAin[i])
-        VTin.append(VTin_)
-    del VTin_
-    x_test = VTin
+        VAin_,  coparmAin_  = codage_nhwc(VAin_brute[i],  "fit01")
+        print(coparmAin_)
+        VAin.append(VAin_)
+        coparmAin.append(coparmAin_)
+    del VAin_, coparmAin_
+    del VAin_brute # plus utile une fois codé
+    x_train = VAin
+    NcanIn  = len(x_train)
     #
-    VTout = []
+    VAout = []
+    coparmAout = []
     for i in np.arange(NvarOut) :
-        VTout_ =  recodage(VTout_brute[i], coparmAout[i])
-        VTout.append(VTout_)
-    del VTout_
+        VAout_,  coparmAout_  = codage_nhwc(VAout_brute[i],  "fit01")
+        print(coparmAout_)
+        VAout.append(VAout_)
+        coparmAout.append(coparmAout_)
+    del VAout_, coparmAout_
+    y_train = VAout
+    NensA   = len(y_train[0])
     #
-    y_test = VTout
-    NensT = len(y_test[0])
+    if TEST_ON : # Il faut appliquer le mï¿½me codage et dans les mï¿½mes conditions
+        # (i.e. avec les mï¿½mes paramï¿½tres) que ceux de l'apprentissage.
+        VTin = []
+        for i in np.arange(NvarIn) :
+            VTin_ = codage_nhwc(VTin_brute[i], coparm=coparmAin[i])
+            VTin.append(VTin_)
+        del VTin_, VTin_brute
+        x_test = VTin
+        #
+        VTout = []
+        for i in np.arange(NvarOut) :
+            VTout_ =  codage_nhwc(VTout_brute[i], coparm=coparmAout[i])
+            VTout.append(VTout_)
+        del VTout_
+        #
+        y_test = VTout
+        NensT = len(y_test[0])
 
-if VALID_ON : # Il faut appliquer le mï¿½me codage et dans les mï¿½mes conditions
-    # (i.e. avec les mï¿½mes paramï¿½tre) que ceux de l'apprntissage.
-    VVin = []
-    for i in np.arange(NvarIn) :
-        VVin_ = recodage(VVin_brute[i], coparmAin[i])
-        VVin.append(VVin_)
-    del VVin_
-    x_valid = VVin
-    #
-    VVout = []
-    for i in np.arange(NvarOut) :
-        VVout_ =  recodage(VVout_brute[i], coparmAout[i])
-        VVout.append(VVout_)
-    del VVout_
+    if VALID_ON : # Il faut appliquer le mï¿½me codage et dans les mï¿½mes conditions
+        # (i.e. avec les mï¿½mes paramï¿½tre) que ceux de l'apprntissage.
+        VVin = []
+        for i in np.arange(NvarIn) :
+            VVin_ = codage_nhwc(VVin_brute[i], coparm=coparmAin[i])
+            VVin.append(VVin_)
+        del VVin_, VVin_brute
+        x_valid = VVin
+        #
+        VVout = []
+        for i in np.arange(NvarOut) :
+            VVout_ =  codage_nhwc(VVout_brute[i], coparm=coparmAout[i])
+            VVout.append(VVout_)
+        del VVout_, VVout_brute
+        #
+        y_valid = VVout
+        NensV   = len(y_valid[0])
     #
-    y_valid = VVout
-    NensV   = len(y_valid[0])
+    if SCENARIO_CACHE_ON : # pour les runs suivants
+        save_scenario_cache(cache_key, { 'x_train': x_train, 'y_train': y_train,
+                                         'x_valid': x_valid, 'y_valid': y_valid,
+                                         'x_test': x_test, 'y_test': y_test,
+                                         'VAout_brute': VAout_brute, 'VTout_brute': VTout_brute,
+                                         'coparmAin': coparmAin, 'coparmAout': coparmAout,
+                                         'indA': indA, 'indV': indV, 'indT': indT, 'time_axis': time_axis,
+                                         'Din_dico_list': Din_dico_list if LOAD_DATA_BY_VAR_AND_RESOL else None,
+                                         'Dout_dico_list': Dout_dico_list if LOAD_DATA_BY_VAR_AND_RESOL else None })
 
+if TIME_WINDOW > 1 : # entrées (N,H,W,TIME_WINDOW): fenetres de TIME_WINDOW jours (vues, sans copie)
+    x_train, x_valid, x_test = windowed_sets((x_train, x_valid, x_test), (indA, indV, indT), TIME_WINDOW)
 #----------------------------------------------------------------------
-# POUR AVOIR CHANNEL LAST, en Linux dans ~/.keras/keras.json
+# CHANNEL LAST, en Linux dans ~/.keras/keras.json
 # Windows c:/Users/charles/.keras/keras.json
-for i in np.arange(NvarIn):
-    x_train[i] = x_train[i].transpose(0,2,3,1)
-    x_valid[i] = x_valid[i].transpose(0,2,3,1)
-    x_test[i] = x_test[i].transpose(0,2,3,1)
-for i in np.arange(NvarOut):
-    y_train[i] = y_train[i].transpose(0,2,3,1)
-    y_valid[i] = y_valid[i].transpose(0,2,3,1)
-    y_test[i] = y_test[i].transpose(0,2,3,1)
+# x_* et y_* sont deja en (N,H,W,1): codés par codage_nhwc ci-dessus
 #----------------------------------------------------------------------
 
 if 1 : # Affichage des shapes ...
@@ -861,7 +775,8 @@ if RUN_MODE=="LEARN":
     
     Mdl   = Model(all_Kinput_img, ArchiOut)
     Mdl.summary();
-    Mdl.compile(loss='logcosh', optimizer=optimizers.Adam(learning_rate=2*(10**(-2.89637961))))
+    Mdl.compile(loss='logcosh', optimizer=optimizers.Adam(learning_rate=2*(10**(-2.89637961))),
+                **jit_compile_kwargs()) # etapes compilées XLA (ou non)
     print("Architecture completed")
     #
 else : # --> RUN_MODE "RESUME" ou
@@ -869,6 +784,7 @@ else : # --> RUN_MODE "RESUME" ou
     print("Lecture du ficher Modele d'un apprentissage passé: ",Mdl2savedcase)
     np.random.seed(acide)
     Mdl = load_model(Mdl2reloadArchi)   # Chargement du modele (de l'archi)
+    set_jit_compile(Mdl)                # etapes compilées XLA selon XLA_JIT_COMPILE
     Mdl.summary();
 #
 #%%
@@ -882,6 +798,18 @@ for k in range(len(y_train)):
 #======================================================================
 #                LEARNING (ou reprendre)
 #======================================================================
+# Données d'apprentissage de Mdl.fit: avec TRAIN_NOISE_SIGMA > 0 les entrées
+# SSH sont bruitées par batch (NoisyBatchSequence), d'un bruit nouveau a chaque epoch.
+# Les fenetres temporelles (TIME_WINDOW) passent aussi par batch, sans pile complete.
+# Avec USE_TF_DATA, pipeline tf.data (batchs preparés en parallele du calcul).
+fit_data = resac_fit_data(x_train, y_train, Bsize, noise_sigmas(varIn, coparmAin),
+                          noises=input_noises(varIn, ResoIn, x_train))
+# Poids au meilleur de la validation et export du modele: copiés en memoire et
+# ecrits en arriere plan (BACKGROUND_CHECKPOINT), par fichier temporaire renommé
+ckpt_writer = CheckpointWriter()
+# Validation toutes les VALID_FREQ epochs, sur VALID_SUBSET echantillons, en arriere
+# plan (VALID_BACKGROUND): validation_data de fit ou callback ResacValidation (valid_cbs)
+valid_kw, valid_cbs = validation_setup(x_valid, y_valid, Bsize)
 if RUN_MODE=="RESUME" :
     print("Reload des poids d'un model préalablement sauvegardé",Mdl2savedcase)
     Mdl.load_weights(Mdl2reloadWeights);
@@ -913,29 +841,28 @@ elif RUN_MODE=="REPRENDRE":
                     # apr�s patience it sans am�lioration).
         earlystop= EarlyStopping(monitor='val_loss',
                 patience=int(Niter/4), verbose=2, mode='auto')
-        H_reprendre = Mdl.fit(x_train, y_train, verbose=2, epochs=Niter,batch_size=Bsize,
-                shuffle=True, callbacks=[earlystop], validation_data=(x_valid, y_valid))
+        H_reprendre = Mdl.fit(**fit_data, verbose=2, epochs=Niter,
+                callbacks=valid_cbs+[earlystop], **valid_kw)
     elif VALID_ON==4 or VALID_ON==5:
         log_dir = logs_fit_dir + datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-        tensorboard_callback = TensorBoard(log_dir=log_dir, histogram_freq=1)
+        tensorboard_callback = TensorBoard(log_dir=log_dir, histogram_freq=TENSORBOARD_HISTOGRAM_FREQ)
         # 4 : Le run va jusqu'au bout. On r�cup�re, par la suite la sauvegarde
         #     des poids au meilleur de l'ensemble de validation pour les r�sultats.
-        checkpoint_reprendre= ModelCheckpoint(os.path.join(weights_dir,"modelkvalid.ckpt"),
-                                              monitor='val_loss', verbose=2,
-                                              save_best_only=True, save_weights_only=True,
-                                              mode='auto')
+        checkpoint_reprendre= BackgroundModelCheckpoint(os.path.join(weights_dir,"modelkvalid.ckpt"),
+                                                        writer=ckpt_writer, monitor='val_loss', verbose=2,
+                                                        save_best_only=True, save_weights_only=True,
+                                                        mode='auto')
 
         callback_history = LossHistory(file=os.path.join(historique_dir,"modelkhistory.pkl"))
-        try:
-            os.remove(callback_history.file_name())
-        except OSError:
+        if not callback_history.remove():
             print("Le fichier Historique n'existe pas encore, il n'a pas pu être supprimé")
-            pass
 
+        if valid_cbs : # poids du meilleur snapshot validé, ecrits par ResacValidation
+            checkpoint_reprendre = valid_cbs[0].save_best_to(os.path.join(weights_dir,"modelkvalid.ckpt"), ckpt_writer)
         callbacks_list=[checkpoint_reprendre, callback_history,tensorboard_callback] # Sauvegarde de H.history à chaque epoch
 
-        H_reprendre = Mdl.fit(x_train, y_train, verbose=2, epochs=Niter, batch_size=Bsize,
-                shuffle=True, callbacks=callbacks_list, validation_data=(x_valid, y_valid));
+        H_reprendre = Mdl.fit(**fit_data, verbose=2, epochs=Niter,
+                callbacks=callbacks_list, **valid_kw);
     print("Le run du mode REPRENDRE est allé jusqu'au bout des %d itérations"%(Niter))
     print("learning time : %f secondes" %(time()-t0))
     print("Temps moyen par itération: %f secondes " %((time()-t0)/Niter))
@@ -978,7 +905,7 @@ elif RUN_MODE=="REPRENDRE":
     with open(os.path.join(Mdl2reprendre,'history.pkl'), 'wb') as file:
         pickle.dump(HistoryFromReprendre, file)
     #
-    Mdl.save(archi_train_dir)
+    save_model_background(Mdl, archi_train_dir, ckpt_writer, snapshot=False)
     print('Architecture du modèle sauvegardée')
 #
 elif RUN_MODE=="LEARN":
@@ -986,7 +913,7 @@ elif RUN_MODE=="LEARN":
     #
     # Sauvegarde de l'architecture du modele
     #Mdl.save_weights(Mdl2save+"wei");
-    Mdl.save(archi_train_dir)
+    save_model_background(Mdl, archi_train_dir, ckpt_writer) # copie: ecrite pendant l'apprentissage
     print('Architecture du modèle sauvegardée')
 
     # Les param�tres de codage de l'ens d'App
@@ -995,41 +922,41 @@ elif RUN_MODE=="LEARN":
     #
     t0 = time();
     if VALID_ON == 0 : # Pas d'usage de l'ensemble de validation (run 'simple)
-        H = Mdl.fit(x_train, y_train, verbose=2,
-                    epochs=Niter,batch_size=Bsize,shuffle=True);
+        H = Mdl.fit(**fit_data, verbose=2,
+                    epochs=Niter);
     elif VALID_ON == 1 : # Usage de l'ensemble de validation (sans early stopping)
-        H = Mdl.fit(x_train, y_train, verbose=2, epochs=Niter, batch_size=Bsize,
-                    shuffle=True, validation_data=(x_valid, y_valid));
+        H = Mdl.fit(**fit_data, verbose=2, epochs=Niter,
+                    callbacks=valid_cbs, **valid_kw);
     elif VALID_ON == 3 : # Early stopping sur l'ensemle de validation. Les poids ou
                          # le modï¿½le sauvgardable sont obtenus ï¿½ la fin du run
                          # aprï¿½s patience it sans amï¿½lioration).
         earlystop = EarlyStopping(monitor='val_loss',
                 patience=20, verbose=2, mode='auto');
-        H = Mdl.fit(x_train, y_train, verbose=2, epochs=Niter,batch_size=Bsize,
-                shuffle=True, callbacks=[earlystop], validation_data=(x_valid, y_valid));
+        H = Mdl.fit(**fit_data, verbose=2, epochs=Niter,
+                callbacks=valid_cbs+[earlystop], **valid_kw);
     elif VALID_ON==4 or VALID_ON==5 :
         # 4 : Le run va jusqu'au bout. On rï¿½cupï¿½re, par la suite la sauvegarde
         #     des poids au meilleur de l'ensemble de validation pour les rï¿½sultats.
-        tensorboard_callback = TensorBoard(log_dir=logs_fit_dir, histogram_freq=1)
-        checkpoint= ModelCheckpoint(os.path.join(weights_dir,"modelkvalid.ckpt"), monitor='val_loss',
-                                    verbose=2, save_best_only=True, save_weights_only=True,
-                                    mode='auto')
+        tensorboard_callback = TensorBoard(log_dir=logs_fit_dir, histogram_freq=TENSORBOARD_HISTOGRAM_FREQ)
+        checkpoint= BackgroundModelCheckpoint(os.path.join(weights_dir,"modelkvalid.ckpt"),
+                                              writer=ckpt_writer, monitor='val_loss',
+                                              verbose=2, save_best_only=True, save_weights_only=True,
+                                              mode='auto')
         callback_history = LossHistory(file=os.path.join(historique_dir,"modelkhistory.pkl"))
         #checkpoint= ModelCheckpoint(Mdl2save+"valid.ckpt", monitor='val_loss', verbose=2,
         #        save_best_only=True, save_weights_only=True, mode='auto')
         #
-        try:
-            os.remove(callback_history.file_name())
-        except OSError:
+        if not callback_history.remove():
             print("Le fichier n'existe pas encore, il n'a pas pu être supprimé")
-            pass
         #
+        if valid_cbs : # poids du meilleur snapshot validé, ecrits par ResacValidation
+            checkpoint = valid_cbs[0].save_best_to(os.path.join(weights_dir,"modelkvalid.ckpt"), ckpt_writer)
         callbacks_list=[checkpoint, callback_history,tensorboard_callback] # Sauvegarde de H.history à chaque epoch
         #
         # Model Fit()
         #
-        H = Mdl.fit(x_train, y_train, verbose=2, epochs=Niter, batch_size=Bsize,
-                shuffle=True, callbacks=callbacks_list, validation_data=(x_valid, y_valid));
+        H = Mdl.fit(**fit_data, verbose=2, epochs=Niter,
+                callbacks=callbacks_list, **valid_kw);
     #
     print("learning time : %f" %(time()-t0))
     print("temps moyen des" +str(Niter)+ " iterations:"+str((time()-t0)/Niter))
@@ -1064,6 +991,7 @@ elif RUN_MODE=="LEARN":
         itminval = np.argmin(valid_err_hist)
         print("itminval =",itminval)
 #
+ckpt_writer.wait() # checkpoints et export du modele ecrits avant les resultats
 #%%
 #======================================================================
 #                       RESULTS ON MODEL LEARNED
@@ -1113,7 +1041,7 @@ def setresult(Mdl, x_set, strset, VXout_brute, calX,
     # Predicted coded data
     y_scale = Mdl.predict(x_set);
     for i in np.arange(NvarOut):
-        y_scale[i] = y_scale[i].transpose(0,3,1,2)
+        y_scale[i] = as_data_dtype(y_scale[i].transpose(0,3,1,2))
     if len(varOut)==1 : # Si une seule sortie mettre y_scale en forme de list comme l'est y_train
         y_scale = [y_scale];
     #BACK TO BRUTE
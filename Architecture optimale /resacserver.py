@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""
+ **************************************************************************
+ resacserver.py
+
+ Serveur de données en memoire partagée du scenario SCENARCHI de
+ resacartparm.py: les données sont lues et codées une seule fois puis
+ publiées en memoire partagée. Les scripts d'apprentissage lancés en
+ parallele sur la meme machine (OB*.py, PTR*.py, avec USE_SHARED_DATA et le
+ meme resacartparm.py) s'y attachent sans copie au lieu de relire les données.
+
+ Usage:
+    python resacserver.py &        # Ctrl-C ou kill pour l'arreter
+    python OB2709.py & python OB2709.py & ...
+ **************************************************************************
+"""
+from __future__ import print_function
+from   resacartdef import *
+#
+serve_resac_scenario(varIn, varOut, ResoIn, ResoOut)
@@ -0,0 +1,49 @@
+#-*- coding: utf-8 -*-
+# Tests de quelques fonctions de resacartdef.py (python -m pytest)
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from resacartdef import *
+
+#----------------------------------------------------------------------
+def chunked(tmp_path, data) :
+    dirname = str(tmp_path / 'X.chunks')
+    write_chunked_array(dirname, data, chunks=(4, 3, 5), compress=False)
+    return ChunkedArray(dirname)
+#
+def test_indexedset_reshape_chunkedarray(tmp_path) :
+    X   = np.arange(10*6*7, dtype='float32').reshape(10, 6, 7)
+    ind = np.array([7, 2, 5, 0])
+    S   = IndexedSet(chunked(tmp_path, X), ind).reshape(len(ind), 1, 6, 7)
+    assert isinstance(S, IndexedSet) and S.shape == (4, 1, 6, 7) and S.ndim == 4
+    Y = X[ind].reshape(4, 1, 6, 7)
+    assert np.array_equal(np.asarray(S), Y)
+    assert np.array_equal(S[1:3], Y[1:3])
+    assert np.array_equal(S[2], Y[2])
+    assert np.array_equal(S[[0, 3], 0, 2:4], Y[[0, 3], 0, 2:4])
+    assert np.array_equal(S[..., 1], Y[..., 1])
+#
+def test_indexedset_ellipsis(tmp_path) :
+    X   = np.arange(10*6*7, dtype='float32').reshape(10, 6, 7)
+    ind = np.array([3, 1, 8])
+    for data in (X, chunked(tmp_path, X)) :
+        S = IndexedSet(data, ind)
+        assert np.array_equal(S[..., 0], X[ind][..., 0])
+        assert np.array_equal(S[1, ..., 2], X[ind][1, ..., 2])
+        assert np.array_equal(S[...], X[ind])
+        assert np.array_equal(S[()], X[ind])
+#
+def test_orthogonal_index_non_monotonic(tmp_path) :
+    lat = np.array([10., 12., 11., 14., 13., 15.])        # non monotone
+    lon = np.array([-5., -3., -4., -1., -2., 0., 1.])
+    dim_dic = { 'lat': lat, 'lat_border': lat - 0.5, 'lon': lon, 'lon_border': lon - 0.5 }
+    ilat, ilon, dim_dic = select_index_by_coords(dim_dic, lat_limits=(10.9, 14.6), lon_limits=(-4.6, -0.6))
+    assert not isinstance(ilat, slice) and not isinstance(ilon, slice)
+    X = np.arange(3*6*7, dtype='float32').reshape(3, 6, 7)
+    Y = X[:, ilat][:, :, ilon]
+    assert Y.shape == (3, len(ilat), len(ilon))
+    assert np.array_equal(orthogonal_index(X, [slice(None), ilat, ilon]), Y)
+    assert np.array_equal(orthogonal_index(chunked(tmp_path, X), [slice(0, 3), ilat, ilon]), Y)
+    assert np.array_equal(orthogonal_index(X, [slice(1, 3), slice(None), ilon]), X[1:3, :, ilon])
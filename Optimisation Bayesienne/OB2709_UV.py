@@ -16,207 +16,22 @@ import os
 
 
 
-def load_resac_by_var_and_resol(varIn,varOut,ResoIn,ResoOut, subdir='NATL60byVar'):
-    """
-    Exemple d'usage:
-        V_data_list, couple_var_reso_list = load_resac_by_var_and_resol(varIn,varOut,ResoIn,ResoOut)
-
-    Lecture des données RESAC par variable/résolution.  La function s'attend à trouver
-    le répertoire des données dans la variable d'environnement RESAC_DATASETS_DIR.
-
-    Les données par Variable/résolution se trouvent normalement dans un sous-dossier
-    appelé 'NATL60byVar'. Il est posisble de spécifier un autre nom avec l'option 
-    subdir='DOSSIER'.
-    
-    Retourne deux éléments:
-        
-        - une liste d'array 3D ([np.time steps, y size, x size]) des données contenant
-          les arrays individuels par variable et résolution nécessaires au cas (selon
-          les variables d'entrée varIn, varOut, ResoIn, ResoOut)
-          
-        - une liste de couples (Variable, Résolution) intervenant dans le cas.
-    """
-    # ---- datasets location
-    #
-    datasets_dir = os.getenv('RESAC_DATASETS_DIR', False)
-    if datasets_dir is False:
-        print('\n# ATTENTION !!\n#')
-        print('#  Le dossier contenant les datasets est introuvable !\n#')
-        print('#  Pour que les notebooks et programmes puissent le localiser, vous')
-        print("#  devez préciser la localisation de ce dossier datasets via la")
-        print("#  variable d'environnement : RESAC_DATASETS_DIR.\n#")
-        print('#  Exemple :')
-        print("#    Dans votre fichier .bashrc :")
-        print('#    export RESAC_DATASETS_DIR=~/mon/datasets/folder\n')
-        print('#')
-        print('# Valeurs typiques :')
-        print('# - Au Locean, toute machine (acces lent):')
-        print('#     export RESAC_DATASETS_DIR="/net/pallas/usr/neuro/com/carlos/Clouds/SUnextCloud/Labo/Stages-et-Projets-long/Resac/donnees"')
-        print('#')
-        print('# - Au Locean, uniquement Acratopotes (accès rapide, disque SSD):')
-        print('#     export RESAC_DATASETS_DIR="/datatmp/home/carlos/Projets/Resac/donnees"')
-        print('#')
-        print('# - Dans le cluster GPU Hal (accès rapide, disque SSD):')
-        print('#     export RESAC_DATASETS_DIR="/net/nfs/ssd3/cmejia/Travaux/Resac/donnees"')
-        assert False, 'datasets folder not found, please set RESAC_DATASETS_DIR env var.'
-    # Resolve tilde...
-    datasets_dir=os.path.expanduser(datasets_dir)
-    #
-    couple_var_reso_list = []
-    for v,r in zip(varIn+varOut,ResoIn+ResoOut):
-        if not (v,r) in couple_var_reso_list :
-            couple_var_reso_list.append((v,r))
-    #
-    # Lecture Des Donnees    
-    V_data_list = []; D_dico_list = []
-    for v,r in couple_var_reso_list:
-        print(f"loading data: '{v}' at R{r}")
-        data_tmp = np.load(os.path.join(datasets_dir,subdir,f"NATL60_{v.upper()}_R{r:02d}.npy"))
-        dimension_tmp = np.load(os.path.join(datasets_dir,subdir,f"NATL60_coords_R{r:02d}.npz"))
-        dico_dim = { 'time': dimension_tmp['time'],
-                     'lat' : dimension_tmp['latitude'],
-                     'lon' : dimension_tmp['longitude'],
-                     'lat_border' : dimension_tmp['latitude_border'],
-                     'lon_border' : dimension_tmp['longitude_border'] }
-        V_data_list.append(data_tmp)
-        D_dico_list.append(dico_dim)
-    #
-    return V_data_list, couple_var_reso_list, D_dico_list
-
-
-print("Lecture Des Données en cours ...");
-
-if LOAD_DATA_BY_VAR_AND_RESOL :
-    V_data_list, couple_var_reso_list, D_dico_list = load_resac_by_var_and_resol(varIn,varOut,ResoIn,ResoOut)
-    #
-    time_axis = D_dico_list[0]['time']
-    Nimg_ = V_data_list[0].shape[0]       # nombre de patterns ou images (ou jours)
-    #
-    if FLAG_STAT_BASE_BRUTE : # Statistiques de base sur les variables brutes lues (->PPT)
-        print('Code for FLAG_STAT_BASE_BRUTE not implemented yet in LOAD_DATA_BY_VAR_AND_RESOL mode!')
-    # Splitset Ens App - Val - Test
-    print(f"Splitset Ens App - Val - Test {pcentSet}% or", end='')
-    indA, indV, indT = isetalea(Nimg_, pcentSet);
-    print(f" {(len(indA), len(indV), len(indT))} images par ensemble.")
-    if FLAG_STAT_BASE_BRUTE_SET :
-        print('Code for FLAG_STAT_BASE_BRUTE_SET not implemented yet in LOAD_DATA_BY_VAR_AND_RESOL mode!')
-    # Liste de données brutes separéee par set (A,T,V) pour OUT et pour IN
-    VAout_brute, VVout_brute, VTout_brute = data_repartition(V_data_list, couple_var_reso_list,
-                                                             varOut, ResoOut, indA, indV, indT)
-    VAin_brute, VVin_brute, VTin_brute = data_repartition(V_data_list, couple_var_reso_list,
-                                                          varIn, ResoIn, indA, indV, indT)
-    # Liste de dictionnaires de dimensions ('time','lat','lat_border', ...) separés pour OUT et pour IN
-    Din_dico_list = dic_dimension_repartition(D_dico_list, couple_var_reso_list, varIn, ResoIn) 
-    Dout_dico_list = dic_dimension_repartition(D_dico_list, couple_var_reso_list, varOut, ResoOut) 
-
-
-    print("# Mise en forme") 
-for i in np.arange(NvarIn) :  # App In
-    NdonA, pixlinA, pixcinA  = np.shape(VAin_brute[i])   # Nombre de donn�es et tailles
-    VAin_brute[i] = VAin_brute[i].reshape(NdonA,1,pixlinA,pixcinA)
-for i in np.arange(NvarOut) : # App Out
-    NoutA, pixloutA, pixcoutA = np.shape(VAout_brute[i])
-    VAout_brute[i] = VAout_brute[i].reshape(NdonA,1,pixloutA,pixcoutA)   
-if NdonA != NoutA :
-    raise ValueError("Probl�me A") # ce n'est pas suffisant
-
-if TEST_ON :
-    for i in np.arange(NvarIn) :  # Tst In
-        NdonT, pixlinT, pixcinT  = np.shape(VTin_brute[i])     # Nombre de donn�es et tailles
-        VTin_brute[i] = VTin_brute[i].reshape(NdonT,1,pixlinT,pixcinT)
-    for i in np.arange(NvarOut) : # Tst Out       
-        NoutT, pixloutT, pixcoutT = np.shape(VTout_brute[i])
-        VTout_brute[i] = VTout_brute[i].reshape(NdonT,1,pixloutT,pixcoutT)
-    if NdonT != NoutT :
-        raise ValueError("Probl�me T") # ce n'est pas suffisant
-if VALID_ON : 
-    for i in np.arange(NvarIn) :  # Val In
-        NdonV, pixlinV, pixcinV  = np.shape(VVin_brute[i]) # Nombre de donn�es et tailles
-        VVin_brute[i] = VVin_brute[i].reshape(NdonV,1,pixlinV,pixcinV)
-    for i in np.arange(NvarOut) : # Val Out       
-        NoutV, pixloutV, pixcoutV = np.shape(VVout_brute[i])
-        VVout_brute[i] = VVout_brute[i].reshape(NdonV,1,pixloutV,pixcoutV)
-    if NdonV != NoutV :
-        raise ValueError("Probl�me V") # ce n'est pas suffisant
-
-#======================================================================
-#                   CODIFICATION / NORMALISATION
-#======================================================================
-print("# Codification / Normalisation")
-# PLM, CE DOIT ETRE OBLIGATOIRE car la sauvegarde des param�tres n'est 
-# pas faite, Il faut repasser ici pour les recalculer � chaque fois
-VAin = []
-coparmAin = []
-for i in np.arange(NvarIn) :
-    VAin_,  coparmAin_  = codage(VAin_brute[i],  "fit01")
-    print(coparmAin_)
-    VAin.append(VAin_)
-    coparmAin.append(coparmAin_)
-del VAin_, coparmAin_
-x_train = VAin
-NcanIn  = len(x_train)
-#
-VAout = []
-coparmAout = []
-for i in np.arange(NvarOut) :
-    VAout_,  coparmAout_  = codage(VAout_brute[i],  "fit01")
-    print(coparmAout_)
-    VAout.append(VAout_)
-    coparmAout.append(coparmAout_)
-del VAout_, coparmAout_
-y_train = VAout
-NensA   = len(y_train[0])
-
-if TEST_ON : # Il faut appliquer le mï¿½me codage et dans les mï¿½mes conditions
-    # (i.e. avec les mï¿½mes paramï¿½tres) que ceux de l'apprentissage.
-    VTin = []
-    for i in np.arange(NvarIn) :
-        VTin_ = recodage(VTin_brute[i], coparmAin[i])
-        VTin.append(VTin_)
-    del VTin_
-    x_test = VTin
-    #
-    VTout = []
-    for i in np.arange(NvarOut) :
-        VTout_ =  recodage(VTout_brute[i], coparmAout[i])
-        VTout.append(VTout_)
-    del VTout_
-    #
-    y_test = VTout
-    NensT = len(y_test[0])
-
-if VALID_ON : # Il faut appliquer le mï¿½me codage et dans les mï¿½mes conditions
-    # (i.e. avec les mï¿½mes paramï¿½tre) que ceux de l'apprntissage.
-    VVin = []
-    for i in np.arange(NvarIn) :
-        VVin_ = recodage(VVin_brute[i], coparmAin[i])
-        VVin.append(VVin_)
-    del VVin_
-    x_valid = VVin
-    #
-    VVout = []
-    for i in np.arange(NvarOut) :
-        VVout_ =  recodage(VVout_brute[i], coparmAout[i])
-        VVout.append(VVout_)
-    del VVout_
-    #
-    y_valid = VVout
-    NensV   = len(y_valid[0])
-
-
+# Lecture, repartition App/Val/Test et codage des données, ou attachement sans
+# copie aux données du scenario publiées en memoire partagée par resacserver.py
+scenario = get_resac_scenario(varIn,varOut,ResoIn,ResoOut)
+x_train, y_train = scenario['x_train'], scenario['y_train']
+x_valid, y_valid = scenario['x_valid'], scenario['y_valid']
+x_test,  y_test  = scenario['x_test'],  scenario['y_test']
+VAout_brute, VVout_brute, VTout_brute = scenario['VAout_brute'], scenario['VVout_brute'], scenario['VTout_brute']
+coparmAin, coparmAout = scenario['coparmAin'], scenario['coparmAout']
+NcanIn = len(x_train)
+NensA, NensV, NensT = len(y_train[0]), len(y_valid[0]), len(y_test[0])
 
 # POUR AVOIR CHANEL LAST, en Linux dans ~/.keras/keras.json
 # Windowd c:/Users/charles/.keras/keras.json
+# x_* et y_* du scenario sont deja en (N,H,W,1) (codage_nhwc)
 #y_test_brute=[]
 #y_train_brute=[]
-for i in np.arange(NvarIn):
-    x_train[i] = x_train[i].transpose(0,2,3,1)
-    x_valid[i] = x_valid[i].transpose(0,2,3,1)
-    x_test[i] = x_test[i].transpose(0,2,3,1)
-for i in np.arange(NvarOut):
-    y_train[i] = y_train[i].transpose(0,2,3,1)
-    y_valid[i] = y_valid[i].transpose(0,2,3,1)
-    y_test[i] = y_test[i].transpose(0,2,3,1)
 #    y_test_brute.append( VTout_brute[i].transpose(0,2,3,1))
 #    y_train_brute.append(VAout_brute[i].transpose(0,2,3,1))
 
@@ -411,10 +226,11 @@ def fit_with(nc, nl, function, lr):
     # Train the model for a specified number of epochs.
   optimizer = optimizers.Adam(learning_rate=2*(10**lr))
   model.compile(loss='logcosh',
-                optimizer=optimizer)
+                optimizer=optimizer,
+                **jit_compile_kwargs())
 # Train the model with the train dataset.
-  H = model.fit(x_train, y_train, epochs=Niter,batch_size=Bsize, 
-            shuffle=True, verbose=2)#, validation_data=(x_valid, y_valid))
+  H = model.fit(**resac_fit_data(x_train, y_train, Bsize), epochs=Niter,
+            verbose=2)#, validation_data=(x_valid, y_valid))
   return  -min(H.history['loss'])
 
 fit_with_partial = partial(fit_with)
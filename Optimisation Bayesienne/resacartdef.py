@@ -6,6 +6,96 @@
  Librerie de fonctions de ResacNet.
 
  Historique:
+    2026-10-18 ResacNet - LossHistory.remove tolerates missing files and tells whether it
+                          removed any, instead of raising FileNotFoundError.
+    2026-10-18 ResacNet - temporal_frames fills the days before the first filled day with it
+                          (uninitialised border frames); windows across sets documented.
+    2026-10-18 ResacNet - codage passes gap01 to fit01 on both the streaming and the in-memory
+                          paths (it was ignored); stats_coparm and codage_stream take gap01.
+    2026-10-18 ResacNet - load_resac_by_var_and_resol keeps memory-mapped or chunked arrays of
+                          another type lazy (IndexedSet converting to dtype on read).
+    2026-10-18 ResacNet - the data catalog is no longer part of the scenario cache fingerprint
+                          (rewritten by every load, derived from the fingerprinted data files).
+    2026-10-18 ResacNet - the scenario cache fingerprint includes the R01 .chunks folders read
+                          by load_resac_data (chunked) and the folders' own size and mtime.
+    2026-10-18 ResacNet - XLA_JIT_COMPILE defaults to None: jit_compile is passed to compile
+                          only when set (jit_compile_kwargs), keeping the Keras default.
+    2026-10-18 ResacNet - adding orthogonal_index: lat/lon index arrays of non monotonic
+                          coordinates are applied axis by axis (sub-grid, as np.ix_).
+    2026-10-18 ResacNet - adding WindowedNoise: input noise of temporal windows drawn per day;
+                          input_noises builds nothing when the noise sigma is 0.
+    2026-10-18 ResacNet - multi-file checkpoints of BackgroundModelCheckpoint replace their
+                          own files one by one (replace_files), not the whole folder.
+    2026-10-18 ResacNet - adding set_jit_compile (XLA compiled steps, XLA_JIT_COMPILE); model
+                          copies (validation, export) keep the jit_compile of the model.
+    2026-10-18 ResacNet - adding ResacValidation, validation_setup and valid_subset: validation
+                          every VALID_FREQ epochs on VALID_SUBSET samples, in background
+                          on a weights snapshot (VALID_BACKGROUND).
+    2026-10-18 ResacNet - adding CheckpointWriter (background writes, atomic rename),
+                          BackgroundModelCheckpoint, save_model_background and torch_snapshot.
+    2026-10-18 ResacNet - LossHistory appends one JSON line per epoch from a writer thread
+                          and compacts the pickle at the end (load_history, compact_history).
+    2026-10-18 ResacNet - adding resac_tf_dataset (tf.data pipeline: parallel gather,
+                          prefetch, optional cache) and resac_fit_data (USE_TF_DATA).
+    2026-10-18 ResacNet - adding WindowedSet, temporal_frames and windowed_sets (and
+                          WindowedTensorSet for PyTorch): sliding temporal windows
+                          (TIME_WINDOW) as strided views, without copies.
+    2026-10-18 ResacNet - adding the scenario cache: save_scenario_cache, load_scenario_cache
+                          (mmap), resac_cache_key and source_fingerprint, used by
+                          get_resac_scenario and resacart.py (USE_SCENARIO_CACHE).
+    2026-10-18 ResacNet - adding CorrelatedNoise and input_noises: spatially correlated
+                          noise (covariance model or spectrum) by batched FFT
+                          filtering (NOISE_CORR_LENGTH, NOISE_COVARIANCE).
+    2026-10-18 ResacNet - adding sample_noise, add_sample_noise, noise_sigmas and
+                          NoisyBatchSequence: noise drawn per batch, keyed by
+                          (seed, sample index, epoch) (TRAIN_NOISE_SIGMA).
+    2026-10-18 ResacNet - adding coparm_affine, CodageLayer and model_with_codage (Keras),
+                          CodageModule and ResacWithCodage (PyTorch): encoding and
+                          decoding layers inside the model, from coparm.
+    2026-10-18 ResacNet - adding codage_nhwc and encode_into: in place encoding, by
+                          blocks, into preallocated float32 channel last buffers
+                          (resacart.py, prepare_resac_scenario).
+    2026-10-18 ResacNet - adding StreamStats, stream_stats, stats_coparm and
+                          codage_stream: one pass chunked statistics giving the
+                          coparm of codage, then encoding by blocks (CODAGE_STREAM).
+    2026-10-18 ResacNet - adding IndexedSet, App/Val/Test sets as views (variable
+                          array + isetalea indices) in data_repartition and
+                          splitset (DATA_SET_VIEWS), images gathered on use.
+    2026-10-18 ResacNet - adding setresolution_couples: each (Variable, Resolution)
+                          couple made once on the whole Time axis, before the
+                          App/Val/Test split. setresolution makes a couple
+                          shared by varIn and varOut only once.
+    2026-10-18 ResacNet - adding block_reduce: block mean, nanmean, min, max and std
+                          with explicit edge handling and bounded time chunks
+                          (BLOCK_REDUCE_TIME_CHUNK). makemoy and showquivmask use it.
+    2026-10-18 ResacNet - adding ingest_netcdf (with NetcdfVarReader): NATL60 NetCDF
+                          outputs read by time blocks into the R01 and lower
+                          resolution .npy and coords files in one pass.
+    2026-10-18 ResacNet - adding a shared memory scenario server: prepare_resac_scenario
+                          (read, split and codage common to the training scripts),
+                          publish/attach/get/serve_resac_scenario (USE_SHARED_DATA).
+    2026-10-18 ResacNet - single precision data path: DATA_DTYPE ('float32') carried by
+                          the loaders, makemoy, codage, data_repartition, setresolution
+                          and setresult. Adding convert_npy_dtype.
+    2026-10-18 ResacNet - vectorised makemoy. Adding build_resac_pyramid, a persistent
+                          cache of the lower resolutions of the big R01 npz, used
+                          by load_resac_data_by_var_and_resol (LOAD_DATA_PYRAMID_CACHE).
+    2026-10-18 ResacNet - adding ResacCatalog, a persistent datasets catalog
+                          (RESAC_CATALOG_FILE) used by the loaders and
+                          get_real_lat_lon_limits, caching build_all_resol_dic.
+    2026-10-18 ResacNet - parallel loading of the (Variable, Resolution) couples in
+                          load_resac_by_var_and_resol (LOAD_DATA_NB_WORKERS).
+    2026-10-18 ResacNet - selection pushdown: zone/lat/lon and Time limits are
+                          turned into index slices (select_index_by_coords,
+                          index_pattern_to_slice) before reading the data.
+    2026-10-18 ResacNet - adding NpzArrayReader and load_resac_data_by_var_and_resol
+                          streaming the big R01 npz one variable and time block at a
+                          time. Fixing lon_border in build_all_resol_dic.
+    2026-10-18 ResacNet - adding chunked storage (ChunkedArray, convert_npy_to_chunked)
+                          and chunked option to load_resac_by_var_and_resol and
+                          load_resac_data.
+    2026-10-18 ResacNet - adding mmap_mode option (LOAD_DATA_MMAP_MODE in
+                          resacartparm.py) to load_resac_by_var_and_resol.
     2021-06-06 ResacNet - Changing scatplot() function in resacartdef.py for
                           bug corrections. Correcting axis limits when plotting
                           identity diagonal. Controling axis limits.
@@ -18,9 +108,19 @@
 from __future__ import print_function
 import os
 import sys
+import copy
 import pickle
 import random
 import math
+import json
+import itertools
+import zipfile
+import hashlib
+import shutil
+import threading
+import signal
+from   concurrent.futures import ThreadPoolExecutor
+from   multiprocessing import shared_memory, resource_tracker
 from   time  import time
 import numpy as     np
 import matplotlib as mpl #see: ../matplotlib/rcsetup.py
@@ -29,17 +129,33 @@ from   matplotlib import cm
 import matplotlib.colorbar as cb
 from   matplotlib.colors import LogNorm
 from   scipy.stats import norm
+import scipy.fft
 from   resacartparm import *
 #
 
 if KERASBYTENSORFLOW :  
     
     from tensorflow.keras.callbacks import Callback
+    from tensorflow.keras.layers import Layer, Input
+    from tensorflow.keras.models import Model, clone_model
+    from tensorflow.keras.utils import get_custom_objects, Sequence
 else:
     if PLAIDMLKERASBACKEND :  # backend pour cartes graphiques non NVIDIA
         os.environ["KERAS_BACKEND"] = "plaidml.keras.backend"
     #
     from keras.callbacks import Callback
+    from keras.layers import Layer, Input
+    from keras.models import Model, clone_model
+    from keras.utils.generic_utils import get_custom_objects
+    from keras.utils import Sequence
+try : # PyTorch est optionnel (scripts de Sigma/PyTorch): CodageModule, ResacWithCodage
+    import torch
+except ImportError :
+    torch = None
+try : # pipeline tf.data (resac_tf_dataset, USE_TF_DATA)
+    import tensorflow as tf
+except ImportError :
+    tf = None
 
 #
 #=====================================================================
@@ -131,7 +247,7 @@ def build_all_resol_dic(dic_r1, all_r, native_resol=1) :
                 elif k == 'lat_border':
                     diccoordtmp[k] = lat_border_r
                 elif k == 'lon_border':
-                    diccoordtmp[k] = lat_border_r
+                    diccoordtmp[k] = lon_border_r
                 else:
                     diccoordtmp[k] = dic_r1[k]
             dico_all_r[f'R{r:02d}'] = diccoordtmp
@@ -155,66 +271,118 @@ def build_lower_resol_vectors(lat, lon, r, borders=False):
         return lat_rLow, lon_rLow
 #
 def select_data_by_dim_by_list(data, set_of_index, dim_axis=0):
-    if dim_axis == 0:
-        data = data[set_of_index]
-    elif dim_axis == 1:
-        data = data[:,set_of_index]
-    elif dim_axis == 2:
-        data = data[:,:,set_of_index]
-    elif dim_axis == 3:
-        data = data[:,:,:,set_of_index]
-    elif dim_axis == 4:
-        data = data[:,:,:,:,set_of_index]
-    else:
-        assert False, f'Invalid dimension index: {dim_axis}. Edit this function to allow it'
+    # set_of_index: slice, liste/array d'indices ou de booleens. Avec une slice
+    # l'indexation est "basique": on obtient une vue (np.ndarray, np.memmap)
+    # ou une lecture partielle (ChunkedArray) au lieu d'une copie.
+    if dim_axis < 0 or dim_axis >= np.ndim(data) :
+        assert False, f'Invalid dimension index: {dim_axis}'
+    data = data[(slice(None),)*dim_axis + (set_of_index,)]
     #
     return data
 #
+def index_pattern_to_slice(index_pattern, dim_len, dim_axis=0):
+    ''' Convertit un schema d'indices, index initial et pas (i0, step), ou
+        seulement le pas (step, i0 vaut alors 0), en slice(i0, None, step)
+        pour une dimension de longueur dim_len.
+    '''
+    if np.isscalar(index_pattern):
+        i0, step = 0, index_pattern
+    elif len(index_pattern) == 2:
+        i0, step = index_pattern
+    else:
+        assert False, f'Invalid index pattern for dimension: {dim_axis}: {index_pattern}'
+    if i0 < 0 or step < 1 or i0 >= dim_len :
+        assert False, f'Invalid i0 or step for dimension: {dim_axis}'
+    #
+    return slice(int(i0), None, int(step))
+#
 def select_data_by_dim(data, index_pattern, dim_lbl=None, dim_axis=0):
-    if np.isscalar(index_pattern) or len(index_pattern) == 2:
-        if np.isscalar(index_pattern):
-            i0, step = 0, index_pattern
-        else:
-            i0, step = index_pattern
-        if i0 >= 0 and step > 1 :
-            list_of_index = np.arange(i0,data.shape[dim_axis],step)
-            data = select_data_by_dim_by_list(data, list_of_index, dim_axis=dim_axis)
-            if dim_lbl is not None :
-                new_dim_lbl = dim_lbl[list_of_index]
-
-        elif i0 < 0 or step < 0 or (i0 + step) > data.shape[dim_axis] :
-            assert False, f'Invalid i0 or step for dimension: {dim_axis}'
-        else:
-            # vraisemblamblement index_pattern est (0, 1) alors, rien ne change
-            if dim_lbl is not None :
-                new_dim_lbl = dim_lbl
+    isel = index_pattern_to_slice(index_pattern, data.shape[dim_axis], dim_axis=dim_axis)
+    data = select_data_by_dim_by_list(data, isel, dim_axis=dim_axis)
     #
     if dim_lbl is None :
         return data
     else:
-        return data, new_dim_lbl
+        return data, dim_lbl[isel]
 #
-def select_by_coords(data, dim_dic, lat_limits=None, lon_limits=None,
-                     lat_axis=1, lon_axis=2, epsilon=1e-4):
+def coord_limits_to_index(coord, border, vmin=None, vmax=None):
+    ''' Indices des bords (border) compris dans [vmin, vmax] puis des centres
+        (coord) strictement a l'interieur de ces bords. Si l'une des limites
+        est None alors c'est le bout dans ce sens.
+
+        Pour des coordonnees croissantes (cas normal) les bornes sont trouvees
+        par recherche binaire (np.searchsorted) et retournees en slices, ce qui
+        permet une lecture du seul hyperslab selectionne. Sinon on se rabat
+        sur des masques (tableaux d'indices).
+
+        Retourne (index des bords, index des centres).
+    '''
+    if np.all(np.diff(border) > 0) and np.all(np.diff(coord) > 0) :
+        b0 = 0 if vmin is None else int(np.searchsorted(border, vmin, side='left'))
+        b1 = len(border) if vmax is None else int(np.searchsorted(border, vmax, side='right'))
+        if b1 <= b0 :
+            return slice(b0, b0), slice(0, 0)
+        c0 = int(np.searchsorted(coord, border[b0], side='right'))
+        c1 = int(np.searchsorted(coord, border[b1-1], side='left'))
+        return slice(b0, b1), slice(c0, max(c0, c1))
+    #
+    bool_border = np.ones(len(border), dtype=bool)
+    if vmin is not None :
+        bool_border &= border >= vmin
+    if vmax is not None :
+        bool_border &= border <= vmax
+    sel_border = border[bool_border]
+    if len(sel_border) == 0 :
+        return np.nonzero(bool_border)[0], np.array([], dtype=int)
+    bool_coord = (coord > sel_border.min()) & (coord < sel_border.max())
+    #
+    return np.nonzero(bool_border)[0], np.nonzero(bool_coord)[0]
+#
+def orthogonal_index(data, isel):
+    ''' data[isel] pour isel un index par axe (slices ou tableaux d'indices,
+        voir coord_limits_to_index) appliqués axe par axe (indexation
+        orthogonale, comme np.ix_): numpy broadcasterait ensemble plusieurs
+        tableaux d'indices (diagonale ou erreur au lieu de la sous grille).
+        Les tableaux sont d'abord remplacés par leur slice englobante, seul
+        l'hyperslab utile est lu (np.memmap, ChunkedArray), puis appliqués
+        un axe a la fois.
+    '''
+    isel = list(isel)
+    if sum(not isinstance(k, slice) for k in isel) <= 1 :
+        return data[tuple(isel)]
+    box = []; take = []
+    for axis,k in enumerate(isel) :
+        if isinstance(k, slice) :
+            box.append(k)
+            continue
+        k = np.asarray(k, dtype=int)
+        k0, k1 = (int(k.min()), int(k.max())+1) if len(k) > 0 else (0, 0)
+        box.append(slice(k0, k1))
+        take.append((axis, k - k0))
+    data = np.asarray(data[tuple(box)])
+    for axis,k in take :
+        data = np.take(data, k, axis=axis)
+    return data
+#
+def select_index_by_coords(dim_dic, lat_limits=None, lon_limits=None, epsilon=1e-4):
+    ''' Comme select_by_coords() mais sans toucher aux donnees: met a jour
+        les coordonnees de dim_dic ('lat', 'lon', 'lat_border', 'lon_border')
+        et retourne les index (slices pour des coordonnees croissantes) a
+        appliquer aux axes lat et lon des donnees.
+
+        Retourne (index lat, index lon, dim_dic).
+    '''
+    ilat = slice(None); ilon = slice(None)
     if lat_limits is not None :
         latmin,latmax = lat_limits
         if latmin is not None :
             latmin -= epsilon
         if latmax is not None :
             latmax += epsilon
-        lat_limits = latmin,latmax
-        # selectionne lat_border d'abord
-        if latmin is not None and latmax is not None :
-            bool_lat_border = [d >= latmin and d <= latmax for d in dim_dic['lat_border']]
-        elif latmin is not None :
-            bool_lat_border = dim_dic['lat_border'] >= latmin
-        elif latmax is not None :
-            bool_lat_border = dim_dic['lat_border'] <= latmax
-        dim_dic['lat_border'] = dim_dic['lat_border'][bool_lat_border]
-        # selectionne ensuite lat selon les limites de lat_border
-        bool_lat = [d > min(dim_dic['lat_border']) and d < max(dim_dic['lat_border']) for d in dim_dic['lat'] ]
-        dim_dic['lat'] = dim_dic['lat'][bool_lat]
-        data = select_data_by_dim_by_list(data, bool_lat, dim_axis=lat_axis)
+        # selectionne lat_border d'abord, puis lat selon les limites de lat_border
+        iborder, ilat = coord_limits_to_index(dim_dic['lat'], dim_dic['lat_border'], latmin, latmax)
+        dim_dic['lat_border'] = dim_dic['lat_border'][iborder]
+        dim_dic['lat'] = dim_dic['lat'][ilat]
     #
     if lon_limits is not None :
         lonmin,lonmax = lon_limits
@@ -222,25 +390,37 @@ def select_by_coords(data, dim_dic, lat_limits=None, lon_limits=None,
             lonmin -= epsilon
         if lonmax is not None :
             lonmax += epsilon
-        lon_limits = lonmin,lonmax
-        # selectionne lon_border d'abord
-        if lonmin is not None and lonmax is not None :
-            bool_lon_border = [d >= lonmin and d <= lonmax for d in dim_dic['lon_border']]
-        elif lonmin is not None :
-            bool_lon_border = dim_dic['lon_border'] >= lonmin
-        elif lonmax is not None :
-            bool_lon_border = dim_dic['lon_border'] <= lonmax
-        dim_dic['lon_border'] = dim_dic['lon_border'][bool_lon_border]
-        # selectionne ensuite lon selon les limites de lon_border
-        bool_lon = [d > min(dim_dic['lon_border']) and d < max(dim_dic['lon_border']) for d in dim_dic['lon'] ]
-        dim_dic['lon'] = dim_dic['lon'][bool_lon]
-        data = select_data_by_dim_by_list(data, bool_lon, dim_axis=lon_axis)
-            
+        # selectionne lon_border d'abord, puis lon selon les limites de lon_border
+        iborder, ilon = coord_limits_to_index(dim_dic['lon'], dim_dic['lon_border'], lonmin, lonmax)
+        dim_dic['lon_border'] = dim_dic['lon_border'][iborder]
+        dim_dic['lon'] = dim_dic['lon'][ilon]
+    #
+    return ilat, ilon, dim_dic
+#
+def select_by_coords(data, dim_dic, lat_limits=None, lon_limits=None,
+                     lat_axis=1, lon_axis=2, epsilon=1e-4):
+    ilat, ilon, dim_dic = select_index_by_coords(dim_dic, lat_limits=lat_limits,
+                                                 lon_limits=lon_limits, epsilon=epsilon)
+    if lat_limits is not None :
+        data = select_data_by_dim_by_list(data, ilat, dim_axis=lat_axis)
+    if lon_limits is not None :
+        data = select_data_by_dim_by_list(data, ilon, dim_axis=lon_axis)
+    #
     return  data, dim_dic
 #
 #----------------------------------------------------------------------
 def get_real_lat_lon_limits(lat_list, lon_list, zone=None, 
-                            lat_limits=None, lon_limits=None, verbose=False):
+                            lat_limits=None, lon_limits=None, verbose=False,
+                            catalog=None, reso=None, subdir='NATL60byVar',
+                            data_prefix='NATL60', data_suffix=''):
+    # lat_list et lon_list (bords des pixels) peuvent etre pris du catalogue
+    # (ResacCatalog) pour la resolution reso
+    if lat_list is None or lon_list is None :
+        dico_dim = catalog.coords(reso, subdir=subdir, data_prefix=data_prefix, data_suffix=data_suffix)
+        if lat_list is None :
+            lat_list = dico_dim['lat_border']
+        if lon_list is None :
+            lon_list = dico_dim['lon_border']
     if zone is not None:
         if zone.lower() in ["north","nord","south","sud"] :
             # convert l'option ZONE North ou South en option LAT [LMin, LMax]
@@ -295,6 +475,20 @@ def get_zonelatlon_label(zone=None, lat_limits=None, lon_limits=None):
 #======================================================================
 # D�finitions
 #----------------------------------------------------------------------
+def as_data_dtype(X, dtype=DATA_DTYPE) :
+    # X dans le type des données (DATA_DTYPE de resacartparm.py), sans copie
+    # s'il l'est deja. dtype=None laisse X tel quel.
+    if dtype is None :
+        return X
+    return np.asarray(X).astype(dtype, copy=False)
+#
+def scalar_as(x, X) :
+    # scalaire x (parametre de codage) dans le type flottant de X pour que
+    # les operations avec X ne le promeuvent pas en float64
+    if np.issubdtype(np.asarray(X).dtype, np.floating) :
+        return np.asarray(X).dtype.type(x)
+    return x
+#----------------------------------------------------------------------
 def fit01(X, gap01=0.0, coparm=None, verbose=False) : 
     ''' Ram�ne les valeurs de X dans l'intervalle [0, 1] + gap01
         On retourne les valeurs (d=max(X)-min(X) et min(X/d) qui
@@ -318,6 +512,7 @@ def fit01(X, gap01=0.0, coparm=None, verbose=False) :
         return Y, coparm
     elif coparm[0] == "fit01" :
         nom,miny,deltax,gap01 = coparm
+        miny,deltax,gap01 = scalar_as(miny,X), scalar_as(deltax,X), scalar_as(gap01,X)
         Y = X / deltax;
         Y = Y - miny;
         Y = Y + gap01;
@@ -331,6 +526,7 @@ def inv_fit01(Y,coparm) :
     miny et d sont les param�tres qui ont �t� retourn�s par fit01.
     '''
     miny,d,gap01 = coparm[1:];
+    miny,d,gap01 = scalar_as(miny,Y), scalar_as(d,Y), scalar_as(gap01,Y)
     #
     Y = Y - gap01;
     Y = Y + miny
@@ -362,8 +558,9 @@ def centrereduc(X, coparm=None, verbose=False) :
         print("       CENTREREDUC -> size: %s:\n   n,min/Max/mean/std Avant: "%(','.join(str(x) for x in X.shape)),
               X.min(),X.max(),X.mean(),X.std())
     if coparm is None :
-        mean = np.mean(X);
-        std = np.std(X)
+        # statistiques accumulées en float64, appliquées dans le type de X
+        mean = scalar_as(np.mean(X, dtype=np.float64), X);
+        std = scalar_as(np.std(X, dtype=np.float64), X)
         Y = (X - mean) / std;
         coparm = ("cenred", mean, std);
         if verbose:
@@ -371,7 +568,7 @@ def centrereduc(X, coparm=None, verbose=False) :
         return Y, coparm
     elif coparm[0] == "cenred" :
         nom, mean, std = coparm
-        Y = (X - mean) / std;
+        Y = (X - scalar_as(mean,X)) / scalar_as(std,X);
         return Y
     else:
         print(f" ** centrereduc: nom de codage '{coparm[0]}' inattendu. Devrait etre 'cenred' ...")
@@ -382,20 +579,174 @@ def decentrereduc(Y,coparm) :
     miny et d sont les param�tres qui ont �t� retourn�s par fit01.
     '''
     nom,mean,std = coparm;
-    X = (Y * std) + mean;
+    X = (Y * scalar_as(std,Y)) + scalar_as(mean,Y);
     return X
 #----------------------------------------------------------------------
-def codage(X,CODAGE,gap01=0.0, verbose=False) : 
+class StreamStats(object):
+    ''' Statistiques de base (n, min, max, moyenne, variance) accumulées en
+        une seule passe, bloc par bloc (update), sans garder les données: les
+        moyenne et variance de chaque bloc (en float64) sont combinées a
+        celles deja accumulées (Welford, forme par blocs de Chan et al.).
+
+        Exemple d'usage:
+            stats = stream_stats(X)                  # X: array, np.memmap, IndexedSet, ...
+            coparm = stats_coparm(stats, "fit01")    # = codage(X, "fit01")[1]
+    '''
+    def __init__(self) :
+        self.n     = 0
+        self.mean  = 0.0
+        self.m2    = 0.0  # somme des carres des ecarts a la moyenne
+        self.min   = None
+        self.max   = None
+        self.dtype = None
+
+    def update(self, X) :
+        X = np.asarray(X)
+        if X.size == 0 :
+            return self
+        n_b    = X.size
+        mean_b = np.mean(X, dtype=np.float64)
+        m2_b   = np.sum(np.square(X - mean_b, dtype=np.float64))
+        min_b, max_b = np.min(X), np.max(X)
+        if self.n == 0 :
+            self.mean, self.m2, self.min, self.max, self.dtype = mean_b, m2_b, min_b, max_b, X.dtype
+        else:
+            delta     = mean_b - self.mean
+            n         = self.n + n_b
+            self.mean = self.mean + delta * n_b / n
+            self.m2   = self.m2 + m2_b + delta**2 * self.n * n_b / n
+            self.min, self.max = np.minimum(self.min, min_b), np.maximum(self.max, max_b)
+        self.n += n_b
+        return self
+
+    @property
+    def var(self) :
+        return self.m2 / self.n
+
+    @property
+    def std(self) :
+        return np.sqrt(self.var)
+#
+def stream_stats(X, time_chunk=CODAGE_TIME_CHUNK) :
+    # StreamStats de X (array, np.memmap, IndexedSet, ChunkedArray, ...) lu
+    # par blocs de time_chunk elements du premier axe
+    stats = StreamStats()
+    for t0 in np.arange(0, len(X), time_chunk) :
+        stats.update(X[t0:t0+time_chunk])
+    return stats
+#
+def stats_coparm(stats, CODAGE, gap01=0.0) :
+    ''' Parametres de codage (coparm) de CODAGE ("fit01", "cenred" ou
+        "cr+fit01") depuis les statistiques (StreamStats) des données, les
+        memes que ceux de codage() sur les données completes: le min d'une
+        transformation croissante (X/d, (X-m)/s) est la transformation du min.
+        gap01 est le decalage de [0, 1] de fit01 (ignoré par "cenred").
+    '''
+    a, b = stats.min, stats.max  # dans le type des données
+    if CODAGE=="fit01" :
+        deltax = b-a;
+        miny = a / deltax
+        return ("fit01", miny, deltax, gap01)
+    mean = scalar_as(stats.mean, a)
+    std  = scalar_as(stats.std, a)
+    if CODAGE=="cenred" :
+        return ("cenred", mean, std)
+    elif CODAGE=="cr+fit01" :
+        mincr, maxcr = (a - mean) / std, (b - mean) / std
+        d_f01 = maxcr - mincr
+        return ("cr+fit01", mean, std, mincr / d_f01, d_f01, gap01)
+    raise ValueError(f"codage: bad code: '{CODAGE}'");
+#
+def recodage_stream(X, coparm, time_chunk=CODAGE_TIME_CHUNK, out=None) :
+    # recodage de X par blocs de time_chunk elements du premier axe, ecrits
+    # dans out (alloué au premier bloc si None): les temporaires du codage
+    # n'ont que la taille d'un bloc
+    for t0 in np.arange(0, len(X), time_chunk) :
+        Y = recodage(X[t0:t0+time_chunk], coparm, stream=False)
+        if out is None :
+            out = np.empty((len(X),)+Y.shape[1:], dtype=Y.dtype)
+        out[t0:t0+len(Y)] = Y
+    return out
+#
+def codage_stream(X, CODAGE, gap01=0.0, verbose=False, time_chunk=CODAGE_TIME_CHUNK, out=None) :
+    ''' codage en deux passes sur X (array, np.memmap, IndexedSet, ...), lu par
+        blocs de time_chunk elements: statistiques (stream_stats) puis codage
+        bloc par bloc (recodage_stream) dans out. Memoire de travail bornée
+        par un bloc, en plus du resultat.
+    '''
+    stats  = stream_stats(X, time_chunk)
+    coparm = stats_coparm(stats, CODAGE, gap01)
+    if verbose:
+        print(f"     CODAGE (stream, {CODAGE}): n,min/Max/mean/std Avant: ",
+              stats.n, stats.min, stats.max, stats.mean, stats.std)
+        print("    ", coparm)
+    return recodage_stream(X, coparm, time_chunk, out), coparm
+#
+def encode_into(X, coparm, out) :
+    # codage (coparm) de X ecrit dans out par operations en place, dans le
+    # meme ordre que recodage: pas d'autre temporaire que out
+    CODAGE = coparm[0]
+    if CODAGE=="fit01" :
+        nom, miny, deltax, gap01 = coparm
+        np.divide(X, scalar_as(deltax,out), out=out)
+        out -= scalar_as(miny,out); out += scalar_as(gap01,out)
+    elif CODAGE=="cenred" :
+        nom, mean, std = coparm
+        np.subtract(X, scalar_as(mean,out), out=out)
+        out /= scalar_as(std,out)
+    elif CODAGE=="cr+fit01" :
+        nom, mn_cr, st_cr, miny_f01, d_f01, gap01_f01 = coparm
+        np.subtract(X, scalar_as(mn_cr,out), out=out)
+        out /= scalar_as(st_cr,out)
+        out /= scalar_as(d_f01,out); out -= scalar_as(miny_f01,out); out += scalar_as(gap01_f01,out)
+    else :
+        raise ValueError("recodage: code %s is unknown"%CODAGE);
+    return out
+#
+def codage_nhwc(X, CODAGE=None, coparm=None, dtype='float32', time_chunk=CODAGE_TIME_CHUNK, out=None) :
+    """
+    Exemple d'usage:
+        x_train_i, coparm_i = codage_nhwc(VAin_brute[i], "fit01")
+        x_valid_i = codage_nhwc(VVin_brute[i], coparm=coparm_i)
+
+    Codage et mise en forme channel last en une passe: X ((N,H,W) ou
+    (N,1,H,W): array, np.memmap, IndexedSet, ...) est lu par blocs de
+    time_chunk images et codé en place (encode_into) directement dans un
+    buffer (N,H,W,1) de type dtype préalloué (ou out), au lieu de codage
+    puis transpose(0,2,3,1) et de leurs copies completes.
+
+    Avec CODAGE les parametres sont calculés d'abord en une passe
+    (stream_stats, stats_coparm) et on retourne (buffer, coparm); avec
+    coparm (ensembles de Val et de Test) on ne retourne que le buffer.
+    """
+    N = len(X)
+    NL, NC = X.shape[-2:]
+    if out is None :
+        out = np.empty((N,NL,NC,1), dtype=dtype)
+    new_coparm = coparm is None
+    if new_coparm :
+        coparm = stats_coparm(stream_stats(X, time_chunk), CODAGE)
+    for t0 in np.arange(0, N, time_chunk) :
+        bloc = np.asarray(X[t0:t0+time_chunk]).reshape(-1,NL,NC)
+        encode_into(bloc, coparm, out[t0:t0+len(bloc),:,:,0])
+    if new_coparm :
+        return out, coparm
+    return out
+#----------------------------------------------------------------------
+def codage(X,CODAGE,gap01=0.0, verbose=False, stream=CODAGE_STREAM, time_chunk=CODAGE_TIME_CHUNK) : 
+    if stream : # statistiques et codage par blocs (codage_stream)
+        return codage_stream(X, CODAGE, gap01, verbose=verbose, time_chunk=time_chunk)
+    X = np.asanyarray(X) # une seule lecture des images d'une vue IndexedSet
     if verbose:
         print("     CODAGE:\n")
     if CODAGE=="fit01" :
-        X, coparm = fit01(X, verbose=verbose);
+        X, coparm = fit01(X, gap01=gap01, verbose=verbose);
     elif CODAGE=="cenred" :
         X, coparm = centrereduc(X, verbose=verbose);
     elif CODAGE=="cr+fit01" :
         Xcr, coparm_cr = centrereduc(X, verbose=verbose)
         n_cr, mn_cr, st_cr = coparm_cr
-        X, coparm_f01 = fit01(Xcr, verbose=verbose);
+        X, coparm_f01 = fit01(Xcr, gap01=gap01, verbose=verbose);
         n_f01, miny_f01, d_f01, gap01_f01 = coparm_f01
         coparm = ( "cr+fit01", mn_cr, st_cr, miny_f01, d_f01, gap01_f01) 
     else :
@@ -416,7 +767,10 @@ def decodage(Y,coparm) :
         raise ValueError("decodage: code %s is unknown"%CODAGE);
     return X
 #----------------------------------------------------------------------
-def recodage(X,coparm) :
+def recodage(X,coparm, stream=CODAGE_STREAM, time_chunk=CODAGE_TIME_CHUNK) :
+    if stream : # codage par blocs (recodage_stream)
+        return recodage_stream(X, coparm, time_chunk)
+    X = np.asanyarray(X) # une seule lecture des images d'une vue IndexedSet
     CODAGE = coparm[0];
     if CODAGE=="fit01" :
         X = fit01(X, coparm=coparm);
@@ -454,6 +808,20 @@ def recodage_multivar(Xlist,coparm_list):
         V_ = recodage(X, coparm)
         V.append(V_)
     return V
+def codage_nhwc_multivar(Xlist, codefunc="fit01", verbose=False):
+    # codage_multivar en channel last (N,H,W,1) float32 (codage_nhwc)
+    V = []; coparm_list = []
+    if np.isscalar(codefunc) :
+        codefunc = [codefunc]*len(Xlist)
+    for X,cfunc in zip(Xlist,codefunc):
+        V_, c_= codage_nhwc(X, cfunc)
+        V.append(V_)
+        coparm_list.append(c_)
+        if verbose:
+            print("   ",c_)
+    return V, coparm_list
+def recodage_nhwc_multivar(Xlist,coparm_list):
+    return [codage_nhwc(X, coparm=coparm) for X,coparm in zip(Xlist,coparm_list)]
 def decodage_multivar(Ylist,coparm_list):
     V = []
     for Y,coparm in zip(Ylist,coparm_list):
@@ -461,6 +829,451 @@ def decodage_multivar(Ylist,coparm_list):
         V.append(V_)
     return V
 #
+#----------------------------------------------------------------------
+# Codage dans le modele: couches de codage/decodage initialisées par coparm
+#----------------------------------------------------------------------
+def coparm_affine(coparm, decode=False) :
+    """
+    Exemple d'usage:
+        a, b = coparm_affine(coparmAin[0])              # codage:   Y = a*X + b
+        a, b = coparm_affine(coparmAout[0], decode=True) # decodage: X = a*Y + b
+
+    Les codages "fit01", "cenred" et "cr+fit01" (et leurs inverses) sont
+    affines: coefficients (a, b), calculés en float64 depuis les parametres
+    de codage pour etre appliqués dans le graphe du modele (CodageLayer,
+    CodageModule) au lieu de recodage/decodage sur le host.
+    """
+    CODAGE = coparm[0]
+    if CODAGE=="fit01" :
+        nom, miny, d, gap01 = coparm
+        m, s = 0.0, 1.0
+    elif CODAGE=="cenred" :
+        nom, m, s = coparm
+        miny, d, gap01 = 0.0, 1.0, 0.0
+    elif CODAGE=="cr+fit01" :
+        nom, m, s, miny, d, gap01 = coparm
+    else :
+        raise ValueError("coparm_affine: code %s is unknown"%CODAGE);
+    m, s, miny, d, gap01 = (float(v) for v in (m, s, miny, d, gap01))
+    if decode : # X = ((Y - gap01 + miny) * d) * s + m
+        return d*s, (miny-gap01)*d*s + m
+    # Y = ((X - m) / s) / d - miny + gap01
+    return 1.0/(s*d), gap01 - miny - m/(s*d)
+#
+class CodageLayer(Layer) :
+    ''' Couche Keras de codage (ou de decodage) affine y = a*x + b, a et b
+        donnés par coparm_affine. Sans poids entrainables, elle est sauvée
+        avec le modele (get_config).
+    '''
+    def __init__(self, a=1.0, b=0.0, **kwargs) :
+        super(CodageLayer, self).__init__(**kwargs)
+        self.a, self.b = float(a), float(b)
+
+    def call(self, x) :
+        return x * self.a + self.b
+
+    def get_config(self) :
+        config = super(CodageLayer, self).get_config()
+        config.update({'a': self.a, 'b': self.b})
+        return config
+#
+get_custom_objects().update({'CodageLayer': CodageLayer})
+#
+def model_with_codage(Mdl, coparmIn=None, coparmOut=None) :
+    """
+    Exemple d'usage:
+        MdlPhys = model_with_codage(Mdl, coparmAin, coparmAout)
+        y_phys  = MdlPhys.predict(x_brute) # listes (N,H,W,1) en unités physiques
+
+    Modele Keras qui prend et rend des unités physiques: le codage des
+    entrées (coparmIn) et le decodage des sorties (coparmOut) sont des
+    couches CodageLayer autour de Mdl (poids partagés), la prediction se
+    fait en une passe sur le device, sans recodage/decodage sur le host ni
+    coparm.npy a recharger a part. coparmIn (ou coparmOut) a None laisse les
+    entrées (ou les sorties) codées.
+    """
+    inputs = [Input(shape=tuple(X.shape[1:]), name="phys_"+X.name.split(':')[0]) for X in Mdl.inputs]
+    x = inputs
+    if coparmIn is not None :
+        x = [CodageLayer(*coparm_affine(c))(X) for X,c in zip(x, coparmIn)]
+    out = Mdl(x if len(x) > 1 else x[0])
+    out = list(out) if isinstance(out, (list, tuple)) else [out]
+    if coparmOut is not None :
+        out = [CodageLayer(*coparm_affine(c, decode=True))(Y) for Y,c in zip(out, coparmOut)]
+    return Model(inputs, out if len(out) > 1 else out[0])
+#
+def jit_compile_kwargs(jit_compile=XLA_JIT_COMPILE) :
+    # argument jit_compile de Mdl.compile, seulement s'il est donné: avec None
+    # rien n'est passé et le defaut de Keras ('auto' en Keras 3) est gardé
+    return {} if jit_compile is None else { 'jit_compile': jit_compile }
+#
+def set_jit_compile(Mdl, jit_compile=XLA_JIT_COMPILE) :
+    """
+    Exemple d'usage:
+        Mdl = set_jit_compile(load_model(Mdl2reloadArchi))
+
+    Etapes train, test et predict de Mdl compilées (ou non) par XLA, comme
+    Mdl.compile(..., jit_compile=jit_compile) mais sans recompiler: l'etat de
+    l'optimiseur d'un modele rechargé est gardé. Les fonctions deja tracées
+    sont oubliées, elles le seront a nouveau au prochain fit/predict. Avec
+    jit_compile None le modele est laissé tel quel.
+    """
+    if jit_compile is None :
+        return Mdl
+    Mdl.jit_compile = jit_compile
+    Mdl.train_function = Mdl.test_function = Mdl.predict_function = None
+    return Mdl
+#
+if torch is not None :
+    class CodageModule(torch.nn.Module) :
+        ''' Module PyTorch de codage (ou de decodage, decode=True) affine
+            y = a*x + b de coparm: a et b sont des buffers, ils suivent le
+            modele sur le device (.to(device)) et sont dans son state_dict.
+        '''
+        def __init__(self, coparm, decode=False) :
+            super(CodageModule, self).__init__()
+            a, b = coparm_affine(coparm, decode)
+            self.register_buffer('a', torch.tensor(a, dtype=torch.float32))
+            self.register_buffer('b', torch.tensor(b, dtype=torch.float32))
+
+        def forward(self, x) :
+            return x * self.a + self.b
+    #
+    class ResacWithCodage(torch.nn.Module) :
+        ''' Modele PyTorch (ResacR27, ResacR09, Resac, ...) avec codage des
+            entrées (coparmIn) et decodage des sorties (coparmOut) dans le
+            graphe: model(x) en unités physiques, en une passe sur le device.
+            coparmIn (ou coparmOut) a None laisse les entrées (ou les sorties)
+            codées; une sortie tenseur unique est decodée par coparmOut[0].
+        '''
+        def __init__(self, model, coparmIn=None, coparmOut=None) :
+            super(ResacWithCodage, self).__init__()
+            self.model  = model
+            self.codeIn = torch.nn.ModuleList([CodageModule(c) for c in ([] if coparmIn is None else coparmIn)])
+            self.decodeOut = torch.nn.ModuleList([CodageModule(c, decode=True) for c in ([] if coparmOut is None else coparmOut)])
+
+        def forward(self, x) :
+            if len(self.codeIn) :
+                x = [cod(X) for cod,X in zip(self.codeIn, x)]
+            out = self.model(x)
+            if len(self.decodeOut) :
+                if torch.is_tensor(out) :
+                    out = self.decodeOut[0](out)
+                else :
+                    out = [dec(Y) for dec,Y in zip(self.decodeOut, out)]
+            return out
+#
+#----------------------------------------------------------------------
+# Bruit tiré par echantillon (par batch, sans array de bruit de la taille des ensembles)
+#----------------------------------------------------------------------
+def sample_noise(index, shape, sigma, seed=NOISE_SEED, epoch=None, dtype='float32', out=None) :
+    """
+    Exemple d'usage:
+        noise = sample_noise(idx_batch, x_train[0].shape[1:], 0.05, epoch=epoch)
+
+    Bruit blanc gaussien (N(0, sigma)) de forme shape pour chacun des
+    echantillons d'indices index: celui de l'echantillon i est tiré d'un
+    generateur initialisé par (seed, i), ou (seed, i, epoch): il ne depend ni
+    du batch ni de l'ordre de tirage, un meme run redonne le meme bruit, et
+    chaque epoch a le sien.
+    """
+    index = np.atleast_1d(index)
+    if out is None :
+        out = np.empty((len(index),)+tuple(shape), dtype=dtype)
+    for k,i in enumerate(index) :
+        key = [int(seed), int(i)] if epoch is None else [int(seed), int(i), int(epoch)]
+        np.random.default_rng(key).standard_normal(out=out[k], dtype=out.dtype)
+    out *= scalar_as(sigma, out)
+    return out
+#
+class CorrelatedNoise(object) :
+    """
+    Exemple d'usage:
+        noisefunc = CorrelatedNoise(x_train[0].shape[1:], corr_length=30e3, dx=9*dxR01, dy=9*dyR01)
+        noise = noisefunc(idx_batch, x_train[0].shape[1:], 0.05, epoch=epoch)
+
+    Generateur de bruit gaussien spatialement correlé, stationnaire, pour des
+    images de forme shape ((H,W), (1,H,W) ou (H,W,1)), avec la meme signature
+    que sample_noise (et les memes bruits blancs de depart, par echantillon).
+    Le bruit blanc d'un batch est filtré par FFT (rfft2 sur tout le batch,
+    produit par l'amplitude sqrt(S) du spectre, irfft2): cout de l'ordre de
+    celui du bruit blanc, au lieu d'une convolution par image.
+
+    Le spectre S est donné soit par spectrum (fonction S(k) du nombre d'onde
+    radial k en cycles/m, ou array (Hp,Wp) sur la grille de fft2), soit par la
+    covariance: modele 'gaussian' (exp(-r**2/(2 L**2))) ou 'exponential'
+    (exp(-r/L)) de longueur corr_length L (m), fonction C(r) de la distance r
+    (m), ou array (Hp,Wp) des covariances aux decalages de la grille de fft2.
+    dx, dy sont les pas (m) des pixels. Les images sont generées sur une grille
+    (Hp,Wp) agrandie d'au moins pad pixels (par defaut 3 L) puis recadrées,
+    pour que le bruit ne soit pas periodique. Le filtre est normalisé: variance sigma**2.
+    """
+    def __init__(self, shape, covariance="gaussian", corr_length=None, spectrum=None,
+                 dx=dxR01, dy=dyR01, pad=None) :
+        self.shape = tuple(shape)
+        hw = tuple(n for n in self.shape if n > 1)
+        if len(hw) != 2 :
+            raise ValueError(f"CorrelatedNoise: shape {shape} is not an image shape")
+        self.H, self.W = hw
+        if pad is None :
+            pad = 0 if corr_length is None else int(np.ceil(3*corr_length/min(dx, dy)))
+        # grille agrandie de tailles rapides pour la FFT (petits facteurs premiers)
+        self.Hp = Hp = scipy.fft.next_fast_len(self.H + pad, real=True)
+        self.Wp = Wp = scipy.fft.next_fast_len(self.W + pad, real=True)
+        if spectrum is not None :
+            if callable(spectrum) :
+                ky = np.fft.fftfreq(Hp, d=dy)[:,None]; kx = np.fft.fftfreq(Wp, d=dx)[None,:]
+                with np.errstate(divide='ignore', invalid='ignore') :
+                    S = np.asarray(spectrum(np.sqrt(kx**2 + ky**2)), dtype=np.float64)
+            else :
+                S = np.asarray(spectrum, dtype=np.float64)
+        else :
+            if isinstance(covariance, str) or callable(covariance) :
+                ly = np.fft.fftfreq(Hp, d=1.0/Hp)[:,None]*dy; lx = np.fft.fftfreq(Wp, d=1.0/Wp)[None,:]*dx
+                r = np.sqrt(lx**2 + ly**2)
+                if covariance=="gaussian" :
+                    C = np.exp(-r**2/(2.0*corr_length**2))
+                elif covariance=="exponential" :
+                    C = np.exp(-r/corr_length)
+                elif callable(covariance) :
+                    C = np.asarray(covariance(r), dtype=np.float64)
+                else :
+                    raise ValueError(f"CorrelatedNoise: bad covariance model: '{covariance}'")
+            else :
+                C = np.asarray(covariance, dtype=np.float64)
+            S = np.fft.fft2(C).real
+        if S.shape != (Hp, Wp) :
+            raise ValueError(f"CorrelatedNoise: spectrum or covariance of shape {S.shape} instead of {(Hp, Wp)}")
+        S = np.where(np.isfinite(S) & (S > 0), S, 0.0) # spectre d'une covariance periodisée: >= 0
+        A = np.sqrt(S / np.mean(S))                     # variance du bruit filtré: mean(A**2) = 1
+        self.amplitude = A[:, :Wp//2+1].astype(np.float32)
+
+    def __call__(self, index, shape, sigma, seed=NOISE_SEED, epoch=None, dtype='float32', out=None) :
+        Hp, Wp = self.Hp, self.Wp
+        white = sample_noise(index, (Hp, Wp), 1.0, seed, epoch, dtype=np.float32)
+        F = scipy.fft.rfft2(white, axes=(-2,-1), workers=-1)
+        F *= self.amplitude
+        noise = scipy.fft.irfft2(F, s=(Hp, Wp), axes=(-2,-1), workers=-1, overwrite_x=True)[:, :self.H, :self.W]
+        if out is None :
+            out = np.empty((len(noise),)+tuple(shape), dtype=dtype)
+        out[...] = noise.reshape(out.shape)
+        out *= scalar_as(sigma, out)
+        return out
+#
+class WindowedNoise(object) :
+    ''' Bruit des entrées en fenetres temporelles (WindowedSet (N,H,W,window),
+        ou WindowedTensorSet (N,window,H,W) avec channels_first): le bruit
+        noisefunc (sample_noise ou CorrelatedNoise, images (H,W)) est tiré par
+        jour (days, indices des jours des echantillons) et non par echantillon,
+        puis rangé dans les fenetres: un jour a le meme bruit dans toutes les
+        fenetres ou il apparait. Les window-1 images de bord (copies du jour 0,
+        voir temporal_frames) ont le bruit du jour 0. Meme signature que
+        sample_noise.
+    '''
+    def __init__(self, noisefunc, days, window, channels_first=False) :
+        self.noisefunc = noisefunc
+        self.days   = np.asarray(days)
+        self.window = int(window)
+        self.channels_first = channels_first
+
+    def __call__(self, index, shape, sigma, seed=NOISE_SEED, epoch=None, dtype='float32', out=None) :
+        shape = tuple(shape)
+        hw    = shape[1:] if self.channels_first else shape[:-1]
+        frame_days = np.maximum(self.days[index][:,None] + np.arange(1-self.window, 1), 0) # (B,window)
+        days, inv  = np.unique(frame_days, return_inverse=True)
+        noise = self.noisefunc(days, hw, sigma, seed, epoch, dtype=dtype)[inv.reshape(-1)]
+        noise = noise.reshape(frame_days.shape + hw)
+        if not self.channels_first :
+            noise = np.moveaxis(noise, 1, -1)
+        if out is None :
+            return np.ascontiguousarray(noise)
+        out[...] = noise
+        return out
+#
+def input_noises(varIn, ResoIn, Xlist, corr_length=NOISE_CORR_LENGTH,
+                 covariance=NOISE_COVARIANCE, noisevar="SSH", sigma=TRAIN_NOISE_SIGMA) :
+    # generateur de bruit de chaque entrée: CorrelatedNoise (pas des pixels de
+    # sa resolution) pour les entrées noisevar si corr_length > 0, sinon le
+    # bruit blanc sample_noise; tiré par jour (WindowedNoise) pour les entrées
+    # en fenetres temporelles. None (rien a construire) si sigma <= 0.
+    if sigma <= 0 :
+        return None
+    noises = []
+    for v,r,X in zip(varIn, ResoIn, Xlist) :
+        windowed = isinstance(X, WindowedSet) or (torch is not None and isinstance(X, WindowedTensorSet))
+        shape = tuple(X.frames.shape[1:]) if windowed else X.shape[1:]
+        noisefunc = sample_noise
+        if corr_length > 0 and v==noisevar :
+            noisefunc = CorrelatedNoise(shape, covariance, corr_length, dx=r*dxR01, dy=r*dyR01)
+        if windowed :
+            noisefunc = WindowedNoise(noisefunc, X.days, X.window, channels_first=not isinstance(X, WindowedSet))
+        noises.append(noisefunc)
+    return noises
+#
+def add_sample_noise(X, sigma, seed=NOISE_SEED, time_chunk=CODAGE_TIME_CHUNK, stats=False,
+                     noisefunc=sample_noise) :
+    ''' Copie de X (array, IndexedSet, ...) bruitée par noisefunc (sample_noise
+        ou CorrelatedNoise), bloc par bloc de time_chunk images: le bruit n'est
+        jamais de la taille de X.
+        Avec stats=True retourne aussi les StreamStats du bruit et de sa
+        valeur absolue, et la somme des valeurs absolues de X.
+    '''
+    Y = np.array(X) # X peut etre une vue (IndexedSet) ou un memmap en lecture
+    noise_stats, noiseabs_stats, sumabsX = StreamStats(), StreamStats(), 0.0
+    for t0 in np.arange(0, len(Y), time_chunk) :
+        bloc = Y[t0:t0+time_chunk]
+        noise = noisefunc(np.arange(t0, t0+len(bloc)), bloc.shape[1:], sigma, seed, dtype=bloc.dtype)
+        if stats :
+            noise_stats.update(noise); noiseabs_stats.update(np.abs(noise))
+            sumabsX += np.sum(np.abs(bloc), dtype=np.float64)
+        bloc += noise
+    if stats :
+        return Y, noise_stats, noiseabs_stats, sumabsX
+    return Y
+#
+def noise_sigmas(varIn, coparmIn, sigma=TRAIN_NOISE_SIGMA, noisevar="SSH") :
+    # sigma (unités physiques) du bruit des entrées noisevar, en unités codées:
+    # le codage etant affine, le bruit codé est a*bruit (coparm_affine)
+    return [sigma*abs(coparm_affine(c)[0]) if v==noisevar else 0.0 for v,c in zip(varIn, coparmIn)]
+#
+class NoisyBatchSequence(Sequence) :
+    """
+    Exemple d'usage:
+        train_seq = NoisyBatchSequence(x_train, y_train, Bsize, noise_sigmas(varIn, coparmAin))
+        H = Mdl.fit(train_seq, epochs=Niter, validation_data=(x_valid, y_valid))
+
+    Batchs de Mdl.fit pris dans les listes x (entrées) et y (sorties), dans un
+    ordre tiré a chaque epoch (shuffle), avec un bruit blanc de sigma sigmas[k]
+    (unités codées, voir noise_sigmas) ajouté a l'entrée k du batch par
+    sample_noise(indices, epoch), ou par le generateur noises[k] (CorrelatedNoise,
+    voir input_noises): bruit reproductible, nouveau a chaque epoch, alloué a
+    la taille d'un batch seulement.
+    """
+    def __init__(self, x, y, batch_size, sigmas=None, shuffle=True, seed=NOISE_SEED, noises=None, **kwargs) :
+        super(NoisyBatchSequence, self).__init__(**kwargs)
+        self.x, self.y = list(x), list(y)
+        self.batch_size = int(batch_size)
+        self.sigmas = [0.0]*len(self.x) if sigmas is None else list(sigmas)
+        self.noises = [sample_noise]*len(self.x) if noises is None else list(noises)
+        self.shuffle, self.seed = shuffle, seed
+        self.epoch = 0
+        self.set_order()
+
+    def set_order(self) :
+        n = len(self.y[0])
+        if self.shuffle :
+            self.order = np.random.default_rng([int(self.seed), self.epoch]).permutation(n)
+        else :
+            self.order = np.arange(n)
+
+    def __len__(self) :
+        return int(np.ceil(len(self.y[0]) / self.batch_size))
+
+    def add_noise(self, xb, idx, epoch) :
+        # bruit (en place) des entrées xb du batch des echantillons idx
+        for X,sigma,noisefunc in zip(xb, self.sigmas, self.noises) :
+            if sigma > 0 :
+                X += noisefunc(idx, X.shape[1:], sigma, self.seed, epoch, dtype=X.dtype)
+        return xb
+
+    def batch(self, idx, epoch) :
+        # listes des entrées (bruitées) et des sorties des echantillons idx
+        xb = self.add_noise([np.asarray(X[idx]) for X in self.x], idx, epoch)
+        yb = [np.asarray(Y[idx]) for Y in self.y]
+        return xb, yb
+
+    def __getitem__(self, b) :
+        xb, yb = self.batch(self.order[b*self.batch_size:(b+1)*self.batch_size], self.epoch)
+        return (tuple(xb) if len(xb) > 1 else xb[0]), (tuple(yb) if len(yb) > 1 else yb[0])
+
+    def on_epoch_end(self) :
+        self.epoch += 1
+        self.set_order()
+#
+def resac_tf_dataset(x, y, batch_size, sigmas=None, noises=None, shuffle=True, seed=NOISE_SEED,
+                     cache=TFDATA_CACHE, shuffle_buffer=TFDATA_SHUFFLE_BUFFER, repeat=True) :
+    """
+    Exemple d'usage:
+        ds = resac_tf_dataset(x_train, y_train, Bsize, noise_sigmas(varIn, coparmAin))
+        H = Mdl.fit(ds, steps_per_epoch=batch_count(len(y_train[0]), Bsize), epochs=Niter,
+                    validation_data=resac_tf_dataset(x_valid, y_valid, Bsize, shuffle=False, repeat=False))
+
+    Pipeline tf.data des batchs (entrées x, sorties y: listes d'arrays, memmaps
+    ou IndexedSet/WindowedSet) avec les memes batchs bruités que
+    NoisyBatchSequence (sigmas, noises, seed): une epoch est une permutation
+    des indices (tirée de (seed, epoch)), les batchs sont rassemblés et
+    bruités par un map parallele (tf.numpy_function) et prefetchés pendant
+    le calcul du modele.
+
+    Avec cache (None: pas de cache, '': en memoire, sinon nom de fichier) les
+    echantillons rassemblés sont mis en cache au premier passage, puis
+    melangés a chaque epoch dans un buffer de shuffle_buffer echantillons
+    (le bruit reste tiré par batch). Avec repeat=True la suite des epochs
+    est infinie (Mdl.fit avec steps_per_epoch), sinon une seule passe.
+    """
+    seq = NoisyBatchSequence(x, y, batch_size, sigmas, shuffle=False, seed=seed, noises=noises)
+    n, nx = len(seq.y[0]), len(seq.x)
+    dtypes = [tf.as_dtype(np.dtype(X.dtype)) for X in seq.x + seq.y]
+    shapes = [tuple(X.shape[1:]) for X in seq.x + seq.y]
+    AUTOTUNE = tf.data.AUTOTUNE
+    #
+    def structure(arrays, batched=True) :
+        for A,shape in zip(arrays, shapes) :
+            A.set_shape(((None,) if batched else ()) + shape)
+        xb, yb = list(arrays[:nx]), list(arrays[nx:])
+        return (tuple(xb) if len(xb) > 1 else xb[0]), (tuple(yb) if len(yb) > 1 else yb[0])
+    #
+    def gather(idx, epoch) : # batch des echantillons idx, bruité pour l'epoch
+        xb, yb = seq.batch(idx, int(epoch))
+        return xb + yb
+    #
+    def noised(idx, epoch, *arrays) : # bruit des entrées d'un batch venant du cache
+        xb = seq.add_noise([np.array(X) for X in arrays[:nx]], idx, int(epoch))
+        return xb + [np.asarray(Y) for Y in arrays[nx:]]
+    #
+    if cache is None :
+        def epoch_batches(epoch) :
+            idx = tf.range(n, dtype=tf.int64)
+            if shuffle :
+                idx = tf.random.experimental.stateless_shuffle(idx, seed=tf.stack([tf.constant(int(seed), tf.int64), epoch]))
+            return tf.data.Dataset.from_tensor_slices(idx).batch(batch_size).map(lambda b : (b, epoch))
+        map_batch = lambda idx, epoch : structure(tf.numpy_function(gather, [idx, epoch], dtypes))
+    else :
+        def sample(i) : # echantillon i (entrées et sorties), avant bruit
+            return [np.asarray(X[i]) for X in seq.x + seq.y]
+        def map_sample(i) :
+            return tuple([i] + tf.numpy_function(sample, [i], dtypes))
+        samples = tf.data.Dataset.range(n).map(map_sample, num_parallel_calls=AUTOTUNE).cache(cache)
+        def epoch_batches(epoch) :
+            ds = samples.shuffle(shuffle_buffer) if shuffle else samples
+            return ds.batch(batch_size).map(lambda idx, *arrays : (idx, epoch) + arrays)
+        map_batch = lambda idx, epoch, *arrays : structure(tf.numpy_function(noised, [idx, epoch] + list(arrays), dtypes))
+    epochs = tf.data.Dataset.counter() if repeat else tf.data.Dataset.from_tensors(tf.constant(0, tf.int64))
+    ds = epochs.flat_map(epoch_batches).map(map_batch, num_parallel_calls=AUTOTUNE, deterministic=True)
+    return ds.prefetch(AUTOTUNE)
+#
+def batch_count(n, batch_size) :
+    return int(np.ceil(n / batch_size))
+#
+def resac_fit_data(x, y, batch_size, sigmas=None, noises=None, tfdata=USE_TF_DATA) :
+    """
+    Exemple d'usage:
+        fit_data = resac_fit_data(x_train, y_train, Bsize, noise_sigmas(varIn, coparmAin))
+        H = Mdl.fit(**fit_data, epochs=Niter, validation_data=(x_valid, y_valid))
+
+    Arguments de Mdl.fit pour les données d'apprentissage: pipeline tf.data
+    (resac_tf_dataset) si tfdata (par defaut USE_TF_DATA), sinon
+    NoisyBatchSequence si une entrée est bruitée (sigmas) ou fenetrée
+    (WindowedSet), sinon les listes d'arrays (batchs decoupés par Keras).
+    """
+    x, y = list(x), list(y)
+    if tfdata :
+        return { 'x': resac_tf_dataset(x, y, batch_size, sigmas, noises),
+                 'steps_per_epoch': batch_count(len(y[0]), batch_size) }
+    if (sigmas is not None and max(sigmas) > 0) or any(isinstance(X, IndexedSet) for X in x) :
+        return { 'x': NoisyBatchSequence(x, y, batch_size, sigmas, noises=noises) }
+    return { 'x': x, 'y': y, 'batch_size': batch_size, 'shuffle': True }
+#
 #======================================================================
 def showimgdata(X, Labels=None, n=1, fr=0, interp=None, cmap=CMAP_DEF, nsubl=None, 
                 vmin=None, vmax=None, facecolor='w', vnorm=None, origine='lower',
@@ -710,10 +1523,9 @@ def showquivmask (Ui, Vi, resol, qscale=None, qmask=None, qmode=None) :
         UU_[0:Nlig:qstep, 0:Ncol:qstep] = Ui[0:Nlig:qstep, 0:Ncol:qstep];
         VV_[0:Nlig:qstep, 0:Ncol:qstep] = Vi[0:Nlig:qstep, 0:Ncol:qstep];
     else : # moyenne' assumed
-        UM_ = makemoy(Ui.reshape(1,Nlig,Ncol),qmask,qmask);
-        VM_ = makemoy(Vi.reshape(1,Nlig,Ncol),qmask,qmask);
-        UU_[0:Nlig:qmask , 0:Ncol:qmask] = UM_[0];
-        VV_[0:Nlig:qmask , 0:Ncol:qmask] = VM_[0];
+        # moyenne sans les NaN, blocs incomplets du bord compris
+        UU_[0:Nlig:qmask , 0:Ncol:qmask] = block_reduce(Ui, qmask, qmask, "nanmean", edge="partial");
+        VV_[0:Nlig:qmask , 0:Ncol:qmask] = block_reduce(Vi, qmask, qmask, "nanmean", edge="partial");
     plt.quiver(UU_,VV_, scale=qscale);
 #--------------------------------------------------
 def showquivmaskdiff (Uiref, Viref, Uiest, Viest, resol, qscale=None,
@@ -753,8 +1565,8 @@ def showxquiv(X, U, V, resol, dim_dic, qscale=None, qmask=None, qmode=None, xvmi
               figdir='.', savefig=False) :
     print("-- in showxquiv --");
     # qmode : 1: 'step sinon 'moyenne'
-    # qmask : Si qmode!=1, en attendant de revoir la fonction makemoy,
-    #         ce doit etre un diviseur de Nlig et Ncol - not checked
+    # qmask : Si qmode!=1, taille des blocs de moyenne (block_reduce, les
+    #         blocs incomplets du bord sont moyennés sur les pixels disponibles)
     Nimg, Nlig, Ncol = np.shape(X); # same for U et V not checked
     xxticks, lxticks, yyticks, lyticks = getrticks_from_dic(dim_dic);
     origine = ORIGINE;
@@ -912,22 +1724,277 @@ def nanrms(X, Y) :
     RMS    = np.sqrt(np.nansum((X_-Y_)**2) / Nitem_ );
     return RMS, Nnan, inan
 #----------------------------------------------------------------------
+def reduce_full_blocks(A, ml, mc, func) :
+    # Reduction (func) par blocs de ml x mc pixels de A (n, nl, nc), nl et nc
+    # multiples de ml et mc: A est vu en (n, nl/ml, ml, nc/mc, mc) et reduit
+    # sur les axes des blocs (le plus interne d'abord). Sommes en float64.
+    n,nl,nc = A.shape
+    B = A.reshape(n, nl//ml, ml, nc//mc, mc)
+    if func == "min" :
+        return B.min(axis=4).min(axis=2)
+    if func == "max" :
+        return B.max(axis=4).max(axis=2)
+    if func == "nanmean" :
+        valid = ~np.isnan(B)
+        count = valid.sum(axis=4).sum(axis=2)
+        somme = np.where(valid, B, 0).sum(axis=4, dtype=np.float64).sum(axis=2)
+        with np.errstate(invalid='ignore', divide='ignore') :
+            return somme / count  # NaN pour les blocs sans aucune valeur
+    moy = B.sum(axis=4, dtype=np.float64).sum(axis=2) / (ml*mc)
+    if func == "mean" :
+        return moy
+    # "std": ecart type (ddof=0) autour de la moyenne du bloc
+    ecart = B - moy[:,:,None,:,None]
+    return np.sqrt((ecart*ecart).sum(axis=4, dtype=np.float64).sum(axis=2) / (ml*mc))
+#
+def block_reduce(X, ml=3, mc=3, func="mean", edge="error", time_chunk=BLOCK_REDUCE_TIME_CHUNK) :
+    """
+    Exemple d'usage:
+        X03 = block_reduce(X01, 3, 3)                        # = makemoy(X01, 3, 3)
+        U18 = block_reduce(U, 18, 18, "nanmean", edge="partial")
+
+    Reduction par blocs de ml x mc pixels (lat, lon) d'un array (N, nl, nc),
+    ou d'une seule image (nl, nc). func: "mean", "nanmean" (moyenne des
+    seules valeurs non NaN, NaN si tout le bloc est NaN), "min", "max" ou
+    "std" (ecart type dans le bloc).
+
+    Bords non multiples de ml ou mc selon edge:
+        "error" ..... AssertionError (comme makemoy),
+        "trim" ...... les blocs incomplets du bord sont ignorés,
+        "partial" ... les blocs incomplets du bord sont reduits sur les
+                      pixels disponibles (taille de sortie arrondie au dessus).
+
+    L'axe du temps est traité par morceaux de time_chunk images (par defaut
+    BLOCK_REDUCE_TIME_CHUNK): la memoire de travail reste bornée, X peut etre
+    un np.memmap. Le resultat garde le type flottant de X (float64 sinon).
+    """
+    if np.ndim(X) == 2 :
+        return block_reduce(X[None], ml, mc, func=func, edge=edge, time_chunk=time_chunk)[0]
+    if func not in ("mean", "nanmean", "min", "max", "std") :
+        raise ValueError(f"block_reduce: bad func: '{func}'")
+    N,nl,nc = np.shape(X)
+    nl0, nc0 = nl - nl % ml, nc - nc % mc  # partie en blocs complets
+    if edge == "error" :
+        assert nl0 == nl and nc0 == nc, f"block_reduce: dimensions {(nl,nc)} non multiples de {(ml,mc)}"
+    elif edge == "trim" :
+        nl, nc = nl0, nc0
+    elif edge != "partial" :
+        raise ValueError(f"block_reduce: bad edge: '{edge}'")
+    L0, C0 = nl0//ml, nc0//mc
+    # blocs (lignes, colonnes) de sortie -> (lignes, colonnes, taille de bloc) d'entrée
+    regions = [((slice(0,L0), slice(0,C0)), (slice(0,nl0), slice(0,nc0)), (ml, mc))]
+    if nl > nl0 :
+        regions.append(((slice(L0,L0+1), slice(0,C0)), (slice(nl0,nl), slice(0,nc0)), (nl-nl0, mc)))
+    if nc > nc0 :
+        regions.append(((slice(0,L0), slice(C0,C0+1)), (slice(0,nl0), slice(nc0,nc)), (ml, nc-nc0)))
+    if nl > nl0 and nc > nc0 :
+        regions.append(((slice(L0,L0+1), slice(C0,C0+1)), (slice(nl0,nl), slice(nc0,nc)), (nl-nl0, nc-nc0)))
+    #
+    dtype = X.dtype if np.issubdtype(X.dtype, np.floating) else np.float64
+    xr = np.empty((N, -(-nl//ml), -(-nc//mc)), dtype=dtype)
+    for t0 in np.arange(0, N, max(int(time_chunk), 1)) :
+        A = np.asarray(X[t0:t0+time_chunk])
+        for (ol, oc), (il, ic), (bl, bc) in regions :
+            if il.stop > il.start and ic.stop > ic.start :
+                xr[t0:t0+len(A), ol, oc] = reduce_full_blocks(A[:, il, ic], bl, bc, func)
+    return xr
+#
 def makemoy(XB, ml=3, mc=3) :
-    N,nl,nc = np.shape(XB);
-    xm      = np.zeros((N,nl//ml,nc//mc));
-    ii = 0;
-    for i in np.arange(0,nl,ml) :
-        jj = 0;
-        for j in np.arange(0,nc,mc) :
-            if 0 :
-                moy = np.mean(XB[:,i:i+ml,j:j+mc]);
-                xm[0,ii,jj] = moy; 
-            else :              
-                moy = np.mean(XB[:,i:i+ml,j:j+mc], axis=(1,2));
-                xm[:,ii,jj] = moy;
-            jj=jj+1;
-        ii=ii+1;
-    return xm
+    # Moyenne par blocs de ml x mc pixels (voir block_reduce), dimensions
+    # multiples de ml et mc. Le resultat garde le type flottant de XB.
+    return block_reduce(np.asanyarray(XB), ml, mc, "mean")
+#-------------------------------------------------------------
+class IndexedSet(np.lib.mixins.NDArrayOperatorsMixin):
+    ''' Vue d'un ensemble (App, Val ou Test) sans copie des données: l'array
+        complet d'une variable (data, eventuellement un np.memmap) et le vecteur
+        d'indices (isetalea) de l'ensemble sur le premier axe (Time).
+
+        Les images ne sont rassemblées, et converties en dtype, qu'à la
+        demande: indexation (X[i], X[i:j], X[im2show,0,:,:], ...),
+        np.asarray(X) ou toute operation numpy (X - Y, np.mean(X), ...).
+        reshape() en gardant le premier axe donne une autre vue: de data
+        reshapé si possible, sinon (ChunkedArray, ...) la vue garde la forme
+        d'une image (sample_shape) et les images lues sont reshapées.
+
+        Exemple d'usage:
+            VA = IndexedSet(V_data, indA)
+            batch = VA[0:32]                  # seules 32 images sont lues
+    '''
+    def __init__(self, data, index, dtype=None, sample_shape=None) :
+        self.data  = data
+        self.index = np.asarray(index)
+        self.dtype = np.dtype(data.dtype if dtype is None else dtype)
+        self.sample_shape = None if sample_shape is None else tuple(sample_shape)
+
+    @property
+    def shape(self) :
+        if self.sample_shape is not None :
+            return (len(self.index),) + self.sample_shape
+        return (len(self.index),) + tuple(self.data.shape[1:])
+
+    @property
+    def ndim(self) :
+        return len(self.shape)
+
+    @property
+    def size(self) :
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self) :
+        return self.size * self.dtype.itemsize
+
+    def __len__(self) :
+        return len(self.index)
+
+    def _expand_key(self, key) :
+        # cle en tuple, Ellipsis remplacé par des slices: key[0] est l'axe des indices
+        if not isinstance(key, tuple) :
+            key = (key,)
+        if any(k is Ellipsis for k in key) :
+            iell = [k is Ellipsis for k in key].index(True)
+            key  = key[:iell] + (slice(None),)*(self.ndim-len(key)+1) + key[iell+1:]
+        return key if len(key) > 0 else (slice(None),)
+
+    def __getitem__(self, key) :
+        key = self._expand_key(key)
+        idx = self.index[key[0]]
+        if self.sample_shape is None :
+            X = self.data[(idx,) + key[1:]]
+        else :
+            X = np.asarray(self.data[idx]).reshape(np.shape(idx) + self.sample_shape)
+            X = X[(slice(None),)*np.ndim(idx) + key[1:]]
+        return np.asarray(X).astype(self.dtype, copy=False)
+
+    def __array__(self, dtype=None, copy=None) :
+        X = self[:]
+        return X if dtype is None else X.astype(dtype, copy=False)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs) :
+        inputs = tuple(np.asarray(x) if isinstance(x, IndexedSet) else x for x in inputs)
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def reshape(self, *shape) :
+        if len(shape) == 1 and isinstance(shape[0], (tuple, list)) :
+            shape = tuple(shape[0])
+        if len(shape) > 1 and shape[0] == len(self) :
+            if self.sample_shape is None and hasattr(self.data, 'reshape') :
+                return IndexedSet(self.data.reshape((self.data.shape[0],) + tuple(shape[1:])),
+                                  self.index, self.dtype)
+            if int(np.prod(shape[1:])) == int(np.prod(self.shape[1:])) :
+                return IndexedSet(self.data, self.index, self.dtype, shape[1:])
+        return np.asarray(self).reshape(shape)
+
+    def astype(self, dtype, copy=True) :
+        return np.asarray(self).astype(dtype, copy=copy)
+
+    def transpose(self, *axes) :
+        return np.asarray(self).transpose(*axes)
+
+    def min(self, *args, **kwargs) :
+        return np.asarray(self).min(*args, **kwargs)
+
+    def max(self, *args, **kwargs) :
+        return np.asarray(self).max(*args, **kwargs)
+
+    def mean(self, *args, **kwargs) :
+        return np.asarray(self).mean(*args, **kwargs)
+
+    def std(self, *args, **kwargs) :
+        return np.asarray(self).std(*args, **kwargs)
+#-------------------------------------------------------------
+class WindowedSet(IndexedSet):
+    ''' Ensemble (App, Val ou Test) de fenetres temporelles sans copie: l'entrée
+        du jour t est la pile des jours t-window+1, ..., t en canaux (H,W,window).
+
+        frames est l'array (window-1+Ntime,H,W) des images dans l'ordre du
+        temps, precedées de window-1 copies du premier jour (bord), voir
+        temporal_frames: la fenetre d'un jour peut donc contenir des jours des
+        autres ensembles (contexte temporel des entrées, pas des sorties).
+        Les fenetres sont une vue (sliding_window_view, par
+        strides) de frames, et l'ensemble une IndexedSet de cette vue par les
+        indices (isetalea) des jours: un batch (X[idx]) est rassemblé a la
+        demande, aucune pile de window copies n'est allouée.
+
+        Exemple d'usage:
+            frames = temporal_frames((x_train[0], x_valid[0], x_test[0]), (indA, indV, indT), 3)
+            XA = WindowedSet(frames, indA, 3)
+            batch = XA[0:32]                  # (32,H,W,3)
+    '''
+    def __init__(self, frames, index, window, dtype=None) :
+        self.frames = frames
+        self.window = int(window)
+        self.days   = np.asarray(index) # jour de chaque echantillon (dernier de sa fenetre)
+        windows = np.lib.stride_tricks.sliding_window_view(frames, self.window, axis=0)
+        super(WindowedSet, self).__init__(windows, index, dtype)
+
+    def reshape(self, *shape) :
+        return np.asarray(self).reshape(*shape)
+#
+def temporal_frames(Xsets, indsets, window=TIME_WINDOW, Ntime=None) :
+    # Un seul array (window-1+Ntime,H,W) des images (N,H,W,1) ou (N,H,W) des
+    # ensembles Xsets remises a leur jour (indsets), pour WindowedSet. Un
+    # jour d'aucun ensemble (arrondi de isetalea) prend l'image du jour
+    # precedent, ou du premier jour rempli s'il le precede; les window-1
+    # premieres images (bord) sont celle du jour 0.
+    # Les jours de tous les ensembles etant dans frames, la fenetre d'un jour
+    # d'App peut contenir des jours de Val ou de Test (et inversement): seules
+    # les entrées du passé, jamais les sorties, qui restent celles du jour.
+    if Ntime is None :
+        Ntime = max(int(np.max(ind)) for ind in indsets) + 1
+    X0 = Xsets[0]
+    shape = tuple(X0.shape[1:3])
+    frames = np.empty((window-1+Ntime,)+shape, dtype=X0.dtype)
+    filled = np.zeros(Ntime, dtype=bool)
+    for X,ind in zip(Xsets, indsets) :
+        frames[window-1+np.asarray(ind)] = np.asarray(X).reshape((len(ind),)+shape)
+        filled[ind] = True
+    t0 = int(np.argmax(filled)) # premier jour rempli
+    frames[window-1:window-1+t0] = frames[window-1+t0]
+    for t in np.flatnonzero(~filled[t0:]) + t0 :
+        frames[window-1+t] = frames[window-2+t]
+    frames[:window-1] = frames[window-1]
+    return frames
+#
+def windowed_sets(Xsets, indsets, window=TIME_WINDOW) :
+    """
+    Exemple d'usage:
+        x_train, x_valid, x_test = windowed_sets((x_train, x_valid, x_test), (indA, indV, indT))
+
+    Remplace les entrées (listes des variables de chaque ensemble, images
+    (N,H,W,1)) par des WindowedSet de window jours consecutifs (N,H,W,window),
+    sur un seul array des jours par variable (temporal_frames): meme memoire
+    que les entrées d'un jour, les arrays d'origine pouvant etre liberés.
+    Avec window=1 les listes sont rendues telles quelles.
+    """
+    if window <= 1 :
+        return [list(Xlist) for Xlist in Xsets]
+    out = [[] for _ in Xsets]
+    for k in range(len(Xsets[0])) :
+        frames = temporal_frames([Xlist[k] for Xlist in Xsets], indsets, window)
+        for Xlist_out, ind in zip(out, indsets) :
+            Xlist_out.append(WindowedSet(frames, ind, window))
+    return out
+#
+if torch is not None :
+    class WindowedTensorSet(object) :
+        ''' WindowedSet sur un device PyTorch: frames y est copié une fois et
+            les fenetres sont une vue (unfold); X[i:j] donne le batch (B,window,H,W)
+            (channel first), rassemblé sur le device.
+        '''
+        def __init__(self, wset, device=None) :
+            self.frames  = torch.from_numpy(np.ascontiguousarray(wset.frames)).to(device)
+            self.windows = self.frames.unfold(0, wset.window, 1) # (Ntime,H,W,window), vue
+            self.index   = torch.as_tensor(wset.index, device=self.frames.device)
+            self.days    = wset.days
+            self.window  = wset.window
+            self.shape   = (len(wset), wset.window) + tuple(wset.frames.shape[1:])
+
+        def __len__(self) :
+            return self.shape[0]
+
+        def __getitem__(self, key) :
+            return self.windows[self.index[key]].permute(0,3,1,2)
 #-------------------------------------------------------------
 def isetalea (Nimg, pcentSet) :
     pcentA, pcentV, pcentT = pcentSet;
@@ -939,71 +2006,103 @@ def isetalea (Nimg, pcentSet) :
     indT = Ialea[int(Nimg*(pcentA+pcentV)): int(Nimg*(pcentA+pcentV+pcentT))];
     return indA, indV, indT;    
 #----------------------------------------
-def splitset (Vin_brute, Vout_brute, pcentSet) :
+def splitset (Vin_brute, Vout_brute, pcentSet, views=DATA_SET_VIEWS) :
+    # views=True: ensembles en vues IndexedSet (sans copie) au lieu de copies
     Nimg_ = len(Vin_brute[0]); # == len(Vou_brute[0]); not checked
     indA, indV, indT = isetalea(Nimg_, pcentSet);
+    def subset(X, ind) :
+        return IndexedSet(X, ind) if views else X[tuple([ind])]
     #
     VAout_brute = []; VVout_brute = []; VTout_brute = [];
     for i in np.arange(len(Vout_brute)) : # Pour chaque variable (i.e. liste)
-        VAout_brute.append(Vout_brute[i][tuple([indA])]);               
-        VVout_brute.append(Vout_brute[i][tuple([indV])]);               
-        VTout_brute.append(Vout_brute[i][tuple([indT])]);               
+        VAout_brute.append(subset(Vout_brute[i], indA));
+        VVout_brute.append(subset(Vout_brute[i], indV));
+        VTout_brute.append(subset(Vout_brute[i], indT));
     VAin_brute = []; VVin_brute = []; VTin_brute = [];
     for i in np.arange(len(Vin_brute)) : # Pour chaque variable (i.e. liste)
-        VAin_brute.append(Vin_brute[i][tuple([indA])]);               
-        VVin_brute.append(Vin_brute[i][tuple([indV])]);               
-        VTin_brute.append(Vin_brute[i][tuple([indT])]);
+        VAin_brute.append(subset(Vin_brute[i], indA));
+        VVin_brute.append(subset(Vin_brute[i], indV));
+        VTin_brute.append(subset(Vin_brute[i], indT));
     return VAin_brute, VAout_brute, VVin_brute, VVout_brute, VTin_brute, VTout_brute;
 #-------------------------------------------------------------
+def setresolution_couples(FdataAllVar, varlue, varIn, varOut, ResoIn, ResoOut,
+                         native_resol=1, dtype=DATA_DTYPE) :
+    """
+    Exemple d'usage:
+        V_data_list, couple_var_reso_list = setresolution_couples(FdataAllVar, varlue,
+                                                                  varIn,varOut,ResoIn,ResoOut)
+        VAout_brute, VVout_brute, VTout_brute = data_repartition(V_data_list, couple_var_reso_list,
+                                                                 varOut, ResoOut, indA, indV, indT)
+
+    Resolutions IN et OUT depuis l'array [nb.variable, np.time steps, y size,
+    x size] des données natives (native_resol) avant la repartition en
+    ensembles: chaque couple (Variable, Résolution) de varIn+varOut n'est
+    calculé (makemoy) qu'une seule fois, sur tout l'axe de Time. Les couples
+    a la resolution native sont des vues de FdataAllVar.
+
+    Retourne, comme load_resac_by_var_and_resol, la liste des arrays et la
+    liste des couples (Variable, Résolution), a repartir par data_repartition.
+    """
+    couple_var_reso_list = []
+    for v,r in zip(varIn+varOut,ResoIn+ResoOut) :
+        if not (v,r) in couple_var_reso_list :
+            couple_var_reso_list.append((v,r))
+    V_data_list = []
+    for v,r in couple_var_reso_list :
+        reso_rel = r // native_resol
+        print(f"... making '{v}' at R{r:02d}")
+        dvar = FdataAllVar[varlue.index(v)]
+        if reso_rel > 1 :
+            dvar = makemoy(dvar, reso_rel, reso_rel)
+        V_data_list.append(as_data_dtype(dvar, dtype))
+    return V_data_list, couple_var_reso_list
+#-------------------------------------------------------------
 def setresolution(VA_brute,VV_brute,VT_brute,varlue,ResoIn,ResoOut,
-                  native_resol=1) :           
-    # Make resolution for IN and OUT
+                  native_resol=1, dtype=DATA_DTYPE) :
+    # Make resolution for IN and OUT, ensembles deja repartis. Chaque couple
+    # (Variable, Résolution) n'est calculé qu'une fois, meme s'il est a la fois
+    # dans varIn et varOut (les listes IN et OUT partagent alors les arrays).
+    # Voir setresolution_couples pour le calcul avant la repartition.
+    dico_VAT = {}
+    def make_couple(v, r) :
+        if (v,r) not in dico_VAT :
+            reso_rel = r // native_resol
+            idvar = varlue.index(v)
+            dico_VAT[(v,r)] = []
+            for V_brute in (VA_brute, VV_brute, VT_brute) :
+                dvar = V_brute[idvar]
+                if reso_rel > 1 :
+                    dvar = makemoy(dvar, reso_rel, reso_rel)
+                dico_VAT[(v,r)].append(as_data_dtype(dvar, dtype))
+        return dico_VAT[(v,r)]
     print("... making V*out_Brute");
     VAout_brute = []; VVout_brute = []; VTout_brute = [];
-    for i in np.arange(NvarOut) : #varOut ['SSH', 'SSH', 'U', 'V']
-        reso_rel = ResoOut[i] // native_resol
-        idvar = varlue.index(varOut[i])
-        dvar  = VA_brute[idvar];
-        if reso_rel > 1 :
-            dvar  = makemoy(dvar, reso_rel, reso_rel);
-        VAout_brute.append(dvar);            
-        dvar  = VV_brute[idvar];
-        if reso_rel > 1 :
-            dvar  = makemoy(dvar, reso_rel, reso_rel);
-        VVout_brute.append(dvar);            
-        dvar  = VT_brute[idvar];
-        if reso_rel > 1 :
-            dvar  = makemoy(dvar, reso_rel, reso_rel);
-        VTout_brute.append(dvar);            
+    for v,r in zip(varOut, ResoOut) : #varOut ['SSH', 'SSH', 'U', 'V']
+        dA, dV, dT = make_couple(v, r)
+        VAout_brute.append(dA); VVout_brute.append(dV); VTout_brute.append(dT);
     print("... making V*in_Brute");
     VAin_brute = []; VVin_brute = []; VTin_brute = [];
-    for i in np.arange(NvarIn) : #varIn['SSH', 'SST', 'SST', 'SST']
-        reso_rel = ResoIn[i] // native_resol
-        idvar = varlue.index(varIn[i])
-        dvar  = VA_brute[idvar];
-        if reso_rel > 1 :
-            dvar  = makemoy(dvar, reso_rel, reso_rel);
-        VAin_brute.append(dvar);            
-        dvar  = VV_brute[idvar];
-        if reso_rel > 1 :
-            dvar  = makemoy(dvar, reso_rel, reso_rel);
-        VVin_brute.append(dvar);            
-        dvar  = VT_brute[idvar];
-        if reso_rel > 1 :
-            dvar  = makemoy(dvar, reso_rel, reso_rel);
-        VTin_brute.append(dvar);
+    for v,r in zip(varIn, ResoIn) : #varIn['SSH', 'SST', 'SST', 'SST']
+        dA, dV, dT = make_couple(v, r)
+        VAin_brute.append(dA); VVin_brute.append(dV); VTin_brute.append(dT);
     return VAout_brute, VVout_brute, VTout_brute, VAin_brute, VVin_brute, VTin_brute;
 #-------------------------------------------------------------
-def data_repartition(V_brute, couple_var_reso_list, var_list, reso_list, indA, indV, indT) :
+def data_repartition(V_brute, couple_var_reso_list, var_list, reso_list, indA, indV, indT,
+                     dtype=DATA_DTYPE, views=DATA_SET_VIEWS) :
     # Make resolution for IN and OUT
+    # views=True (par defaut DATA_SET_VIEWS): chaque ensemble est une vue
+    # IndexedSet (array de la variable + indices), les images ne sont lues
+    # qu'a l'usage (codage, indexation, ...). Sinon copies en dtype.
     print("... making V*out_Brute");
     VA_brute = []; VV_brute = []; VT_brute = [];
     for v,r in zip(var_list,reso_list) : #varOut ['SSH', 'SSH', 'U', 'V']
         idvar = couple_var_reso_list.index((v,r))
         print(v,r,idvar)
-        VA_brute.append(V_brute[idvar][indA,:])
-        VV_brute.append(V_brute[idvar][indV,:])
-        VT_brute.append(V_brute[idvar][indT,:])
+        for V_set, ind in ((VA_brute, indA), (VV_brute, indV), (VT_brute, indT)) :
+            if views :
+                V_set.append(IndexedSet(V_brute[idvar], ind, dtype))
+            else:
+                V_set.append(as_data_dtype(V_brute[idvar][ind,:], dtype))
     return VA_brute, VV_brute, VT_brute
 #-------------------------------------------------------------
 def dic_dimension_repartition(D_dico_list, couple_var_reso_list, var_list, reso_list,
@@ -1757,26 +2856,364 @@ def appendHist(h1, h2):
             dest[key] = value + h2[key]
         return dest
 #--------------------------------------------------
+def append_history_record(logname, record):
+    # une ligne JSON {cle: valeur} par epoch, en ajout seul: cout constant
+    with open(logname, 'a') as file:
+        file.write(json.dumps(record) + '\n')
+#--------------------------------------------------
+def load_history(path):
+    ''' Historique {cle: [valeurs par epoch]} du pickle path (saveHist) suivi
+        des epochs du log path+'.jsonl' (LossHistory) pas encore compactées,
+        par exemple apres un arret en cours d'apprentissage. Une derniere
+        ligne incomplete (arret pendant l'ecriture) est ignorée.
+    '''
+    try:
+        with open(path, 'rb') as file:
+            history = {k: list(v) for k, v in pickle.load(file).items()}
+    except FileNotFoundError:
+        history = {}
+    try:
+        with open(path + '.jsonl') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                for k, v in record.items():
+                    history.setdefault(k, []).append(v)
+    except FileNotFoundError:
+        pass
+    return history
+#--------------------------------------------------
+def compact_history(path):
+    # log path+'.jsonl' ajouté au pickle path (remplacé par renommage), puis supprimé
+    history = load_history(path)
+    saveHist(path + '.tmp', history)
+    os.replace(path + '.tmp', path)
+    try:
+        os.remove(path + '.jsonl')
+    except FileNotFoundError:
+        pass
+    return history
+#--------------------------------------------------
 
 class LossHistory(Callback):
+    ''' Sauvegarde de l'historique a chaque epoch: une ligne ajoutée au log
+        file+'.jsonl' par un thread d'ecriture (l'apprentissage n'attend pas
+        le disque), compacté a la fin dans le pickle file ({cle: [valeurs]},
+        pour plot_history et la reprise). load_history(file) relit aussi les
+        epochs non compactées.
+    '''
     def __init__(self, file="history.pkl") :
          self.history_filename = file
+         self.log_filename = file + '.jsonl'
+         self.writer = None
 
     def file_name(self) :
          return self.history_filename
 
+    def remove(self) :
+         # supprime le log et le pickle s'ils existent; False si aucun n'existait
+         removed = False
+         for filename in (self.log_filename, self.history_filename) :
+             if os.path.exists(filename) :
+                 os.remove(filename)
+                 removed = True
+         return removed
+
+    def on_train_begin(self, logs = None):
+        self.writer = ThreadPoolExecutor(max_workers=1) # un seul thread: lignes dans l'ordre des epochs
+
     def on_epoch_end(self, epoch, logs = None):
-        new_history={}
-        for k, v in logs.items(): # compile new history from logs
-            new_history[k] = [v] # convert values into lists
+        if self.writer is None:
+            self.on_train_begin()
+        record = {k: float(v) for k, v in (logs or {}).items()}
+        self.writer.submit(append_history_record, self.log_filename, record)
+
+    def on_train_end(self, logs = None):
+        if self.writer is not None:
+            self.writer.shutdown(wait=True)
+            self.writer = None
+        compact_history(self.history_filename) # save history from current training
+
+#--------------------------------------------------
+def replace_path(tmp, path):
+    # remplace path (fichier ou dossier) par tmp; un dossier existant est
+    # d'abord renommé en path+'.old' (complet en cas d'arret entre les deux)
+    if os.path.isdir(tmp) and os.path.isdir(path):
+        old = path.rstrip(os.sep) + '.old'
+        shutil.rmtree(old, ignore_errors=True)
+        os.rename(path, old)
+        os.rename(tmp, path)
+        shutil.rmtree(old, ignore_errors=True)
+    else:
+        os.replace(tmp, path)
+#--------------------------------------------------
+def replace_files(tmp, dirname):
+    # remplace dans dirname chacun des fichiers du dossier tmp (os.replace,
+    # atomique par fichier), puis supprime tmp; les autres fichiers de
+    # dirname sont gardés. Le fichier d'etat 'checkpoint' (TF) en dernier.
+    names = sorted(os.listdir(tmp), key=lambda name: name == 'checkpoint')
+    for name in names:
+        os.replace(os.path.join(tmp, name), os.path.join(dirname, name))
+    shutil.rmtree(tmp, ignore_errors=True)
+#--------------------------------------------------
+class CheckpointWriter(object):
+    ''' Ecriture des checkpoints par un thread (background=True, par defaut
+        BACKGROUND_CHECKPOINT), sinon dans le thread appelant.
+
+        submit(path, savefunc, snapshot) ecrit savefunc(snapshot, tmp) dans un
+        fichier temporaire (meme dossier, meme extension) ou, si isdir, dans
+        le dossier path+'.tmp', puis le renomme en path (replace_path): un
+        checkpoint est complet ou absent, jamais a moitié ecrit. Avec files
+        (checkpoint de plusieurs fichiers path.index, path.data-*, ...) les
+        fichiers ecrits dans path+'.tmp' remplacent un a un ceux du dossier
+        de path (replace_files), sans toucher aux autres. snapshot est
+        une copie en memoire (poids, state_dict) prise par l'appelant. Un
+        snapshot soumis pendant qu'un autre du meme path attend remplace
+        celui-ci: seul le plus recent est ecrit. wait() attend la fin des
+        ecritures (et en remonte les erreurs).
+
+        Exemple d'usage:
+            writer = CheckpointWriter()
+            writer.submit(path, torch.save, torch_snapshot(checkpoint))
+            ...
+            writer.wait()
+    '''
+    def __init__(self, background=BACKGROUND_CHECKPOINT):
+        self.pool = ThreadPoolExecutor(max_workers=1) if background else None
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.futures = []
+
+    def submit(self, path, savefunc, snapshot, isdir=False, files=False):
+        with self.lock:
+            first = path not in self.pending
+            self.pending[path] = (savefunc, snapshot, isdir, files)
+        if self.pool is None:
+            self.write(path)
+        elif first:
+            self.futures.append(self.pool.submit(self.write, path))
+
+    def write(self, path):
+        with self.lock:
+            savefunc, snapshot, isdir, files = self.pending.pop(path)
+        if isdir or files:
+            tmp = path.rstrip(os.sep) + '.tmp'
+            shutil.rmtree(tmp, ignore_errors=True)
+        else:
+            tmp = os.path.join(os.path.dirname(path), '.tmp.' + os.path.basename(path))
         try:
-            with open(self.history_filename, 'rb') as file:
-                old_history=pickle.load(file)
+            savefunc(snapshot, tmp)
         except:
-            print("Fail au moment du chargement du fichier "+self.history_filename)
-            old_history={}
+            if isdir or files:
+                shutil.rmtree(tmp, ignore_errors=True)
+            elif os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        if files:
+            replace_files(tmp, os.path.dirname(os.path.abspath(path)))
+        else:
+            replace_path(tmp, path)
 
-        saveHist(self.history_filename, appendHist(old_history,new_history)) # save history from current training
+    def wait(self):
+        futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+#--------------------------------------------------
+class BackgroundModelCheckpoint(Callback):
+    ''' ModelCheckpoint (poids seulement) par un CheckpointWriter: a chaque
+        amelioration de monitor (ou a chaque epoch, save_best_only=False) les
+        poids sont copiés en memoire (get_weights) et ecrits, via une copie
+        du modele (clone_model), pendant que l'apprentissage continue. Un
+        filepath '.h5' est un fichier remplacé; sinon (format checkpoint TF,
+        plusieurs fichiers) chacun de ses fichiers l'est, les autres fichiers
+        du dossier (historique, ...) restent. Les ecritures sont
+        terminées a la fin de fit (on_train_end).
+    '''
+    def __init__(self, filepath, writer=None, monitor='val_loss', verbose=0,
+                 save_best_only=True, save_weights_only=True, mode='auto'):
+        super(BackgroundModelCheckpoint, self).__init__()
+        if not save_weights_only:
+            raise ValueError("BackgroundModelCheckpoint: only save_weights_only=True is supported")
+        self.filepath = filepath
+        self.writer = CheckpointWriter() if writer is None else writer
+        self.monitor, self.verbose, self.save_best_only = monitor, verbose, save_best_only
+        if mode == 'auto':
+            mode = 'max' if 'acc' in monitor else 'min'
+        self.sign = 1.0 if mode == 'min' else -1.0
+        self.best = np.inf
+        self.shadow = None
+
+    def on_train_begin(self, logs=None):
+        if self.shadow is None:
+            self.shadow = clone_model(self.model) # ecrit par le thread, jamais entrainé
+
+    def save_snapshot(self, weights, tmp):
+        self.shadow.set_weights(weights)
+        if self.filepath.endswith('.h5'):
+            self.shadow.save_weights(tmp)
+        else:
+            os.makedirs(tmp)
+            self.shadow.save_weights(os.path.join(tmp, os.path.basename(self.filepath)))
+
+    def on_epoch_end(self, epoch, logs=None):
+        current = (logs or {}).get(self.monitor)
+        if self.save_best_only:
+            if current is None or not self.sign*current < self.best:
+                return
+            if self.verbose > 0:
+                print(f"\nEpoch {epoch+1:05d}: {self.monitor} improved from {self.sign*self.best:.5f} "
+                      f"to {current:.5f}, saving model to {self.filepath}")
+            self.best = self.sign*current
+        self.save(self.model.get_weights())
+
+    def save(self, weights):
+        files = not self.filepath.endswith('.h5')
+        self.writer.submit(self.filepath, self.save_snapshot, weights, files=files)
+
+    def on_train_end(self, logs=None):
+        self.writer.wait()
+#--------------------------------------------------
+def valid_subset_index(n, subset=VALID_SUBSET, seed=NOISE_SEED):
+    # indices (triés) d'un sous ensemble fixe de subset echantillons parmi n (tous si 0)
+    if not subset or subset >= n:
+        return np.arange(n)
+    return np.sort(np.random.default_rng(seed).choice(n, subset, replace=False))
+#--------------------------------------------------
+def valid_subset(x, y, subset=VALID_SUBSET, seed=NOISE_SEED):
+    # listes x, y (arrays, tenseurs PyTorch ou IndexedSet) reduites a valid_subset_index
+    idx = valid_subset_index(len(y[0]), subset, seed)
+    if len(idx) == len(y[0]):
+        return list(x), list(y)
+    return [X[idx] for X in x], [Y[idx] for Y in y]
+#--------------------------------------------------
+class ResacValidation(Callback):
+    ''' Validation de Mdl.fit toutes les freq epochs (a partir de la premiere)
+        sur validation_data (eventuellement reduit, valid_subset), a la place
+        du validation_data de fit. Avec background=True elle est faite sur un
+        snapshot des poids (get_weights, dans une copie clone_model) par un
+        thread pendant que l'apprentissage continue; une validation demandée
+        pendant qu'une autre tourne est sautée. La premiere est attendue.
+
+        Les derniers resultats (val_loss, ...) sont mis dans les logs de chaque
+        epoch, jusqu'aux suivants: l'historique (History, LossHistory) a une
+        valeur par epoch et EarlyStopping(monitor='val_loss') les utilise. Les
+        callbacks qui les lisent doivent etre apres celui-ci dans la liste.
+        save_best_to(filepath) ecrit les poids du snapshot ayant la meilleure
+        validation (BackgroundModelCheckpoint.save), pas ceux du moment.
+
+        Exemple d'usage:
+            valid_cb = ResacValidation(valid_subset(x_valid, y_valid), Bsize, freq=5, background=True)
+            H = Mdl.fit(x_train, y_train, callbacks=[valid_cb.save_best_to(path), earlystop])
+    '''
+    def __init__(self, validation_data, batch_size, freq=VALID_FREQ, background=VALID_BACKGROUND,
+                 monitor='val_loss', mode='auto', verbose=0):
+        super(ResacValidation, self).__init__()
+        self.x, self.y = validation_data
+        self.batch_size, self.freq = batch_size, max(int(freq), 1)
+        self.pool = ThreadPoolExecutor(max_workers=1) if background else None
+        self.monitor, self.verbose = monitor, verbose
+        if mode == 'auto':
+            mode = 'max' if 'acc' in monitor else 'min'
+        self.sign = 1.0 if mode == 'min' else -1.0
+        self.best = np.inf
+        self.last = {}
+        self.future = self.pending = None
+        self.shadow = self.saver = None
+
+    def save_best_to(self, filepath, writer=None):
+        self.saver = BackgroundModelCheckpoint(filepath, writer, self.monitor, save_best_only=False)
+        return self
+
+    def on_train_begin(self, logs=None):
+        if self.saver is not None:
+            self.saver.set_model(self.model)
+            self.saver.on_train_begin()
+        if self.pool is not None and self.shadow is None:
+            self.shadow = clone_model(self.model) # evaluée par le thread, jamais entrainée
+            self.shadow.compile(loss=self.model.loss, jit_compile=self.model.jit_compile)
+
+    def evaluate(self, Mdl, weights=None):
+        if weights is not None:
+            Mdl.set_weights(weights)
+        res = Mdl.evaluate(self.x, self.y, batch_size=self.batch_size, verbose=0, return_dict=True)
+        return {'val_' + k: float(v) for k, v in res.items()}
+
+    def result(self, epoch, res, weights):
+        self.last = res
+        current = res.get(self.monitor)
+        if current is None or not self.sign*current < self.best:
+            return
+        if self.verbose > 0:
+            print(f"\nEpoch {epoch+1:05d}: {self.monitor} improved from {self.sign*self.best:.5f} to {current:.5f}")
+        self.best = self.sign*current
+        if self.saver is not None:
+            self.saver.save(self.model.get_weights() if weights is None else weights)
+
+    def collect(self, wait=False):
+        if self.future is not None and (wait or self.future.done()):
+            epoch, weights = self.pending
+            self.result(epoch, self.future.result(), weights)
+            self.future = self.pending = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.collect()
+        if epoch % self.freq == 0:
+            if self.pool is None:
+                self.result(epoch, self.evaluate(self.model), None)
+            elif self.future is None:
+                weights = self.model.get_weights()
+                self.pending = (epoch, weights)
+                self.future = self.pool.submit(self.evaluate, self.shadow, weights)
+                self.collect(wait=not self.last)
+        if logs is not None:
+            logs.update(self.last)
+
+    def on_train_end(self, logs=None):
+        self.collect(wait=True)
+        if self.saver is not None:
+            self.saver.on_train_end()
+#--------------------------------------------------
+def validation_setup(x_valid, y_valid, batch_size, freq=VALID_FREQ, subset=VALID_SUBSET,
+                     background=VALID_BACKGROUND):
+    """
+    Exemple d'usage:
+        valid_kw, valid_cbs = validation_setup(x_valid, y_valid, Bsize)
+        H = Mdl.fit(x_train, y_train, **valid_kw, callbacks=valid_cbs + [earlystop])
+
+    Arguments de Mdl.fit pour la validation: validation_data de Keras (chaque
+    epoch, tout l'ensemble) si freq=1, subset=0 et background=False, sinon
+    un callback ResacValidation (a mettre en tete des callbacks).
+    """
+    if freq <= 1 and not subset and not background:
+        return { 'validation_data': (x_valid, y_valid) }, []
+    return {}, [ResacValidation(valid_subset(x_valid, y_valid, subset), batch_size, freq, background)]
+#--------------------------------------------------
+def save_model_background(Mdl, path, writer, snapshot=True):
+    # Mdl.save(path) par le CheckpointWriter writer; snapshot: copie du modele
+    # (architecture, poids, compilation) si l'apprentissage continue pendant
+    # l'ecriture; sinon le modele lui meme est ecrit.
+    if snapshot:
+        M = clone_model(Mdl)
+        M.set_weights(Mdl.get_weights())
+        if Mdl.optimizer is not None:
+            M.compile(optimizer=Mdl.optimizer.__class__.from_config(Mdl.optimizer.get_config()), loss=Mdl.loss,
+                      jit_compile=Mdl.jit_compile)
+    else:
+        M = Mdl
+    writer.submit(path, lambda M, tmp: M.save(tmp), M, isdir=not path.endswith(('.h5', '.keras')))
+#--------------------------------------------------
+def torch_snapshot(obj):
+    # copie en memoire d'un checkpoint PyTorch (tenseurs, state_dict, modele)
+    # pour torch.save en arriere plan: l'apprentissage peut continuer
+    if torch is not None and torch.is_tensor(obj):
+        return obj.detach().clone()
+    if isinstance(obj, dict):
+        return type(obj)((k, torch_snapshot(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(torch_snapshot(v) for v in obj)
+    return copy.deepcopy(obj)
 
 #
 #--------------------------------------------------
@@ -1826,10 +3263,388 @@ def get_resac_data_dir() :
     return datasets_dir
 #
 #--------------------------------------------------
+# Stockage des donnees par morceaux (chunks) selon (time, lat, lon):
+#   <donnees>/NATL60byVar/NATL60_SSH_R01.chunks/chunks.json  (shape, dtype, chunks, ...)
+#                                              /c0.0.0.npy    (ou .npz si compression)
+#                                              /c0.0.1.npy
+#                                              ...
+#   Les fichiers de coordonnees NATL60_coords_R??.npz restent inchangés.
+#   La conversion depuis les fichiers .npy se fait avec convert_npy_to_chunked().
+#--------------------------------------------------
+class ChunkedArray(object):
+    ''' Array stocké par morceaux dans un dossier (voir write_chunked_array).
+        Se comporte comme un array en lecture seule: shape, dtype, len(), et
+        l'indexation (entiers, slices, listes ou arrays d'indices ou booleens,
+        un par axe) ne lit que les morceaux intersectant la selection.
+        Attention: les indices par liste sont appliqués axe par axe
+        (indexation orthogonale, comme np.ix_), ce qui est équivalent à numpy
+        tant qu'un seul axe est indexé par liste.
+    '''
+    def __init__(self, dirname) :
+        with open(os.path.join(dirname, 'chunks.json'), 'r') as file:
+            meta = json.load(file)
+        self.dirname  = dirname
+        self.shape    = tuple(meta['shape'])
+        self.dtype    = np.dtype(meta['dtype'])
+        self.chunks   = tuple(meta['chunks'])
+        self.compress = meta['compress']
+        self.attrs    = meta.get('attrs', {})
+
+    @property
+    def ndim(self) :
+        return len(self.shape)
+
+    def __len__(self) :
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None) :
+        data = self[...]
+        return data if dtype is None else data.astype(dtype)
+
+    def chunk_filename(self, cidx) :
+        ext = '.npz' if self.compress else '.npy'
+        return os.path.join(self.dirname, 'c'+'.'.join(str(c) for c in cidx)+ext)
+
+    def read_chunk(self, cidx) :
+        if self.compress :
+            with np.load(self.chunk_filename(cidx)) as z :
+                return z['c']
+        return np.load(self.chunk_filename(cidx))
+
+    def _key_to_index(self, key) :
+        # une liste d'indices (array d'entiers) par axe, et les axes a supprimer
+        if not isinstance(key, tuple) :
+            key = (key,)
+        if any(k is Ellipsis for k in key) :
+            iell = [k is Ellipsis for k in key].index(True)
+            key  = key[:iell] + (slice(None),)*(self.ndim-len(key)+1) + key[iell+1:]
+        key = key + (slice(None),)*(self.ndim-len(key))
+        index = []; squeeze = []
+        for axis,(k,n) in enumerate(zip(key, self.shape)) :
+            if isinstance(k, slice) :
+                index.append(np.arange(*k.indices(n)))
+            elif np.isscalar(k) :
+                k = int(k)
+                index.append(np.array([k + n if k < 0 else k]))
+                squeeze.append(axis)
+            else :
+                k = np.asarray(k)
+                if k.dtype == bool :
+                    k = np.nonzero(k)[0]
+                k = k.astype(int)
+                index.append(np.where(k < 0, k + n, k))
+        return index, tuple(squeeze)
+
+    def __getitem__(self, key) :
+        index, squeeze = self._key_to_index(key)
+        out = np.empty([len(i) for i in index], dtype=self.dtype)
+        cid = [i // c for i,c in zip(index, self.chunks)]
+        for cidx in itertools.product(*[np.unique(c) for c in cid]) :
+            pos   = [np.nonzero(c == ci)[0] for c,ci in zip(cid, cidx)]
+            local = [i[p] - ci*c for i,p,ci,c in zip(index, pos, cidx, self.chunks)]
+            out[np.ix_(*pos)] = self.read_chunk(cidx)[np.ix_(*local)]
+        if len(squeeze) > 0 :
+            out = out.squeeze(axis=squeeze)
+        return out
+#
+#--------------------------------------------------
+class StackedArrays(object):
+    ''' Empile (virtuellement) une liste d'arrays de meme shape selon un
+        nouvel axe 0, sans les lire. Utilisé par load_resac_data() pour
+        présenter les variables stockées par morceaux comme le grand array
+        [nb.variable, np.time steps, y size, x size].
+    '''
+    def __init__(self, arrays) :
+        self.arrays = list(arrays)
+        self.shape  = (len(self.arrays),) + tuple(self.arrays[0].shape)
+        self.dtype  = self.arrays[0].dtype
+
+    @property
+    def ndim(self) :
+        return len(self.shape)
+
+    def __len__(self) :
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None) :
+        data = self[...]
+        return data if dtype is None else data.astype(dtype)
+
+    def __getitem__(self, key) :
+        if not isinstance(key, tuple) :
+            key = (key,)
+        if len(key) > 0 and key[0] is Ellipsis :
+            key = (slice(None),)*(self.ndim-len(key)+1) + key[1:]
+        if len(key) == 0 :
+            key = (slice(None),)
+        k0, rest = key[0], key[1:]
+        if np.isscalar(k0) :
+            return self.arrays[int(k0)][rest] if len(rest) > 0 else self.arrays[int(k0)]
+        ivar = np.arange(len(self.arrays))[k0]
+        if len(rest) == 0 :
+            rest = (Ellipsis,)
+        return np.stack([self.arrays[i][rest] for i in ivar])
+#
+#--------------------------------------------------
+def write_chunked_array(dirname, data, chunks=CHUNKED_DATA_CHUNKS,
+                        compress=CHUNKED_DATA_COMPRESS, attrs=None, dtype=None) :
+    ''' Ecrit l'array data (array ou np.memmap) par morceaux de taille chunks
+        dans le dossier dirname. Les donnees sont lues un bloc de temps à la
+        fois, la mémoire utilisée est donc de l'ordre de chunks[0] images.
+        Le fichier chunks.json est ecrit a la fin: un dossier sans ce fichier
+        correspond a une conversion interrompue. Avec dtype les morceaux sont
+        convertis dans ce type (par ex. 'float32').
+    '''
+    dtype  = np.dtype(data.dtype if dtype is None else dtype)
+    shape  = tuple(np.shape(data))
+    chunks = tuple(min(c,n) for c,n in zip(chunks, shape))
+    os.makedirs(dirname, exist_ok=True)
+    nchunks = [int(np.ceil(n / c)) for c,n in zip(chunks, shape)]
+    for it in np.arange(nchunks[0]) :
+        t0 = it*chunks[0]
+        block = np.asarray(data[t0:t0+chunks[0]]).astype(dtype, copy=False)
+        for sidx in itertools.product(*[range(n) for n in nchunks[1:]]) :
+            slc = tuple(slice(i*c, (i+1)*c) for i,c in zip(sidx, chunks[1:]))
+            chunk = np.ascontiguousarray(block[(slice(None),)+slc])
+            fname = os.path.join(dirname, 'c'+'.'.join(str(i) for i in (it,)+sidx))
+            if compress :
+                np.savez_compressed(fname+'.npz', c=chunk)
+            else :
+                np.save(fname+'.npy', chunk)
+    meta = { 'shape': list(shape), 'dtype': dtype.str,
+             'chunks': list(chunks), 'compress': bool(compress),
+             'attrs': {} if attrs is None else attrs }
+    with open(os.path.join(dirname, 'chunks.json'), 'w') as file:
+        json.dump(meta, file, indent=1)
+    return ChunkedArray(dirname)
+#
+#--------------------------------------------------
+def open_chunked_array(dirname) :
+    if not os.path.exists(os.path.join(dirname, 'chunks.json')) :
+        raise FileNotFoundError(f"open_chunked_array: '{dirname}' n'est pas un array par morceaux "+\
+                                "(convertir d'abord les donnees avec convert_npy_to_chunked())")
+    return ChunkedArray(dirname)
+#
+#--------------------------------------------------
+def convert_npy_to_chunked(var_list, reso_list, subdir='NATL60byVar',
+                           data_prefix='NATL60', data_suffix='',
+                           chunks=CHUNKED_DATA_CHUNKS, compress=CHUNKED_DATA_COMPRESS,
+                           overwrite=False, dtype=DATA_DTYPE) :
+    """
+    Exemple d'usage:
+        convert_npy_to_chunked(["SSH","SST","U","V"], [1, 3, 9, 27, 81])
+
+    Convertit les fichiers <donnees>/<subdir>/NATL60_{VAR}_R{rr}.npy en dossiers
+    NATL60_{VAR}_R{rr}.chunks (voir write_chunked_array) a cote des fichiers
+    d'origine, lus ensuite par load_resac_by_var_and_resol(..., chunked=True)
+    et load_resac_data(..., chunked=True). Les .npy sont lus en np.memmap,
+    un bloc de temps à la fois et convertis en dtype (par defaut DATA_DTYPE,
+    None garde le type des .npy). Les fichiers de coordonnees
+    NATL60_coords_R{rr}.npz sont verifies mais pas dupliqués.
+    """
+    datasets_dir = get_resac_data_dir();
+    for v in var_list :
+        for r in reso_list :
+            basename = f"{data_prefix}_{v.upper()}_R{r:02d}{data_suffix}"
+            src = os.path.join(datasets_dir,subdir,basename+".npy")
+            dst = os.path.join(datasets_dir,subdir,basename+CHUNKED_EXT)
+            if os.path.exists(os.path.join(dst,'chunks.json')) and not overwrite :
+                print(f"convert_npy_to_chunked: '{basename}{CHUNKED_EXT}' existe deja, on passe")
+                continue
+            coords = os.path.join(datasets_dir,subdir,f"{data_prefix}_coords_R{r:02d}{data_suffix}.npz")
+            if not os.path.exists(coords) :
+                print(f"convert_npy_to_chunked: ATTENTION, fichier de coordonnees '{coords}' introuvable")
+            print(f"converting data: '{v}' at R{r:02d}{data_suffix} ... ", end='', flush=True)
+            t0 = time()
+            data = np.load(src, mmap_mode='r')
+            write_chunked_array(dst, data, chunks=chunks, compress=compress, dtype=dtype,
+                                attrs={ 'source': os.path.basename(src),
+                                        'coords': os.path.basename(coords) })
+            print(f"done {data.shape} in {time()-t0:.1f}s")
+#
+#--------------------------------------------------
+def dtype_filename(filename, dtype) :
+    # NATL60_SSH_R03.npy -> NATL60_SSH_R03.float32.npy
+    base, ext = os.path.splitext(filename)
+    return f"{base}.{np.dtype(dtype).name}{ext}"
+#
+def convert_npy_dtype(var_list, reso_list, dtype=DATA_DTYPE, subdir='NATL60byVar',
+                      data_prefix='NATL60', data_suffix='', time_chunk=NPZ_STREAM_TIME_CHUNK,
+                      overwrite=False) :
+    """
+    Exemple d'usage:
+        convert_npy_dtype(["SSH","SST","U","V"], [3, 9, 27, 81], dtype='float32')
+
+    Convertit les fichiers <donnees>/<subdir>/NATL60_{VAR}_R{rr}.npy en
+    NATL60_{VAR}_R{rr}.{dtype}.npy (par ex. NATL60_SSH_R03.float32.npy) a cote
+    des fichiers d'origine, time_chunk pas de temps à la fois. Ces fichiers
+    sont pris en priorité par load_resac_by_var_and_resol(..., dtype=dtype),
+    qui peut alors les projeter en mémoire (mmap_mode) sans conversion.
+    """
+    datasets_dir = get_resac_data_dir();
+    for v in var_list :
+        for r in reso_list :
+            src = os.path.join(datasets_dir,subdir,f"{data_prefix}_{v.upper()}_R{r:02d}{data_suffix}.npy")
+            dst = dtype_filename(src, dtype)
+            if os.path.exists(dst) and not overwrite :
+                print(f"convert_npy_dtype: '{os.path.basename(dst)}' existe deja, on passe")
+                continue
+            print(f"converting data: '{v}' at R{r:02d}{data_suffix} to {np.dtype(dtype).name} ... ", end='', flush=True)
+            t0 = time()
+            data = np.load(src, mmap_mode='r')
+            out  = np.lib.format.open_memmap(dst+'.tmp', mode='w+', dtype=dtype, shape=data.shape)
+            for b in np.arange(0, len(data), time_chunk) :
+                out[b:b+time_chunk] = data[b:b+time_chunk]
+            out.flush()
+            del out
+            os.replace(dst+'.tmp', dst)
+            print(f"done {data.shape} in {time()-t0:.1f}s")
+#
+#--------------------------------------------------
+def file_hash(filename, blocksize=2**24) :
+    ''' Hash (sha1) du contenu d'un fichier, lu par blocs de blocksize octets.
+    '''
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f :
+        for buf in iter(lambda: f.read(blocksize), b'') :
+            h.update(buf)
+    return h.hexdigest()
+#
+#--------------------------------------------------
+class ResacCatalog(object):
+    ''' Catalogue persistant des datasets: un seul fichier (RESAC_CATALOG_FILE
+        de resacartparm.py, un pickle) dans le dossier RESAC_DATASETS_DIR.
+
+        Pour chaque fichier de données (<subdir>/NATL60_{VAR}_R{rr}.npy) il garde
+        shape, dtype, taille, date de modification et hash du contenu, et pour
+        chaque fichier de coordonnées (<subdir>/NATL60_coords_R{rr}.npz) les
+        vecteurs du dictionnaire de dimensions ('time', 'lat', 'lon',
+        'lat_border', 'lon_border'). Une entrée n'est recalculée que si la
+        taille ou la date du fichier ont changé: les executions suivantes
+        n'ouvrent plus les fichiers de coordonnées et valident les données
+        sans les lire. Le catalogue garde aussi les resultats de
+        build_all_resol_dic() (voir resol_dic()).
+
+        Exemple d'usage:
+            catalog  = ResacCatalog()
+            dico_dim = catalog.coords(3)            # dimensions des données R03
+            entry    = catalog.data_entry('SSH', 3) # shape, dtype, size, hash, ...
+            catalog.save()
+    '''
+    def __init__(self, datasets_dir=None, filename=RESAC_CATALOG_FILE, verbose=True) :
+        if datasets_dir is None :
+            datasets_dir = get_resac_data_dir()
+        self.datasets_dir = datasets_dir
+        self.filename = os.path.join(datasets_dir, filename)
+        self.verbose = verbose
+        self.modified = False
+        self._lock = threading.RLock()
+        self.content = { 'files': {}, 'resol_dic': {} }
+        if os.path.isfile(self.filename) :
+            try :
+                with open(self.filename, 'rb') as f :
+                    self.content = pickle.load(f)
+            except Exception as e :
+                print(f"catalogue '{self.filename}' illisible ({e}), il sera reconstruit")
+    #
+    def save(self) :
+        ''' Ecrit le catalogue s'il a changé (fichier temporaire puis renommage,
+            un lecteur concurrent ne voit jamais un catalogue a moitie ecrit).
+        '''
+        with self._lock :
+            if not self.modified :
+                return
+            tmpfile = f"{self.filename}.{os.getpid()}.tmp"
+            try :
+                with open(tmpfile, 'wb') as f :
+                    pickle.dump(self.content, f)
+                os.replace(tmpfile, self.filename)
+                self.modified = False
+            except OSError as e :
+                print(f"catalogue '{self.filename}' non sauvegardé: {e}")
+    #
+    def entry(self, relpath, build) :
+        ''' Entrée du fichier relpath (relatif a datasets_dir), construite par
+            build(filename) si absente ou perimée (taille ou date changées).
+        '''
+        filename = os.path.join(self.datasets_dir, relpath)
+        st = os.stat(filename)
+        with self._lock :
+            entry = self.content['files'].get(relpath)
+        if entry is None or entry['size'] != st.st_size or entry['mtime'] != st.st_mtime_ns :
+            if self.verbose :
+                print(f"catalogue: indexation de '{relpath}'")
+            entry = build(filename)
+            entry.update({ 'size': st.st_size, 'mtime': st.st_mtime_ns,
+                           'hash': file_hash(filename) })
+            with self._lock :
+                self.content['files'][relpath] = entry
+                self.modified = True
+        return entry
+    #
+    def data_entry(self, v, r, subdir='NATL60byVar', data_prefix='NATL60', data_suffix='') :
+        def build(filename) :
+            data = np.load(filename, mmap_mode='r') # lit seulement l'entete du .npy
+            return { 'var': v.upper(), 'reso': r, 'shape': tuple(data.shape),
+                     'dtype': data.dtype.str }
+        return self.entry(os.path.join(subdir,f"{data_prefix}_{v.upper()}_R{r:02d}{data_suffix}.npy"), build)
+    #
+    def coords(self, r, subdir='NATL60byVar', data_prefix='NATL60', data_suffix='') :
+        ''' Dictionnaire de dimensions (copie) des données a la resolution r.
+        '''
+        def build(filename) :
+            with np.load(filename) as dimension_tmp :
+                dico_dim = { 'time': dimension_tmp['time'],
+                             'lat' : dimension_tmp['latitude'],
+                             'lon' : dimension_tmp['longitude'],
+                             'lat_border' : dimension_tmp['latitude_border'],
+                             'lon_border' : dimension_tmp['longitude_border'] }
+            return { 'reso': r, 'coords': dico_dim }
+        entry = self.entry(os.path.join(subdir,f"{data_prefix}_coords_R{r:02d}{data_suffix}.npz"), build)
+        return dict(entry['coords'])
+    #
+    def resol_dic(self, dic_r1, all_r, native_resol=1) :
+        ''' build_all_resol_dic(dic_r1, all_r, native_resol) gardé en cache,
+            la cle etant un hash des vecteurs de dic_r1.
+        '''
+        h = hashlib.sha1()
+        for k in sorted(dic_r1.keys()) :
+            h.update(k.encode())
+            h.update(np.ascontiguousarray(np.asarray(dic_r1[k])).tobytes())
+        key = (h.hexdigest(), tuple(all_r), native_resol)
+        with self._lock :
+            dico_all_r = self.content['resol_dic'].get(key)
+        if dico_all_r is None :
+            dico_all_r = build_all_resol_dic(dic_r1, all_r, native_resol=native_resol)
+            with self._lock :
+                self.content['resol_dic'][key] = dico_all_r
+                self.modified = True
+        return { k: dict(d) for k,d in dico_all_r.items() }
+    #
+    def check_couples(self, couple_var_reso_list, subdir='NATL60byVar',
+                      data_prefix='NATL60', data_suffix='') :
+        ''' Verifie, sans lire les données, que chaque couple (Variable,
+            Résolution) existe et que sa shape correspond a ses coordonnées.
+            Retourne le nombre total d'octets des données concernées.
+        '''
+        nbytes = 0
+        for v,r in couple_var_reso_list :
+            entry = self.data_entry(v, r, subdir=subdir, data_prefix=data_prefix, data_suffix=data_suffix)
+            dico_dim = self.coords(r, subdir=subdir, data_prefix=data_prefix, data_suffix=data_suffix)
+            dim_shape = (len(dico_dim['time']), len(dico_dim['lat']), len(dico_dim['lon']))
+            assert entry['shape'] == dim_shape, f"{v.upper()}_R{r:02d}{data_suffix}: shape {entry['shape']} "+\
+                f"incompatible avec ses coordonnees {dim_shape}"
+            nbytes += int(np.prod(entry['shape'])) * np.dtype(entry['dtype']).itemsize
+        return nbytes
+#
+#--------------------------------------------------
 # nouvelle version PREFEREZ CETTE METHODE
 def load_resac_by_var_and_resol(varIn, varOut, ResoIn, ResoOut, subdir='NATL60byVar',
                                 data_prefix='NATL60', data_suffix='',
-                                zone=None, lat=None, lon=None, itime=None):
+                                zone=None, lat=None, lon=None, itime=None,
+                                mmap_mode=LOAD_DATA_MMAP_MODE, chunked=LOAD_DATA_CHUNKED,
+                                nb_workers=LOAD_DATA_NB_WORKERS, catalog=LOAD_DATA_CATALOG,
+                                dtype=DATA_DTYPE):
     """
     Exemple d'usage:
         V_data_list, couple_var_reso_list = load_resac_by_var_and_resol(varIn,varOut,ResoIn,ResoOut)
@@ -1848,6 +3663,8 @@ def load_resac_by_var_and_resol(varIn, varOut, ResoIn, ResoOut, subdir='NATL60by
     alors c'est le bout dans le sens Min ou Max. Par exemple, la zone à partir
     de 30 deg. de Latitude Nord et jusqu'à 50 degres de longitude Ouest s'ecrit:
     -lat=[30, None], -lon=[None, -50]
+    Les limites de zone sont converties en slices d'indices à partir des seules
+    coordonnées (select_index_by_coords) avant toute lecture des données.
     
     Enfin, il aus aussi possible de specifier un schema d'indices de Time a 
     selectionner en especifiant en une tuple l'index initial et le pas de
@@ -1855,6 +3672,37 @@ def load_resac_by_var_and_resol(varIn, varOut, ResoIn, ResoOut, subdir='NATL60by
     l'element 0 un par un jusque la fin, c'est à dire tous les pas de temps
     disponibles dans les données.
     
+    L'option mmap_mode (par defaut LOAD_DATA_MMAP_MODE de resacartparm.py) est
+    passée à np.load(). Avec mmap_mode='r' les fichiers .npy sont projetés en
+    mémoire sans etre lus: seules les pages touchées par la selection de zone,
+    de lat/lon ou de Time sont effectivement lues sur le disque. Sans aucune
+    selection l'array retourné reste un np.memmap (en lecture seule), qui sera
+    lu au fur et à mesure de son usage (data_repartition, ...). Avec
+    mmap_mode=None on retrouve l'ancien comportement (lecture complete).
+
+    Avec chunked=True (par defaut LOAD_DATA_CHUNKED) les données sont lues
+    dans les dossiers NATL60_{VAR}_R{rr}.chunks produits par
+    convert_npy_to_chunked(): seuls les morceaux (time, lat, lon) touchés par
+    la selection sont lus (mmap_mode est alors ignoré).
+
+    Les couples (Variable, Résolution) sont lus en parallele par un pool d'au
+    plus nb_workers threads (par defaut LOAD_DATA_NB_WORKERS), les resultats
+    gardant l'ordre des couples. nb_workers=1 donne une lecture sequentielle.
+    Avec mmap_mode ou chunked sans selection les arrays restent paresseux et
+    ne sont lus qu'à l'usage: le gain concerne alors les seules selections.
+
+    Avec catalog=True (par defaut LOAD_DATA_CATALOG), ou une instance de
+    ResacCatalog, les coordonnées sont prises du catalogue des datasets et
+    les couples sont validés (existence, shape) avant toute lecture.
+
+    Les arrays retournés sont de type dtype (par defaut DATA_DTYPE, None garde
+    le type stocké). Les fichiers deja convertis NATL60_{VAR}_R{rr}.{dtype}.npy
+    (voir convert_npy_dtype()) sont lus en priorité. Sinon un array paresseux
+    (np.memmap, ChunkedArray) est rendu en IndexedSet de tout l'axe de Time,
+    converti en dtype a chaque lecture (les ensembles App/Val/Test, les
+    batchs, ...) sans jamais etre chargé en entier; une selection deja lue
+    en mémoire est convertie.
+
     Retourne trois éléments:
         
         - liste d'array 3D ([np.time steps, y size, x size]) des données contenant
@@ -1877,41 +3725,68 @@ def load_resac_by_var_and_resol(varIn, varOut, ResoIn, ResoOut, subdir='NATL60by
         if not (v,r) in couple_var_reso_list :
             couple_var_reso_list.append((v,r))
     #
+    if catalog is True :
+        catalog = ResacCatalog(datasets_dir)
+    if catalog :
+        # validation des couples a lire, sans toucher aux données
+        coord_kw = dict(subdir=subdir, data_prefix=data_prefix, data_suffix=data_suffix)
+        if not chunked :
+            nbytes = catalog.check_couples(couple_var_reso_list, **coord_kw)
+            print(f"catalogue: {len(couple_var_reso_list)} couples (Variable, Résolution), {nbytes/2**20:.1f} Mo")
+    #
     if zone is not None or lat is not None or lon is not None:
         # affiner les limites lat/lon pour coller precisement aux données de plus
         # basse resolution et ainsi, au fur et a mesure que l'on traite les plus
         # hautes resolutions, garantir la coherence des dimensions (multiples de 3,9,27,...)
         r = max(ResoIn+ResoOut)  # la plus basse resolution, 81, normalement
-        dimension_tmp = np.load(os.path.join(datasets_dir,subdir,f"{data_prefix}_coords_R{r:02d}{data_suffix}.npz"))
-        lat,lon = get_real_lat_lon_limits(dimension_tmp['latitude_border'],
-                                          dimension_tmp['longitude_border'],
-                                          zone=zone,
-                                          lat_limits=lat, lon_limits=lon)
+        if catalog :
+            lat,lon = get_real_lat_lon_limits(None, None, zone=zone,
+                                              lat_limits=lat, lon_limits=lon,
+                                              catalog=catalog, reso=r, **coord_kw)
+        else:
+            dimension_tmp = np.load(os.path.join(datasets_dir,subdir,f"{data_prefix}_coords_R{r:02d}{data_suffix}.npz"))
+            lat,lon = get_real_lat_lon_limits(dimension_tmp['latitude_border'],
+                                              dimension_tmp['longitude_border'],
+                                              zone=zone,
+                                              lat_limits=lat, lon_limits=lon)
         print(f"Selection par zone ou Lan/Lon ({lat}/{lon})")
     #
-    # Lecture Des Donnees    
-    V_data_list = []; D_dico_list = []
-    for i,c in enumerate(couple_var_reso_list):
+    # Lecture Des Donnees, d'un couple (Variable, Résolution)
+    def load_couple(i, c):
         v,r  = c
-        print(f"loading data: '{v}' at R{r:02d}{data_suffix}")
-        data_tmp = np.load(os.path.join(datasets_dir,subdir,f"{data_prefix}_{v.upper()}_R{r:02d}{data_suffix}.npy"))
-        dimension_tmp = np.load(os.path.join(datasets_dir,subdir,f"{data_prefix}_coords_R{r:02d}{data_suffix}.npz"))
-        # conversion de dimension_tmp, objet 'numpy.lib.npyio.NpzFile', en dico_dim dictionnaire
-        dico_dim = { 'time': dimension_tmp['time'],
-                     'lat' : dimension_tmp['latitude'],
-                     'lon' : dimension_tmp['longitude'],
-                     'lat_border' : dimension_tmp['latitude_border'],
-                     'lon_border' : dimension_tmp['longitude_border'] }
+        if chunked :
+            print(f"loading data: '{v}' at R{r:02d}{data_suffix} (chunked)")
+            data_tmp = open_chunked_array(os.path.join(datasets_dir,subdir,f"{data_prefix}_{v.upper()}_R{r:02d}{data_suffix}{CHUNKED_EXT}"))
+        else:
+            data_file = os.path.join(datasets_dir,subdir,f"{data_prefix}_{v.upper()}_R{r:02d}{data_suffix}.npy")
+            if dtype is not None and os.path.isfile(dtype_filename(data_file, dtype)) :
+                data_file = dtype_filename(data_file, dtype)
+            print(f"loading data: '{v}' at R{r:02d}{data_suffix}"+\
+                  ("" if mmap_mode is None else f" (mmap_mode='{mmap_mode}')")+\
+                  ("" if dtype is None else f" as {np.dtype(dtype).name}"))
+            data_tmp = np.load(data_file, mmap_mode=mmap_mode)
+        if catalog :
+            dico_dim = catalog.coords(r, **coord_kw)
+        else:
+            dimension_tmp = np.load(os.path.join(datasets_dir,subdir,f"{data_prefix}_coords_R{r:02d}{data_suffix}.npz"))
+            # conversion de dimension_tmp, objet 'numpy.lib.npyio.NpzFile', en dico_dim dictionnaire
+            dico_dim = { 'time': dimension_tmp['time'],
+                         'lat' : dimension_tmp['latitude'],
+                         'lon' : dimension_tmp['longitude'],
+                         'lat_border' : dimension_tmp['latitude_border'],
+                         'lon_border' : dimension_tmp['longitude_border'] }
         if lat is not None or lon is not None or itime is not None:
             print(f" - {v.upper()}_R{r:02d}{data_suffix} - Dim AVANT: {data_tmp.shape}")
+            # index (time, lat, lon) a lire, calculés sur les seules coordonnées
+            isel = [slice(None)]*3
             if lat is not None or lon is not None :
                 if i == 0:
                     print(f"   (avant) limites lat des donnees: [{dico_dim['lat'][0]},{dico_dim['lat'][-1]}] en {len(dico_dim['lat'])} valeurs,"+\
                           f" lon: [{dico_dim['lon'][0]},{dico_dim['lon'][-1]}] en {len(dico_dim['lon'])} valeurs.")
                 # selection par zones de coordonnees
-                data_tmp, dico_dim = select_by_coords(data_tmp, dico_dim,
-                                                      lat_limits=lat, lat_axis=1,
-                                                      lon_limits=lon, lon_axis=2)
+                isel[1], isel[2], dico_dim = select_index_by_coords(dico_dim,
+                                                                    lat_limits=lat,
+                                                                    lon_limits=lon)
                 if i == 0:
                     print(f"   (apres) limites lat des donnees: [{dico_dim['lat'][0]},{dico_dim['lat'][-1]}] en {len(dico_dim['lat'])} valeurs,"+\
                           f" lon: [{dico_dim['lon'][0]},{dico_dim['lon'][-1]}] en {len(dico_dim['lon'])} valeurs.")
@@ -1920,14 +3795,37 @@ def load_resac_by_var_and_resol(varIn, varOut, ResoIn, ResoOut, subdir='NATL60by
                 if i == 0:
                     print(f"   (avant) limites Time des donnees: [{dico_dim['time'][0]},{dico_dim['time'][-1]}] en {len(dico_dim['time'])} valeurs")
                 # selection par sous-echantillonnage dans l'axe de Time
-                data_tmp, new_time = select_data_by_dim(data_tmp, itime, dim_lbl=currtime,
-                                                        dim_axis=0)
-                dico_dim['time'] = new_time
+                isel[0] = index_pattern_to_slice(itime, len(currtime), dim_axis=0)
+                dico_dim['time'] = currtime[isel[0]]
                 if i == 0:
                     print(f"   (apres) limites Time des donnees: [{dico_dim['time'][0]},{dico_dim['time'][-1]}] en {len(dico_dim['time'])} valeurs")
+            # une seule indexation par slices: vue sur le np.memmap (seul
+            # l'hyperslab sera lu) ou lecture des seuls morceaux concernés;
+            # axe par axe pour des coordonnées non monotones (orthogonal_index)
+            data_tmp = orthogonal_index(data_tmp, isel)
             print(f" - Dim APRES: {data_tmp.shape}")
-        V_data_list.append(data_tmp)
-        D_dico_list.append(dico_dim)
+        if dtype is not None and data_tmp.dtype != np.dtype(dtype) :
+            if isinstance(data_tmp, (np.memmap, ChunkedArray)) :
+                # reste paresseux: conversion a la lecture (IndexedSet)
+                data_tmp = IndexedSet(data_tmp, np.arange(len(data_tmp)), dtype)
+            else :
+                data_tmp = np.asarray(data_tmp).astype(dtype)
+        return data_tmp, dico_dim
+    #
+    # Lecture des couples en parallele par un pool de nb_workers threads (les
+    # lectures de fichiers liberent le GIL). L'ordre des resultats est celui
+    # de couple_var_reso_list.
+    nb_workers = max(1, min(nb_workers or 1, len(couple_var_reso_list)))
+    if nb_workers > 1 :
+        with ThreadPoolExecutor(max_workers=nb_workers) as pool :
+            loaded = list(pool.map(load_couple, range(len(couple_var_reso_list)),
+                                   couple_var_reso_list))
+    else:
+        loaded = [load_couple(i, c) for i,c in enumerate(couple_var_reso_list)]
+    V_data_list = [d for d,_ in loaded]
+    D_dico_list = [dd for _,dd in loaded]
+    if catalog :
+        catalog.save()
     #
     return V_data_list, couple_var_reso_list, D_dico_list
 #
@@ -1936,12 +3834,17 @@ def load_resac_by_var_and_resol(varIn, varOut, ResoIn, ResoOut, subdir='NATL60by
 # (les 4 variables, tous les pas de temps, ...)
 # Le chargement est TRES LENT ET GOURMAND EN MEMOIRE dans le cas de l'array
 # "natl60_htuv_01102012_01102013.npz" des données NATL60 qui est en resolution
-# tres fine.
+# tres fine. Voir load_resac_data_by_var_and_resol() pour une lecture de ce
+# fichier variable par variable et par blocs de temps.
 def load_resac_data(npz_data_file, 
                     zone=None,             # zone de selection pre-configure: "North", "South".
                     lat=None, lon=None,    # limites lat, lon de la zone de selection
                     itime=None,            # indices de sous-echantillonnage des patterns (axe de Time)
                     time_init=None,
+                    chunked=LOAD_DATA_CHUNKED, # lecture des R01 par variable stockés par morceaux
+                    subdir='NATL60byVar', data_prefix='NATL60', data_suffix='',
+                    chunked_var_list=['SSH','SST','U','V'],
+                    dtype=DATA_DTYPE,      # type des données retournées (None: type stocké)
                     nav_lat_xtremes=[ 26.57738495,  44.30360031],
                     nav_lon_xtremes=[-64.41895294, -40.8841095 ]) :
     """
@@ -1971,6 +3874,15 @@ def load_resac_data(npz_data_file,
                         Les coordonnees des chaque pixel sera calculée selon les
                         dimensions des donnees et dans une grille reguliere
                         limitee par ces valeurs extremes.
+        chunked=True ... Au lieu du fichier npz_data_file, lit les arrays R01
+                        par variable (chunked_var_list) stockés par morceaux
+                        dans <donnees>/<subdir>/NATL60_{VAR}_R01.chunks (voir
+                        convert_npy_to_chunked()). Seuls les morceaux touchés
+                        par la selection de zone ou de Time sont lus.
+        dtype=TYPE ..... Type des données retournées, par defaut DATA_DTYPE
+                        ('float32'). Les variables du npz sont alors converties
+                        par blocs de temps à la lecture, sans copie complete
+                        dans le type stocké. None garde le type stocké.
     
     Lecture des données RESAC.  La function s'attend à trouver le repertoire
     des données dans la variable d'environnement RESAC_DATASETS_DIR.
@@ -2004,13 +3916,27 @@ def load_resac_data(npz_data_file,
     data_set_filename = os.path.join(datasets_dir,npz_data_file)
     #
     # Lecture Des Donnees
-    print(f"Lecture Des Donnees du fichier {npz_data_file} ... ", end='', flush=True)
-    Data_       = np.load(data_set_filename)
-    FdataAllVar = Data_['FdataAllVar']
-    varlue      = list(Data_['varlue'])
-    # Pour enlever les b devant les chaines de caracteres lors de la lecture et pour la
-    # conversion de 'SSU','SSV' en 'U','V'
-    varlue      = ['U' if i==b'SSU' else 'V' if i==b'SSV' else i.decode() for i in varlue]
+    if chunked :
+        print(f"Lecture Des Donnees par morceaux dans {subdir} ... ", end='', flush=True)
+        varlue      = list(chunked_var_list)
+        FdataAllVar = StackedArrays([open_chunked_array(os.path.join(datasets_dir,subdir,
+                                                                     f"{data_prefix}_{v.upper()}_R01{data_suffix}{CHUNKED_EXT}"))
+                                     for v in varlue])
+    else:
+        print(f"Lecture Des Donnees du fichier {npz_data_file} ... ", end='', flush=True)
+        # Pour enlever les b devant les chaines de caracteres lors de la lecture et pour la
+        # conversion de 'SSU','SSV' en 'U','V'
+        varlue      = read_npz_varlue(data_set_filename)
+        if dtype is None :
+            FdataAllVar = np.load(data_set_filename)['FdataAllVar']
+        else:
+            # lecture par variable et blocs de temps, convertis en dtype au fur et a mesure
+            with NpzArrayReader(data_set_filename, 'FdataAllVar') as reader :
+                FdataAllVar = np.empty(reader.shape, dtype=dtype)
+                for ivar in np.arange(reader.shape[0]) :
+                    for t0 in np.arange(0, reader.shape[1], NPZ_STREAM_TIME_CHUNK) :
+                        t1 = min(t0+NPZ_STREAM_TIME_CHUNK, reader.shape[1])
+                        FdataAllVar[ivar,t0:t1] = reader.read(ivar, t0, t1)
     print(f'\nArray avec {len(varlue)} variables: {varlue}')
     print(f'contenant des images de taille {FdataAllVar.shape[2:]} pixels')
     print(f'et {FdataAllVar.shape[1]} pas de temps (une image par jour).')
@@ -2045,6 +3971,7 @@ def load_resac_data(npz_data_file,
     # selection par zones de coordonnees
     if zone is not None or lat is not None or lon is not None or itime is not None:
         print(f"Selection par zone ou Time:\n - Dim AVANT: {FdataAllVar.shape}")
+        isel = [slice(None)]*4
         if zone is not None or lat is not None or lon is not None :
             print(f" - selection par zone ou Lan/Lon ({lat}/{lon}):")
             print(f"   (avant) limites lat des donnees: [{dimensions['lat'][0]},{dimensions['lat'][-1]}] en {len(dimensions['lat'])} valeurs,"+\
@@ -2065,10 +3992,10 @@ def load_resac_data(npz_data_file,
                                               zone=zone,
                                               lat_limits=lat, lon_limits=lon)
             #
-            # effectue la selection de zone 
-            FdataAllVar, dimensions = select_by_coords(FdataAllVar, dimensions,
-                                                       lat_limits=lat, lat_axis=2,
-                                                       lon_limits=lon, lon_axis=3)
+            # index de la selection de zone (appliqués plus bas, avec ceux de Time)
+            isel[2], isel[3], dimensions = select_index_by_coords(dimensions,
+                                                                  lat_limits=lat,
+                                                                  lon_limits=lon)
             print(f"   (apres) limites lat des donnees: [{dimensions['lat'][0]},{dimensions['lat'][-1]}] en {len(dimensions['lat'])} valeurs,"+\
                   f" lon: [{dimensions['lon'][0]},{dimensions['lon'][-1]}] en {len(dimensions['lon'])} valeurs.")
         if itime is not None:
@@ -2076,21 +4003,872 @@ def load_resac_data(npz_data_file,
             print(f" - selection par Time selon pattern: {itime}:")
             print(f"   (avant) limites Time des donnees: [{dimensions['time'][0]},{dimensions['time'][-1]}] en {len(dimensions['time'])} valeurs")
             # selection par sous-echantillonnage dans l'axe de Time
-            FdataAllVar, new_time = select_data_by_dim(FdataAllVar, itime,
-                                                       dim_lbl=currtime,
-                                                       dim_axis=1)
-            dimensions['time'] = new_time
+            isel[1] = index_pattern_to_slice(itime, len(currtime), dim_axis=1)
+            dimensions['time'] = currtime[isel[1]]
             print(f"   (apres) limites Time des donnees: [{dimensions['time'][0]},{dimensions['time'][-1]}] en {len(dimensions['time'])} valeurs")
+        # effectue la selection en une seule indexation par slices (axe par
+        # axe pour des coordonnées non monotones, orthogonal_index)
+        FdataAllVar = orthogonal_index(FdataAllVar, isel)
         print(f" - Dim APRES: {FdataAllVar.shape}")
     #
+    if chunked :
+        # lecture effective des morceaux selectionnés
+        FdataAllVar = as_data_dtype(np.asarray(FdataAllVar), dtype)
+    #
     return FdataAllVar,varlue,dimensions
 #
+#--------------------------------------------------
+class NpzArrayReader(object):
+    ''' Lecteur d'un array (membre 'FdataAllVar' par defaut) d'un fichier .npz
+        sans le charger en entier: on ne lit que les octets d'un bloc
+        [ivar, t0:t1] de l'array [nb.variable, np.time steps, y size, x size].
+        Si le .npz est compressé, le membre est décompressé au fil de l'eau
+        (les blocs sont lus en avancant, la mémoire reste celle d'un bloc).
+    '''
+    def __init__(self, npz_file, member='FdataAllVar') :
+        self.zipfile = zipfile.ZipFile(npz_file, 'r')
+        self.fp      = self.zipfile.open(member+'.npy', 'r')
+        version      = np.lib.format.read_magic(self.fp)
+        if version == (1, 0) :
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(self.fp)
+        elif version == (2, 0) :
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(self.fp)
+        else :
+            raise ValueError(f"NpzArrayReader: version de format npy {version} non prevue")
+        if fortran_order :
+            raise ValueError("NpzArrayReader: array en ordre Fortran non prevu")
+        self.shape  = tuple(shape)
+        self.dtype  = np.dtype(dtype)
+        self.offset = self.fp.tell()    # debut des donnees dans le membre .npy
+
+    def read(self, ivar, t0, t1) :
+        # bloc [ivar, t0:t1, :, :]
+        imgsize = int(np.prod(self.shape[2:])) * self.dtype.itemsize
+        self.fp.seek(self.offset + (ivar*self.shape[1] + t0) * imgsize)
+        buf = self.fp.read((t1 - t0) * imgsize)
+        return np.frombuffer(buf, dtype=self.dtype).reshape((t1 - t0,) + self.shape[2:])
+
+    def close(self) :
+        self.fp.close()
+        self.zipfile.close()
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *args) :
+        self.close()
+#
+#--------------------------------------------------
+def read_npz_varlue(data_set_filename) :
+    # noms des variables du grand array ('SSU','SSV' -> 'U','V')
+    with np.load(data_set_filename) as Data_ :
+        varlue = list(Data_['varlue'])
+    return ['U' if i==b'SSU' else 'V' if i==b'SSV' else i.decode() for i in varlue]
+#
+#--------------------------------------------------
+def build_resac_pyramid(npz_data_file, var_list, reso_list, time_chunk=NPZ_STREAM_TIME_CHUNK,
+                        catalog=None, cache_subdir=PYRAMID_CACHE_SUBDIR, dtype=DATA_DTYPE) :
+    """
+    Exemple d'usage:
+        pyramid = build_resac_pyramid("natl60_htuv_01102012_01102013.npz",
+                                      ['SSH','SST'], [3, 9, 27, 81])
+        SSH_R27 = pyramid[('SSH',27)]
+
+    Cache persistant des résolutions plus basses (pyramide) des variables
+    du grand array R01 de npz_data_file, dans <donnees>/<cache_subdir>/.
+    Chaque niveau est un fichier .npy nommé par le hash du fichier source
+    (pris du catalogue, voir ResacCatalog), la résolution et le type des
+    données (dtype, par defaut DATA_DTYPE): {hash}_{VAR}_R{rr}.{dtype}.npy.
+    Un fichier source modifié donne donc un nouveau jeu de niveaux.
+
+    Les niveaux absents sont calculés en une seule lecture du R01 par blocs
+    de time_chunk pas de temps (NpzArrayReader), chaque niveau étant la
+    moyenne par blocs (makemoy) du niveau précédent (R03 depuis R01, R09
+    depuis R03, ...). Les résolutions de reso_list doivent donc etre
+    multiples les unes des autres.
+
+    Retourne un dictionnaire {(Variable, Résolution): np.memmap en lecture
+    seule} des niveaux, lus a la demande.
+    """
+    datasets_dir = get_resac_data_dir();
+    data_set_filename = os.path.join(datasets_dir,npz_data_file)
+    if not isinstance(catalog, ResacCatalog) :
+        catalog = ResacCatalog(datasets_dir)
+    def build(filename) :
+        with NpzArrayReader(filename, 'FdataAllVar') as reader :
+            return { 'shape': reader.shape, 'dtype': reader.dtype.str }
+    entry = catalog.entry(npz_data_file, build)
+    catalog.save()
+    #
+    cache_dir = os.path.join(datasets_dir,cache_subdir)
+    os.makedirs(cache_dir, exist_ok=True)
+    level_dtype = np.dtype(entry['dtype'] if dtype is None else dtype)
+    def level_filename(v, r) :
+        return os.path.join(cache_dir,f"{entry['hash'][:16]}_{v.upper()}_R{r:02d}.{level_dtype.name}.npy")
+    #
+    levels = sorted(set(r for r in reso_list if r > 1))
+    for rp,r in zip([1]+levels[:-1], levels) :
+        assert r % rp == 0, f"build_resac_pyramid: R{r:02d} n'est pas multiple de R{rp:02d}"
+    #
+    varlue = None
+    pyramid = {}
+    for v in var_list :
+        todo = [r for r in levels if not os.path.isfile(level_filename(v, r))]
+        if len(todo) > 0 :
+            if varlue is None :
+                varlue = read_npz_varlue(data_set_filename)
+            ivar = varlue.index(v)
+            print(f"pyramid cache: building '{v}' at {', '.join(f'R{r:02d}' for r in todo)} ... ", end='', flush=True)
+            t0 = time()
+            out = {}
+            with NpzArrayReader(data_set_filename, 'FdataAllVar') as reader :
+                Nimg_ = reader.shape[1]
+                for b in np.arange(0, Nimg_, time_chunk) :
+                    # chaque niveau depuis son parent, jusqu'au plus bas a produire
+                    level, rp = reader.read(ivar, b, min(b+time_chunk, Nimg_)), 1
+                    for r in levels[:levels.index(max(todo))+1] :
+                        level, rp = makemoy(level, r//rp, r//rp), r
+                        if r in todo :
+                            if r not in out :
+                                out[r] = np.lib.format.open_memmap(level_filename(v, r)+'.tmp', mode='w+',
+                                                                   dtype=level_dtype,
+                                                                   shape=(Nimg_,)+level.shape[1:])
+                            out[r][b:b+len(level)] = level
+            for r in todo :
+                out[r].flush()
+                del out[r]
+                os.replace(level_filename(v, r)+'.tmp', level_filename(v, r))
+            print(f"done in {time()-t0:.1f}s")
+        for r in levels :
+            pyramid[(v,r)] = np.load(level_filename(v, r), mmap_mode='r')
+    #
+    return pyramid
+#
+#--------------------------------------------------
+def load_resac_data_by_var_and_resol(npz_data_file, varIn, varOut, ResoIn, ResoOut,
+                                     zone=None, lat=None, lon=None, itime=None,
+                                     time_init=None, time_chunk=NPZ_STREAM_TIME_CHUNK,
+                                     catalog=LOAD_DATA_CATALOG, pyramid_cache=LOAD_DATA_PYRAMID_CACHE,
+                                     dtype=DATA_DTYPE,
+                                     nav_lat_xtremes=[ 26.57738495,  44.30360031],
+                                     nav_lon_xtremes=[-64.41895294, -40.8841095 ]) :
+    """
+    Exemple d'usage:
+        V_data_list, couple_var_reso_list, D_dico_list = \\
+            load_resac_data_by_var_and_resol("natl60_htuv_01102012_01102013.npz",
+                                             varIn,varOut,ResoIn,ResoOut)
+
+    Meme resultat que load_resac_by_var_and_resol() (liste d'arrays par couple
+    (Variable, Résolution), liste des couples et liste des dictionnaires de
+    dimensions), mais construit à partir du grand array R01 du fichier
+    npz_data_file (celui de load_resac_data()), sans jamais le charger en
+    entier: les données sont lues une variable et time_chunk pas de temps à
+    la fois (voir NpzArrayReader), la selection de zone est appliquée à ce
+    bloc puis les résolutions plus basses en sont déduites par makemoy. La
+    mémoire de pointe est donc celle d'un bloc d'une variable (plus les
+    arrays produits) au lieu des 4 variables pour toute l'année.
+
+    Les options zone, lat, lon, itime, time_init, nav_lat_xtremes et
+    nav_lon_xtremes sont celles de load_resac_data(). Avec catalog (voir
+    load_resac_by_var_and_resol()) les dictionnaires de dimensions par
+    résolution sont pris du cache du catalogue.
+
+    Avec pyramid_cache=True (par defaut LOAD_DATA_PYRAMID_CACHE) les
+    résolutions plus basses que R01 sont prises du cache de pyramide (voir
+    build_resac_pyramid(), construit au premier appel) en np.memmap, seul le
+    R01 étant encore lu dans le .npz.
+
+    Les arrays retournés sont de type dtype (par defaut DATA_DTYPE), les
+    moyennes par blocs etant calculées sur les données lues (float64).
+    """
+    import pandas as pd
+
+    if time_init is None :
+        time_init = "2012-10-01"
+    #
+    # ---- datasets location
+    datasets_dir = get_resac_data_dir();
+    data_set_filename = os.path.join(datasets_dir,npz_data_file)
+    #
+    couple_var_reso_list = []
+    for v,r in zip(varIn+varOut,ResoIn+ResoOut):
+        if not (v,r) in couple_var_reso_list :
+            couple_var_reso_list.append((v,r))
+    #
+    varlue = read_npz_varlue(data_set_filename)
+    #
+    reader = NpzArrayReader(data_set_filename, 'FdataAllVar')
+    _, Nimg_, Nlig_, Ncol_ = reader.shape #(4L, 366L, 1296L, 1377L)
+    print(f"Lecture par variable et par blocs de {time_chunk} pas de temps du fichier {npz_data_file}")
+    print(f" - Array avec {len(varlue)} variables: {varlue}, dimensions: {reader.shape}")
+    #
+    # Coordonnees R01, comme dans load_resac_data()
+    dimensions = {}
+    dimensions['time'] = pd.date_range(time_init, periods=Nimg_)
+    all_lat = np.linspace(nav_lat_xtremes[0],nav_lat_xtremes[1],num=Nlig_)
+    all_lon = np.linspace(nav_lon_xtremes[0],nav_lon_xtremes[1],num=Ncol_)
+    delta_lat = (all_lat[1]-all_lat[0])
+    delta_lon = (all_lon[1]-all_lon[0])
+    dimensions['lat'] = all_lat
+    dimensions['lon'] = all_lon
+    dimensions['lat_border'] = np.concatenate((all_lat - delta_lat/2,[all_lat[-1] + delta_lat/2]))
+    dimensions['lon_border'] = np.concatenate((all_lon - delta_lon/2,[all_lon[-1] + delta_lon/2]))
+    #
+    # selection par sous-echantillonnage dans l'axe de Time (indices des pas de temps a lire)
+    time_index = np.arange(Nimg_)
+    itsel = slice(None)
+    if itime is not None :
+        itsel = index_pattern_to_slice(itime, Nimg_, dim_axis=0)
+        time_index = time_index[itsel]
+        dimensions['time'] = dimensions['time'][itsel]
+    #
+    # selection par zones de coordonnees: calculée une seule fois sur les
+    # coordonnees, puis appliquée à chaque bloc lu
+    ilat = slice(None); ilon = slice(None)
+    if zone is not None or lat is not None or lon is not None :
+        r = max(ResoIn+ResoOut)  # la plus basse resolution, 81, normalement
+        _, _, lat_border_rLow, lon_border_rLow = build_lower_resol_vectors(all_lat, all_lon, r, borders=True)
+        lat,lon = get_real_lat_lon_limits(lat_border_rLow, lon_border_rLow, zone=zone,
+                                          lat_limits=lat, lon_limits=lon)
+        print(f" - selection par zone ou Lan/Lon ({lat}/{lon})")
+        ilat, ilon, dimensions = select_index_by_coords(dimensions, lat_limits=lat,
+                                                        lon_limits=lon)
+    #
+    all_r = sorted(set(r for v,r in couple_var_reso_list))
+    if catalog is True :
+        catalog = ResacCatalog(datasets_dir)
+    if catalog :
+        dico_all_r = catalog.resol_dic(dimensions, all_r)
+        catalog.save()
+    else:
+        dico_all_r = build_all_resol_dic(dimensions, all_r)
+    #
+    # Résolutions plus basses prises du cache de pyramide (vues np.memmap),
+    # les limites de zone a R01 etant multiples de la plus basse resolution
+    V_data_dic = {}
+    if pyramid_cache :
+        pyr_couples = [(v,r) for v,r in couple_var_reso_list if r > 1]
+        if len(pyr_couples) > 0 :
+            pyramid = build_resac_pyramid(npz_data_file,
+                                          sorted(set(v for v,r in pyr_couples), key=varlue.index),
+                                          sorted(set(r for v,r in pyr_couples)),
+                                          time_chunk=time_chunk, catalog=catalog, dtype=dtype)
+            for v,r in pyr_couples :
+                rlat = slice(None if ilat.start is None else ilat.start//r, None if ilat.stop is None else ilat.stop//r)
+                rlon = slice(None if ilon.start is None else ilon.start//r, None if ilon.stop is None else ilon.stop//r)
+                V_data_dic[(v,r)] = pyramid[(v,r)][itsel, rlat, rlon]
+    #
+    # Lecture Des Donnees, une variable et un bloc de temps a la fois
+    for v in varlue :
+        resos = [r for vv,r in couple_var_reso_list if vv == v and (vv,r) not in V_data_dic]
+        if len(resos) == 0 :
+            continue
+        ivar = varlue.index(v)
+        print(f"loading data: '{v}' at {', '.join(f'R{r:02d}' for r in resos)} ... ", end='', flush=True)
+        t0 = time()
+        for b in np.arange(0, len(time_index), time_chunk) :
+            tidx  = time_index[b:b+time_chunk]
+            block = reader.read(ivar, tidx[0], tidx[-1]+1)[tidx - tidx[0]][:,ilat,ilon]
+            for r in resos :
+                dvar = makemoy(block, r, r) if r > 1 else block
+                if b == 0 :
+                    V_data_dic[(v,r)] = np.empty((len(time_index),)+dvar.shape[1:],
+                                                 dtype=dvar.dtype if dtype is None else dtype)
+                V_data_dic[(v,r)][b:b+len(tidx)] = dvar
+            del block
+        print(f"done in {time()-t0:.1f}s")
+    reader.close()
+    #
+    V_data_list = []; D_dico_list = []
+    for v,r in couple_var_reso_list :
+        V_data_list.append(V_data_dic[(v,r)])
+        D_dico_list.append(dict(dico_all_r[f'R{r:02d}']))
+    #
+    return V_data_list, couple_var_reso_list, D_dico_list
+#
+#--------------------------------------------------
+def open_netcdf(nc_file) :
+    ''' Ouvre un fichier NetCDF avec netCDF4 ou, a defaut, avec h5py (les
+        fichiers NetCDF4 sont des fichiers HDF5). Retourne le dataset (a fermer
+        avec close()) et le dictionnaire de ses variables.
+    '''
+    try :
+        import netCDF4
+    except ImportError :
+        import h5py
+        ds = h5py.File(nc_file, 'r')
+        return ds, ds
+    ds = netCDF4.Dataset(nc_file, 'r')
+    ds.set_auto_maskandscale(False)
+    return ds, ds.variables
+#
+#--------------------------------------------------
+class NetcdfVarReader(object):
+    ''' Lecteur d'une variable d'un fichier NetCDF sans la charger en entier:
+        read() lit un bloc de temps [t0:t1, ilat, ilon] d'une variable
+        (time, y, x) ou (time, 1, y, x), read_all() la variable entiere
+        (coordonnées). Les valeurs _FillValue ou missing_value deviennent NaN,
+        scale_factor et add_offset sont appliqués.
+    '''
+    def __init__(self, nc_file, ncvar) :
+        self.ds, variables = open_netcdf(nc_file)
+        self.var = variables[ncvar]
+        if hasattr(self.var, 'ncattrs') :
+            attrs = { k: self.var.getncattr(k) for k in self.var.ncattrs() }
+        else:
+            attrs = dict(self.var.attrs)
+        attrs = { k: v.decode() if isinstance(v, bytes) else np.ravel(v)[0] if np.ndim(v) > 0 else v
+                  for k,v in attrs.items() }
+        self.fill  = [attrs[k] for k in ('_FillValue', 'missing_value') if k in attrs]
+        self.scale = attrs.get('scale_factor', None)
+        self.shift = attrs.get('add_offset', None)
+        self.units = attrs.get('units', None)
+        self.depth = len(self.var.shape) == 4 and self.var.shape[1] == 1 # (time, depth=1, y, x)
+        self.shape = (self.var.shape[0],) + tuple(self.var.shape[2:]) if self.depth else tuple(self.var.shape)
+
+    def decode(self, X) :
+        X = np.asarray(X)
+        if self.scale is not None or self.shift is not None :
+            X = X.astype(np.float64)
+        elif not np.issubdtype(X.dtype, np.floating) :
+            X = X.astype(np.float32)
+        for fill in self.fill :
+            X[X == fill] = np.nan
+        if self.scale is not None :
+            X *= self.scale
+        if self.shift is not None :
+            X += self.shift
+        return X
+
+    def read(self, t0, t1, ilat=slice(None), ilon=slice(None)) :
+        # bloc [t0:t1, ilat, ilon]
+        if self.depth :
+            return self.decode(self.var[t0:t1, 0, ilat, ilon])
+        return self.decode(self.var[t0:t1, ilat, ilon])
+
+    def read_all(self) :
+        return self.decode(self.var[...])
+
+    def close(self) :
+        self.ds.close()
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *args) :
+        self.close()
+#
+#--------------------------------------------------
+def netcdf_time_to_datetime64(values, units) :
+    ''' Axe de temps NetCDF ('seconds since 1958-01-01 00:00:00', 'days since
+        ...', ...) en datetime64[ns].
+    '''
+    step, origin = units.split(' since ')
+    factor = { 'seconds': 1, 'second': 1, 's': 1, 'minutes': 60, 'minute': 60,
+               'hours': 3600, 'hour': 3600, 'h': 3600, 'days': 86400, 'day': 86400, 'd': 86400 }[step.strip().lower()]
+    origin = np.datetime64(origin.strip().replace(' ', 'T').rstrip('Z'), 'ns')
+    return origin + np.round(np.asarray(values, dtype=np.float64)*factor*1e9).astype('timedelta64[ns]')
+#
+#--------------------------------------------------
+def ingest_netcdf(nc_files, var_list=['SSH','SST','U','V'], reso_list=[1, 3, 9, 27, 81],
+                  var_map=NETCDF_VAR_MAP, time_name='time_counter', lat_name='nav_lat',
+                  lon_name='nav_lon', ilat=None, ilon=None, subdir='NATL60byVar',
+                  data_prefix='NATL60', data_suffix='', time_chunk=NPZ_STREAM_TIME_CHUNK,
+                  dtype=DATA_DTYPE, overwrite=False) :
+    """
+    Exemple d'usage:
+        ingest_netcdf(sorted(glob.glob('/data/NATL60/NATL60-CJM165_y2013m*.1d_SSH.nc')),
+                      ['SSH'], [1, 3, 9, 27, 81])
+
+    Construit les fichiers <donnees>/<subdir>/NATL60_{VAR}_R{rr}.npy et
+    NATL60_coords_R{rr}.npz directement depuis les sorties NetCDF du modele.
+
+    Pour chaque variable de var_list, les fichiers de nc_files contenant sa
+    variable NetCDF (var_map, par defaut NETCDF_VAR_MAP de resacartparm.py)
+    sont lus a la suite, dans l'ordre donné, par blocs de time_chunk pas de
+    temps (NetcdfVarReader). Chaque bloc, restreint aux indices ilat/ilon
+    (slices, par ex. pour une region) et tronqué aux multiples de la plus
+    basse resolution, est ecrit dans le R01 et moyenné par blocs (makemoy)
+    pour chaque niveau depuis le precedent (R03 depuis R01, R09 depuis R03,
+    ...): une seule lecture des données, une memoire bornée par time_chunk.
+    Les resolutions de reso_list doivent etre multiples les unes des autres.
+    Les variables deja produites sont passées, sauf avec overwrite=True.
+
+    Les coordonnées (time_name, lat_name, lon_name) sont lues dans les
+    fichiers de la premiere variable. Comme dans load_resac_data, les
+    vecteurs lat/lon sont une grille reguliere limitée par les valeurs
+    extremes de la zone, ceux des basses resolutions sont donnés par
+    build_all_resol_dic().
+    """
+    datasets_dir = get_resac_data_dir();
+    out_dir = os.path.join(datasets_dir,subdir)
+    os.makedirs(out_dir, exist_ok=True)
+    if isinstance(nc_files, str) :
+        nc_files = [nc_files]
+    nc_files = [os.path.join(datasets_dir,f) for f in nc_files]
+    ilat = slice(None) if ilat is None else ilat
+    ilon = slice(None) if ilon is None else ilon
+    #
+    levels = sorted(set(reso_list) | {1})
+    for rp,r in zip(levels[:-1], levels[1:]) :
+        assert r % rp == 0, f"ingest_netcdf: R{r:02d} n'est pas multiple de R{rp:02d}"
+    def data_filename(v, r) :
+        return os.path.join(out_dir,f"{data_prefix}_{v.upper()}_R{r:02d}{data_suffix}.npy")
+    #
+    # fichiers de chaque variable, dans l'ordre de nc_files
+    var_files = { v: [] for v in var_list }
+    for f in nc_files :
+        ds, variables = open_netcdf(f)
+        for v in var_list :
+            if var_map[v] in variables :
+                var_files[v].append(f)
+        ds.close()
+    for v in var_list :
+        if len(var_files[v]) == 0 :
+            raise ValueError(f"ingest_netcdf: variable '{v}' ('{var_map[v]}') absente des fichiers NetCDF")
+    #
+    # taille R01 de la zone, tronquée aux multiples de la plus basse resolution
+    with NetcdfVarReader(var_files[var_list[0]][0], var_map[var_list[0]]) as reader :
+        Nlig_ = len(range(*ilat.indices(reader.shape[1])))//levels[-1]*levels[-1]
+        Ncol_ = len(range(*ilon.indices(reader.shape[2])))//levels[-1]*levels[-1]
+    #
+    for v in var_list :
+        if not overwrite and all(os.path.isfile(data_filename(v, r)) for r in reso_list) :
+            print(f"ingest_netcdf: '{v}' deja produit, on passe")
+            continue
+        readers = [NetcdfVarReader(f, var_map[v]) for f in var_files[v]]
+        Nimg_ = sum(reader.shape[0] for reader in readers)
+        print(f"ingest_netcdf: '{v}' {Nimg_} pas de temps, R01 {(Nlig_, Ncol_)} -> "+\
+              f"{', '.join(f'R{r:02d}' for r in reso_list)} ... ", end='', flush=True)
+        t0 = time()
+        out = {}
+        b = 0
+        for reader in readers :
+            for t in np.arange(0, reader.shape[0], time_chunk) :
+                level = reader.read(t, min(t+time_chunk, reader.shape[0]), ilat, ilon)[:, :Nlig_, :Ncol_]
+                assert level.shape[1:] == (Nlig_, Ncol_), f"ingest_netcdf: '{v}' de taille {level.shape[1:]} differente de {(Nlig_, Ncol_)}"
+                rp = 1
+                for r in levels :
+                    if r > rp :
+                        level, rp = makemoy(level, r//rp, r//rp), r
+                    if r in reso_list :
+                        if r not in out :
+                            out[r] = np.lib.format.open_memmap(data_filename(v, r)+'.tmp', mode='w+',
+                                                               dtype=level.dtype if dtype is None else dtype,
+                                                               shape=(Nimg_,)+level.shape[1:])
+                        out[r][b:b+len(level)] = level
+                b += len(level)
+            reader.close()
+        for r in list(out) :
+            out[r].flush()
+            del out[r]
+            os.replace(data_filename(v, r)+'.tmp', data_filename(v, r))
+        print(f"done in {time()-t0:.1f}s")
+    #
+    # Coordonnees : TIME (de tous les fichiers de la premiere variable)
+    time_axis = []
+    for f in var_files[var_list[0]] :
+        with NetcdfVarReader(f, time_name) as reader :
+            if reader.units is not None and ' since ' in reader.units :
+                time_axis.append(netcdf_time_to_datetime64(reader.read_all(), reader.units))
+            else:
+                time_axis.append(reader.read_all())
+    # Coordonnees : Lat / Lon (au centre du pixel), grille reguliere entre les extremes de la zone
+    with NetcdfVarReader(var_files[var_list[0]][0], lat_name) as reader :
+        nav_lat = reader.read_all()
+    with NetcdfVarReader(var_files[var_list[0]][0], lon_name) as reader :
+        nav_lon = reader.read_all()
+    if np.ndim(nav_lat) == 2 :
+        nav_lat = nav_lat[ilat, ilon][:Nlig_, :Ncol_]
+        nav_lon = nav_lon[ilat, ilon][:Nlig_, :Ncol_]
+    else:
+        nav_lat = nav_lat[ilat][:Nlig_]
+        nav_lon = nav_lon[ilon][:Ncol_]
+    all_lat = np.linspace(np.nanmin(nav_lat),np.nanmax(nav_lat),num=Nlig_)
+    all_lon = np.linspace(np.nanmin(nav_lon),np.nanmax(nav_lon),num=Ncol_)
+    delta_lat = (all_lat[1]-all_lat[0])
+    delta_lon = (all_lon[1]-all_lon[0])
+    dic_r1 = { 'time': np.concatenate(time_axis),
+               'lat' : all_lat,
+               'lon' : all_lon,
+               'lat_border' : np.concatenate((all_lat - delta_lat/2,[all_lat[-1] + delta_lat/2])),
+               'lon_border' : np.concatenate((all_lon - delta_lon/2,[all_lon[-1] + delta_lon/2])) }
+    dico_all_r = build_all_resol_dic(dic_r1, reso_list)
+    for r in reso_list :
+        dic = dico_all_r[f'R{r:02d}']
+        np.savez(os.path.join(out_dir,f"{data_prefix}_coords_R{r:02d}{data_suffix}.npz"),
+                 time=dic['time'], latitude=dic['lat'], longitude=dic['lon'],
+                 latitude_border=dic['lat_border'], longitude_border=dic['lon_border'])
+    print(f"ingest_netcdf: coordonnées R{', R'.join(f'{r:02d}' for r in reso_list)} ecrites dans {out_dir}")
+#
+#======================================================================
+# Scenario en memoire partagée (serveur de données)
+#----------------------------------------------------------------------
+# Un processus serveur (serve_resac_scenario, voir resacserver.py) lit et code
+# une fois les données d'un scenario et les publie en memoire partagée; les
+# processus d'entrainement (OB*.py, PTR*.py, ...) lancés en parallele s'y
+# attachent sans copie (get_resac_scenario).
+SHARED_SCENARIO_ARRAYS = ('x_train', 'y_train', 'x_valid', 'y_valid', 'x_test', 'y_test',
+                          'VAout_brute', 'VVout_brute', 'VTout_brute')
+#--------------------------------------------------
+def prepare_resac_scenario(varIn, varOut, ResoIn, ResoOut, codefunc="fit01",
+                           noise=RESAC_WITH_NOISE, dtype=DATA_DTYPE, **load_kw) :
+    """
+    Exemple d'usage:
+        scenario = prepare_resac_scenario(varIn,varOut,ResoIn,ResoOut)
+        x_train, y_train = scenario['x_train'], scenario['y_train']
+
+    Phase de lecture et de codage commune aux scripts d'apprentissage:
+    lecture des données (load_resac_by_var_and_resol, ou load_resac_data et
+    setresolution si LOAD_DATA_BY_VAR_AND_RESOL est False), repartition
+    App/Val/Test (isetalea), mise en forme (N,1,H,W) puis codage (codefunc)
+    de l'ensemble d'App et recodage des ensembles de Val et de Test avec les
+    memes parametres, directement en channel last (codage_nhwc).
+
+    Avec noise=True (par defaut RESAC_WITH_NOISE) les entrées sont les données
+    satellites (Satellite/SatbyVar/SAT_{VAR}_R{rr}s.npy) et les sorties les
+    données NATL60 aux dimensions satellites (NATL60byVarRXXs). Les autres
+    options (zone, lat, lon, itime, ...) sont passées au chargeur.
+
+    Retourne un dictionnaire avec les listes d'arrays codés (N,H,W,1) 'x_train',
+    'y_train', 'x_valid', 'y_valid', 'x_test', 'y_test', les sorties brutes (N,1,H,W)
+    'VAout_brute', 'VVout_brute', 'VTout_brute', les parametres de codage
+    'coparmAin', 'coparmAout', les indices 'indA', 'indV', 'indT', le
+    'time_axis' et les dictionnaires de dimensions 'Din_dico_list' et
+    'Dout_dico_list' (None si LOAD_DATA_BY_VAR_AND_RESOL est False).
+    """
+    print("Lecture Des Données en cours ...")
+    Din_dico_list = Dout_dico_list = None
+    if LOAD_DATA_BY_VAR_AND_RESOL :
+        if noise : # entrées satellites bruitées, sorties NATL60 aux dimensions satellites
+            print('Les données en entrées sont bruitées :', noise, "\n")
+            Vin_list, cin_list, Din_list = load_resac_by_var_and_resol(varIn, [], ResoIn, [],
+                                                                       subdir='Satellite/SatbyVar',
+                                                                       data_prefix='SAT', data_suffix='s',
+                                                                       dtype=dtype, **load_kw)
+            Vout_list, cout_list, Dout_list = load_resac_by_var_and_resol([], varOut, [], ResoOut,
+                                                                          subdir='NATL60byVarRXXs',
+                                                                          data_suffix='s',
+                                                                          dtype=dtype, **load_kw)
+        else :
+            Vin_list, cin_list, Din_list = load_resac_by_var_and_resol(varIn, varOut, ResoIn, ResoOut,
+                                                                       dtype=dtype, **load_kw)
+            Vout_list, cout_list, Dout_list = Vin_list, cin_list, Din_list
+        time_axis = Din_list[0]['time']
+        # Splitset Ens App - Val - Test
+        print(f"Splitset Ens App - Val - Test {pcentSet}% or", end='')
+        indA, indV, indT = isetalea(Vin_list[0].shape[0], pcentSet)
+        print(f" {(len(indA), len(indV), len(indT))} images par ensemble.")
+        VAout_brute, VVout_brute, VTout_brute = data_repartition(Vout_list, cout_list, varOut, ResoOut,
+                                                                 indA, indV, indT, dtype=dtype)
+        VAin_brute, VVin_brute, VTin_brute = data_repartition(Vin_list, cin_list, varIn, ResoIn,
+                                                              indA, indV, indT, dtype=dtype)
+        Din_dico_list = dic_dimension_repartition(Din_list, cin_list, varIn, ResoIn)
+        Dout_dico_list = dic_dimension_repartition(Dout_list, cout_list, varOut, ResoOut)
+        del Vin_list, Vout_list
+    else :
+        FdataAllVar, varlue, diccoord = load_resac_data("natl60_htuv_01102012_01102013.npz",
+                                                        dtype=dtype, **load_kw)
+        time_axis = diccoord['time']
+        # Splitset Ens App - Val - Test
+        print("Splitset Ens App - Val - Test ...", end='')
+        indA, indV, indT = isetalea(FdataAllVar.shape[1], pcentSet)
+        # chaque couple (Variable, Résolution) une fois sur tout l'axe de Time
+        V_data_list, couple_var_reso_list = setresolution_couples(FdataAllVar, varlue, varIn, varOut,
+                                                                  ResoIn, ResoOut, dtype=dtype)
+        del FdataAllVar
+        VAout_brute, VVout_brute, VTout_brute = data_repartition(V_data_list, couple_var_reso_list, varOut, ResoOut,
+                                                                 indA, indV, indT, dtype=dtype)
+        VAin_brute, VVin_brute, VTin_brute = data_repartition(V_data_list, couple_var_reso_list, varIn, ResoIn,
+                                                              indA, indV, indT, dtype=dtype)
+        del V_data_list
+    #
+    print("# Mise en forme")
+    for Vlist in (VAin_brute, VVin_brute, VTin_brute, VAout_brute, VVout_brute, VTout_brute) :
+        for i,X in enumerate(Vlist) :
+            Vlist[i] = X.reshape((len(X),1)+X.shape[1:])
+    for Xin,Xout,lbl in zip((VAin_brute, VVin_brute, VTin_brute), (VAout_brute, VVout_brute, VTout_brute), "AVT") :
+        if len(Xin[0]) != len(Xout[0]) :
+            raise ValueError(f"Problème {lbl}")
+    #
+    print("# Codification / Normalisation")
+    # codage directement en channel last (N,H,W,1) float32
+    x_train, coparmAin  = codage_nhwc_multivar(VAin_brute, codefunc, verbose=True)
+    y_train, coparmAout = codage_nhwc_multivar(VAout_brute, codefunc, verbose=True)
+    # Val et Test: meme codage et avec les memes parametres que l'apprentissage
+    x_valid = recodage_nhwc_multivar(VVin_brute, coparmAin)
+    y_valid = recodage_nhwc_multivar(VVout_brute, coparmAout)
+    x_test  = recodage_nhwc_multivar(VTin_brute, coparmAin)
+    y_test  = recodage_nhwc_multivar(VTout_brute, coparmAout)
+    del VAin_brute, VVin_brute, VTin_brute
+    #
+    return { 'x_train': x_train, 'y_train': y_train, 'x_valid': x_valid, 'y_valid': y_valid,
+             'x_test': x_test, 'y_test': y_test,
+             'VAout_brute': VAout_brute, 'VVout_brute': VVout_brute, 'VTout_brute': VTout_brute,
+             'coparmAin': coparmAin, 'coparmAout': coparmAout,
+             'indA': indA, 'indV': indV, 'indT': indT, 'time_axis': time_axis,
+             'Din_dico_list': Din_dico_list, 'Dout_dico_list': Dout_dico_list }
+#--------------------------------------------------
+def resac_scenario_name(varIn, varOut, ResoIn, ResoOut, codefunc="fit01",
+                        noise=RESAC_WITH_NOISE, dtype=DATA_DTYPE, **load_kw) :
+    ''' Nom du segment de memoire partagée d'un scenario. Il depend de tout ce
+        qui change les arrays: variables et resolutions, codage, bruit, type,
+        options de lecture, repartition pcentSet et dossier des données.
+    '''
+    key = repr(([str(v) for v in varIn], [str(v) for v in varOut],
+                [int(r) for r in ResoIn], [int(r) for r in ResoOut], codefunc, bool(noise),
+                None if dtype is None else np.dtype(dtype).str, sorted(load_kw.items()),
+                [float(p) for p in pcentSet], LOAD_DATA_BY_VAR_AND_RESOL, get_resac_data_dir()))
+    return "resac_" + hashlib.sha1(key.encode()).hexdigest()[:16]
+#--------------------------------------------------
+def open_shared_memory(name) :
+    ''' Ouvre un segment de memoire partagée existant sans en prendre la
+        responsabilité: sinon le resource_tracker de Python (< 3.13) le
+        detruirait a la sortie du processus qui n'a fait que s'y attacher.
+    '''
+    if sys.version_info >= (3, 13) :
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    try :
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception :
+        pass
+    return shm
+#--------------------------------------------------
+def unlink_shared_memory(name) :
+    ''' Detruit le segment de memoire partagée name s'il existe.
+    '''
+    try :
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError :
+        return
+    shm.close()
+    shm.unlink()
+#--------------------------------------------------
+def publish_resac_scenario(scenario, name, align=64) :
+    ''' Copie un scenario (prepare_resac_scenario) en memoire partagée: un
+        segment '{name}_data' ou les arrays de SHARED_SCENARIO_ARRAYS sont
+        rangés bout a bout (alignés sur align octets), puis un segment '{name}'
+        avec le manifeste (pickle des positions, shapes et dtypes des arrays et
+        des autres elements du scenario). La taille du manifeste est ecrite en
+        dernier: un processus qui la lit non nulle trouve des données completes.
+
+        Retourne les deux segments, a fermer et detruire (close, unlink) par
+        l'appelant quand le scenario n'est plus servi.
+    '''
+    layout = {}; meta = {}; size = 0
+    for key, value in scenario.items() :
+        if key in SHARED_SCENARIO_ARRAYS :
+            layout[key] = []
+            for X in value :
+                layout[key].append((size, X.shape, X.dtype.str))
+                size += -(-X.nbytes // align) * align
+        elif not key.startswith('_') :
+            meta[key] = value
+    unlink_shared_memory(f"{name}_data") # reste d'un serveur interrompu
+    shm_data = shared_memory.SharedMemory(name=f"{name}_data", create=True, size=max(size, 1))
+    for key, items in layout.items() :
+        for X, (offset, shape, dtype) in zip(scenario[key], items) :
+            np.ndarray(shape, dtype=dtype, buffer=shm_data.buf, offset=offset)[...] = X
+    manifest = pickle.dumps({ 'layout': layout, 'meta': meta }, protocol=pickle.HIGHEST_PROTOCOL)
+    shm_meta = shared_memory.SharedMemory(name=name, create=True, size=8+len(manifest))
+    shm_meta.buf[8:8+len(manifest)] = manifest
+    shm_meta.buf[:8] = len(manifest).to_bytes(8, 'little')
+    print(f"scenario '{name}' publié en memoire partagée ({size/2**20:.1f} Mo)")
+    return [shm_meta, shm_data]
+#--------------------------------------------------
+def attach_resac_scenario(name) :
+    ''' S'attache a un scenario publié par publish_resac_scenario.
+
+        Retourne le dictionnaire du scenario dont les arrays sont des vues
+        numpy en lecture seule sur la memoire partagée (aucune copie), ou None
+        si aucun serveur ne publie (ou n'a fini de publier) ce scenario.
+    '''
+    try :
+        shm_meta = open_shared_memory(name)
+    except FileNotFoundError :
+        return None
+    nbytes = int.from_bytes(bytes(shm_meta.buf[:8]), 'little')
+    manifest = pickle.loads(bytes(shm_meta.buf[8:8+nbytes])) if nbytes > 0 else None
+    shm_meta.close()
+    if manifest is None :
+        return None
+    shm_data = open_shared_memory(f"{name}_data")
+    scenario = dict(manifest['meta'])
+    for key, items in manifest['layout'].items() :
+        scenario[key] = []
+        for offset, shape, dtype in items :
+            X = np.ndarray(shape, dtype=dtype, buffer=shm_data.buf, offset=offset)
+            X.flags.writeable = False
+            scenario[key].append(X)
+    scenario['_shm'] = shm_data # le segment reste ouvert tant que le scenario existe
+    return scenario
+#--------------------------------------------------
+# Cache disque des tenseurs codés d'un scenario
+#--------------------------------------------------
+def source_fingerprint(paths) :
+    ''' Empreinte des fichiers sources (chemins relatifs a RESAC_DATASETS_DIR,
+        fichiers ou dossiers parcourus recursivement): nom, taille et date de
+        modification de chaque fichier et dossier, sans relire les Go de
+        données. Un fichier regeneré, converti ou remplacé (ou un dossier
+        .chunks reconverti) change l'empreinte.
+    '''
+    datasets_dir = get_resac_data_dir()
+    h = hashlib.sha1()
+    for path in paths :
+        full = os.path.join(datasets_dir, path)
+        if os.path.isdir(full) :
+            files = sorted([root for root, dirs, fs in os.walk(full)] +
+                           [os.path.join(root, f) for root, dirs, fs in os.walk(full) for f in fs])
+        else :
+            files = [full]
+        for f in files :
+            try :
+                st = os.stat(f)
+                h.update(repr((os.path.relpath(f, datasets_dir), st.st_size, st.st_mtime_ns)).encode())
+            except FileNotFoundError :
+                h.update(repr((os.path.relpath(f, datasets_dir), None)).encode())
+    return h.hexdigest()
+#--------------------------------------------------
+def resac_cache_key(*settings, sources=()) :
+    # clé du cache: hash des parametres (repr) et de l'empreinte des sources
+    key = repr(settings) + source_fingerprint(sources)
+    return "resac_" + hashlib.sha1(key.encode()).hexdigest()[:16]
+#--------------------------------------------------
+def scenario_sources(noise=RESAC_WITH_NOISE, subdir='NATL60byVar', npz_stream=False, **load_kw) :
+    # fichiers sources (relatifs a RESAC_DATASETS_DIR) lus par prepare_resac_scenario
+    # (ou par load_resac_data_by_var_and_resol avec npz_stream, dans resacart.py).
+    # Pas le catalogue (LOAD_DATA_CATALOG): reecrit a chaque lecture, il est
+    # deduit des fichiers de données, deja dans l'empreinte.
+    if not LOAD_DATA_BY_VAR_AND_RESOL or npz_stream :
+        sources = ["natl60_htuv_01102012_01102013.npz"]
+        if not npz_stream and load_kw.get('chunked', LOAD_DATA_CHUNKED) :
+            # load_resac_data lit alors les R01 par variable stockés par morceaux
+            prefix, suffix = load_kw.get('data_prefix', 'NATL60'), load_kw.get('data_suffix', '')
+            sources += [os.path.join(subdir, f"{prefix}_{v.upper()}_R01{suffix}{CHUNKED_EXT}")
+                        for v in load_kw.get('chunked_var_list', ['SSH','SST','U','V'])]
+    elif noise :
+        sources = ['Satellite/SatbyVar', 'NATL60byVarRXXs']
+    else :
+        sources = [subdir]
+    return sources
+#--------------------------------------------------
+def save_scenario_cache(key, scenario) :
+    ''' Ecrit un scenario dans le cache, dossier
+        RESAC_DATASETS_DIR/SCENARIO_CACHE_SUBDIR/key: un fichier .npy par array
+        des listes d'arrays (x_train, ..., VAout_brute, ...) et un pickle pour
+        le reste (coparm, indices, time_axis, dictionnaires de dimensions).
+        Ecrit dans un dossier temporaire renommé a la fin: un autre processus
+        ne voit jamais de cache incomplet.
+    '''
+    cache_dir = os.path.join(get_resac_data_dir(), SCENARIO_CACHE_SUBDIR, key)
+    if os.path.isdir(cache_dir) :
+        return cache_dir
+    tmp_dir = f"{cache_dir}.tmp{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    layout = {}; meta = {}
+    for name, value in scenario.items() :
+        if name.startswith('_') :
+            continue
+        if isinstance(value, (list, tuple)) and len(value) and all(hasattr(X, 'shape') for X in value) :
+            layout[name] = len(value)
+            for i,X in enumerate(value) :
+                np.save(os.path.join(tmp_dir, f"{name}_{i}.npy"), np.asarray(X))
+        else :
+            meta[name] = value
+    with open(os.path.join(tmp_dir, 'scenario.pkl'), 'wb') as f :
+        pickle.dump({ 'layout': layout, 'meta': meta }, f, protocol=pickle.HIGHEST_PROTOCOL)
+    try :
+        os.rename(tmp_dir, cache_dir)
+        print(f"scenario '{key}' sauvé dans le cache")
+    except OSError : # ecrit entre temps par un autre processus
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return cache_dir
+#--------------------------------------------------
+def load_scenario_cache(key, mmap_mode='r') :
+    ''' Relit un scenario du cache (save_scenario_cache): les arrays sont
+        memory-mappés (mmap_mode), seules les pages utilisées sont lues.
+        Retourne None si la clé n'est pas dans le cache.
+    '''
+    cache_dir = os.path.join(get_resac_data_dir(), SCENARIO_CACHE_SUBDIR, key)
+    try :
+        with open(os.path.join(cache_dir, 'scenario.pkl'), 'rb') as f :
+            manifest = pickle.load(f)
+    except FileNotFoundError :
+        return None
+    scenario = dict(manifest['meta'])
+    for name, n in manifest['layout'].items() :
+        scenario[name] = [np.load(os.path.join(cache_dir, f"{name}_{i}.npy"), mmap_mode=mmap_mode)
+                          for i in range(n)]
+    return scenario
+#--------------------------------------------------
+def get_resac_scenario(varIn, varOut, ResoIn, ResoOut, codefunc="fit01",
+                       noise=RESAC_WITH_NOISE, dtype=DATA_DTYPE, shared=USE_SHARED_DATA,
+                       cache=USE_SCENARIO_CACHE, **load_kw) :
+    """
+    Exemple d'usage:
+        scenario = get_resac_scenario(varIn,varOut,ResoIn,ResoOut)
+
+    Donne le scenario (voir prepare_resac_scenario) publié en memoire partagée
+    par un serveur (serve_resac_scenario) s'il y en a un et si shared est
+    True (par defaut USE_SHARED_DATA), sinon celui du cache disque si cache
+    est True (par defaut USE_SCENARIO_CACHE), sinon le lit et le code
+    localement (et le met dans le cache).
+    """
+    name = resac_scenario_name(varIn, varOut, ResoIn, ResoOut, codefunc, noise, dtype, **load_kw)
+    if shared :
+        scenario = attach_resac_scenario(name)
+        if scenario is not None :
+            print(f"scenario '{name}' attaché en memoire partagée")
+            return scenario
+        print(f"scenario '{name}' non publié en memoire partagée, lecture locale")
+    if cache :
+        key = resac_cache_key(name, sources=scenario_sources(noise, **load_kw))
+        scenario = load_scenario_cache(key)
+        if scenario is not None :
+            print(f"scenario '{key}' relu du cache")
+            return scenario
+    scenario = prepare_resac_scenario(varIn, varOut, ResoIn, ResoOut, codefunc, noise, dtype, **load_kw)
+    if cache :
+        save_scenario_cache(key, scenario)
+    return scenario
+#--------------------------------------------------
+def serve_resac_scenario(varIn=varIn, varOut=varOut, ResoIn=ResoIn, ResoOut=ResoOut,
+                         codefunc="fit01", noise=RESAC_WITH_NOISE, dtype=DATA_DTYPE, **load_kw) :
+    """
+    Exemple d'usage:
+        python resacserver.py      (scenario SCENARCHI de resacartparm.py)
+
+    Lit et code une fois le scenario (ou le relit du cache), le publie en memoire partagée puis
+    attend (Ctrl-C ou SIGTERM) en gardant les segments en vie. Les
+    processus d'entrainement du meme scenario (meme resacartparm.py) s'y
+    attachent avec get_resac_scenario. Les segments sont detruits a la fin.
+    """
+    name = resac_scenario_name(varIn, varOut, ResoIn, ResoOut, codefunc, noise, dtype, **load_kw)
+    if attach_resac_scenario(name) is not None :
+        print(f"scenario '{name}' deja publié par un autre serveur")
+        return
+    segments = publish_resac_scenario(get_resac_scenario(varIn, varOut, ResoIn, ResoOut, codefunc,
+                                                         noise, dtype, shared=False, **load_kw), name)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try :
+        print("serveur en attente (Ctrl-C pour arreter) ...")
+        threading.Event().wait()
+    except KeyboardInterrupt :
+        pass
+    finally :
+        for shm in segments :
+            shm.close()
+            shm.unlink()
+        print(f"scenario '{name}' retiré de la memoire partagée")
+#
 #----------------------------------------------------------------------
 def visuB (X_brute, varIO, Resolst, D_dicolst, VisuB, Ndon, strset, inout, im2show,
            qmask=None, qscale=None, qmode=None, calX0=None, 
            fsizeimg=None, fsizesome=None, fsizehquiv=None,
            figdir='.', savefig=False) :
     Nvar = len(varIO)
+    X_brute = [np.asarray(X) for X in X_brute] # images des vues IndexedSet
     calX0_= None
     if calX0 is not None :
         calX0_ = calX0[im2show]
@@ -2148,12 +4926,13 @@ def setresult(Mdl, x_set, strset, VXout_brute, calX, coparm,
               figdir='.', savefig=False) :
 
     imshow_lbl = '-'.join([str(n) for n in im2show])
+    VXout_brute = [np.asarray(X) for X in VXout_brute] # images des vues IndexedSet
     # Predicted coded data
     y_scale = Mdl.predict(x_set);
     if len(varOut)==1 : # Si une seule sortie mettre y_scale en forme de list comme l'est y_train
         y_scale = [y_scale];
     for i in np.arange(NvarOut):
-        y_scale[i] = y_scale[i].transpose(0,3,1,2)
+        y_scale[i] = as_data_dtype(y_scale[i].transpose(0,3,1,2))
     
     #BACK TO BRUTE
 
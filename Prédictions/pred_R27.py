@@ -26,26 +26,17 @@ SSH_R27= np.load(os.path.join(datasets_dir,data_dir,"NATL60_SSH_R27.npy"))
 
 print(parametre)
 
-def normalisation_donnees(jour=0,SSH_R81=SSH_R81,SST_R27=SST_R27, parametre=parametre): 
-  #Normalisation des donnees d'entrées adaptée au modele, parametre de normalisation calculé lors de l'apprentissage
-  #Jour [0;365] -> 0 : 1er Octobre 2012 au 1er Octobre 2013
-  SSH_R81_norm = recodage(SSH_R81[jour,:,:], parametre[0][0])                                                                                 
-  SST_R27_norm = recodage(SST_R27[jour,:,:], parametre[0][1])
-  return SSH_R81_norm,  SST_R27_norm
-
-def decodage_sortie(predictions,parametre):
-  #Dé-normalisation' des prédictions pour les comparer aux données modèles
-  SSH_R27_dec = decodage(predictions[0], parametre[1][0])
-  return  SSH_R27_dec
+#Modele en unités physiques: codage des entrées et décodage des sorties faits dans le graphe,
+#a partir des parametres de codage de l'apprentissage (plus de recodage/decodage sur le host)
+model_phys = model_with_codage(model, parametre[0], parametre[1])
 
-def predictions_decodees(model, jour=0): #Jour correspond à la journée que l'on veut prédire/comparer
-  SSH_R81_norm, SST_R27_norm = normalisation_donnees(jour=jour) #Entrées normalisées
-  R81, R27 = SSH_R81_norm.shape,SST_R27_norm.shape #Récupère les différentes résolutions
+def predictions_decodees(model_phys, jour=0): #Jour correspond à la journée que l'on veut prédire/comparer
+  #Jour [0;365] -> 0 : 1er Octobre 2012 au 1er Octobre 2013
+  R81, R27 = SSH_R81[jour].shape,SST_R27[jour].shape #Récupère les différentes résolutions
 
-#Prédictions de SSH_R27, SSH_R09, U_R09, V_R09
-  sample_to_predict = [SSH_R81_norm.reshape((1,R81[0],R81[1],1)), SST_R27_norm.reshape((1,R27[0],R27[1],1))] #Input en "4" dimensions donc reshape
-  predictions = model.predict(sample_to_predict)  
-  SSH_R27_dec = decodage_sortie(predictions, parametre)
+#Prédictions de SSH_R27 a partir des entrées brutes
+  sample_to_predict = [SSH_R81[jour].reshape((1,R81[0],R81[1],1)), SST_R27[jour].reshape((1,R27[0],R27[1],1))] #Input en "4" dimensions donc reshape
+  SSH_R27_dec = model_phys.predict(sample_to_predict)
 
 #Création des différences prédictions/modèle
   #difference_R09 = SSH_R09[jour,:,:] - SSH_R09_dec.reshape(R09)
@@ -64,7 +55,7 @@ from keras.optimizers import Adam
 #Prédictions par resac et interpolation bicubic
 
 jour = 260#330 est le pire 
-prediction = predictions_decodees(model,jour)
+prediction = predictions_decodees(model_phys,jour)
 
 resac_flatten   = prediction.reshape(-1)
 #Création des fichiers et des plots
@@ -28,28 +28,17 @@ SSH_R01= np.load(os.path.join(datasets_dir,'NATL60byVarRXXs',"NATL60_SSH_R01s.np
 
 print(parametre)
 
-def normalisation_donnees(jour=0,SSH_R09s=SSH_R09s,SST_R03s=SST_R03s, parametre=parametre): 
-  #Normalisation des donnees d'entrées adaptée au modele, parametre de normalisation calculé lors de l'apprentissage
+#Modele en unités physiques: codage des entrées et décodage des sorties faits dans le graphe,
+#a partir des parametres de codage de l'apprentissage (plus de recodage/decodage sur le host)
+model_phys = model_with_codage(model, parametre[0], parametre[1])
+
+def predictions_decodees(model_phys, jour=0): #Jour correspond à la journée que l'on veut prédire/comparer
   #Jour [0;365] -> 0 : 1er Octobre 2012 au 1er Octobre 2013
-  SSH_R09_norm = recodage(SSH_R09s[jour,:,:], parametre[0][0])                                                                                 
-  SST_R03_norm = recodage(SST_R03s[jour,:,:], parametre[0][1])
-  SST_R01_norm = recodage(SST_R01s[jour,:,:], parametre[0][2])
-  return SSH_R09_norm,  SST_R03_norm, SST_R01_norm
-
-def decodage_sortie(predictions,parametre):
-  #Dé-normalisation' des prédictions pour les comparer aux données modèles
-  SSH_R03_dec = decodage(predictions[0], parametre[1][0])
-  SSH_R01_dec = decodage(predictions[1], parametre[1][1])
-  return  SSH_R03_dec, SSH_R01_dec
-
-def predictions_decodees(model, jour=0): #Jour correspond à la journée que l'on veut prédire/comparer
-  SSH_R09_norm, SST_R03_norm, SST_R01_norm = normalisation_donnees(jour=jour) #Entrées normalisées
-  R09, R03, R01 = SSH_R09_norm.shape,SST_R03_norm.shape, SST_R01_norm.shape #Récupère les différentes résolutions
-
-#Prédictions de SSH_R27, SSH_R09, U_R09, V_R09
-  sample_to_predict = [SSH_R09_norm.reshape((1,R09[0],R09[1],1)), SST_R03_norm.reshape((1,R03[0],R03[1],1)), SST_R01_norm.reshape((1,R01[0],R01[1],1))] #Input en "4" dimensions donc reshape
-  predictions = model.predict(sample_to_predict)  
-  SSH_R03_dec, SSH_R01_dec = decodage_sortie(predictions, parametre)
+  R09, R03, R01 = SSH_R09s[jour].shape,SST_R03s[jour].shape, SST_R01s[jour].shape #Récupère les différentes résolutions
+
+#Prédictions de SSH_R03, SSH_R01 a partir des entrées brutes
+  sample_to_predict = [SSH_R09s[jour].reshape((1,R09[0],R09[1],1)), SST_R03s[jour].reshape((1,R03[0],R03[1],1)), SST_R01s[jour].reshape((1,R01[0],R01[1],1))] #Input en "4" dimensions donc reshape
+  SSH_R03_dec, SSH_R01_dec = model_phys.predict(sample_to_predict)
 
 #Création des différences prédictions/modèle
   #difference_R09 = SSH_R09[jour,:,:] - SSH_R09_dec.reshape(R09)
@@ -97,7 +86,7 @@ def bicubicR03(height, width,input):
 #Prédictions par resac et interpolation bicubic
 
 jour = 330#330 est le pire 
-predictionR03, predictionR01 = predictions_decodees(model,jour)
+predictionR03, predictionR01 = predictions_decodees(model_phys,jour)
 bicubic03s = bicubicR03(72,90, SSH_R09s)
 bicubic01s = bicubicR01(72,90, SSH_R09s)
 
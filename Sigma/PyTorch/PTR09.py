@@ -15,307 +15,28 @@ from resacartdef import *
 Niter, Bsize = 2000, 32
 lr = 0.001#2*(10**(-2.89637961)) #learning rate utiisé dans l'architecture
 
-def load_resac_by_var_and_resol(varIn,varOut,ResoIn,ResoOut, subdir='NATL60byVar', noise=RESAC_WITH_NOISE):
-    """
-    Exemple d'usage:
-        V_data_list, couple_var_reso_list = load_resac_by_var_and_resol(varIn,varOut,ResoIn,ResoOut)
-
-    Lecture des données RESAC par variable/résolution.  La function s'attend à trouver
-    le répertoire des données dans la variable d'environnement RESAC_DATASETS_DIR.
-
-    Les données par Variable/résolution se trouvent normalement dans un sous-dossier
-    appelé 'NATL60byVar'. Il est posisble de spécifier un autre nom avec l'option 
-    subdir='DOSSIER'.
-    
-    Retourne deux éléments:
-        
-        - une liste d'array 3D ([np.time steps, y size, x size]) des données contenant
-          les arrays individuels par variable et résolution nécessaires au cas (selon
-          les variables d'entrée varIn, varOut, ResoIn, ResoOut)
-          
-        - une liste de couples (Variable, Résolution) intervenant dans le cas.
-    """
-    # ---- datasets location
-    #
-    datasets_dir = os.getenv('RESAC_DATASETS_DIR', False)
-    if datasets_dir is False:
-        print('\n# ATTENTION !!\n#')
-        print('#  Le dossier contenant les datasets est introuvable !\n#')
-        print('#  Pour que les notebooks et programmes puissent le localiser, vous')
-        print("#  devez préciser la localisation de ce dossier datasets via la")
-        print("#  variable d'environnement : RESAC_DATASETS_DIR.\n#")
-        print('#  Exemple :')
-        print("#    Dans votre fichier .bashrc :")
-        print('#    export RESAC_DATASETS_DIR=~/mon/datasets/folder\n')
-        print('#')
-        print('# Valeurs typiques :')
-        print('# - Au Locean, toute machine (acces lent):')
-        print('#     export RESAC_DATASETS_DIR="/net/pallas/usr/neuro/com/carlos/Clouds/SUnextCloud/Labo/Stages-et-Projets-long/Resac/donnees"')
-        print('#')
-        print('# - Au Locean, uniquement Acratopotes (accès rapide, disque SSD):')
-        print('#     export RESAC_DATASETS_DIR="/datatmp/home/carlos/Projets/Resac/donnees"')
-        print('#')
-        print('# - Dans le cluster GPU Hal (accès rapide, disque SSD):')
-        print('#     export RESAC_DATASETS_DIR="/net/nfs/ssd3/cmejia/Travaux/Resac/donnees"')
-        assert False, 'datasets folder not found, please set RESAC_DATASETS_DIR env var.'
-    # Resolve tilde...
-    datasets_dir=os.path.expanduser(datasets_dir)
-    #
-    couple_var_reso_list = []
-    for v,r in zip(varIn+varOut,ResoIn+ResoOut):
-        if not (v,r) in couple_var_reso_list :
-            couple_var_reso_list.append((v,r))
-
-    dir_labels='NATL60byVarRXXs'
-    # Lecture Des Donnees    
-    V_data_list = []; D_dico_list = []
-    print('Les données en entrées sont bruitées :', RESAC_WITH_NOISE,"\n")
-    if noise: 
-        index = 0
-        for v,r in couple_var_reso_list:
-            if index >= len(varIn):
-                print("Chargement des données NATL60 dimensions satellites pour la sortie")
-                print(f"loading data: '{v}' at R{r}","\n")
-                data_tmp = np.load(os.path.join(datasets_dir,dir_labels,f"NATL60_{v.upper()}_R{r:02d}s.npy")) #s à la fin pour les résolutions satellites
-                dimension_tmp = np.load(os.path.join(datasets_dir,dir_labels,f"NATL60_coords_R{r:02d}s.npz"))
-                
-            else:
-                print("Chargement données satellites pour l'entrée bruitée")
-                print(f"loading data: '{v}' at R{r}","\n")
-                data_tmp = np.load(os.path.join(datasets_dir,subdir,f"SAT_{v.upper()}_R{r:02d}s.npy"))
-                dimension_tmp = np.load(os.path.join(datasets_dir,subdir,f"SAT_coords_R{r:02d}s.npz"))
-        
-            dico_dim = { 'time': dimension_tmp['time'],
-                            'lat' : dimension_tmp['latitude'],
-                            'lon' : dimension_tmp['longitude'],
-                            'lat_border' : dimension_tmp['latitude_border'],
-                            'lon_border' : dimension_tmp['longitude_border'] }
-            index +=1
-            V_data_list.append(data_tmp)
-            D_dico_list.append(dico_dim)
-    else: 
-        for v,r in couple_var_reso_list:
-            print(f"loading data: '{v}' at R{r}")
-            data_tmp = np.load(os.path.join(datasets_dir,subdir,f"NATL60_{v.upper()}_R{r:02d}.npy")) #s à la fin pour les résolutions satellites
-            dimension_tmp = np.load(os.path.join(datasets_dir,subdir,f"NATL60_coords_R{r:02d}.npz"))
-            dico_dim = { 'time': dimension_tmp['time'],
-                            'lat' : dimension_tmp['latitude'],
-                            'lon' : dimension_tmp['longitude'],
-                            'lat_border' : dimension_tmp['latitude_border'],
-                            'lon_border' : dimension_tmp['longitude_border'] }
-            V_data_list.append(data_tmp)
-            D_dico_list.append(dico_dim)
-            
-    return V_data_list, couple_var_reso_list, D_dico_list
-
-
-
-if LOAD_DATA_BY_VAR_AND_RESOL :
-    if RESAC_WITH_NOISE:
-        V_data_list, couple_var_reso_list, D_dico_list = load_resac_by_var_and_resol(varIn,varOut,ResoIn,ResoOut, subdir='Satellite/SatbyVar')
-    else:
-        V_data_list, couple_var_reso_list, D_dico_list = load_resac_by_var_and_resol(varIn,varOut,ResoIn,ResoOut)
-
-    time_axis = D_dico_list[0]['time']
-    Nimg_ = V_data_list[0].shape[0]       # nombre de patterns ou images (ou jours)
-    #
-    if FLAG_STAT_BASE_BRUTE : # Statistiques de base sur les variables brutes lues (->PPT)
-        print('Code for FLAG_STAT_BASE_BRUTE not implemented yet in LOAD_DATA_BY_VAR_AND_RESOL mode!')
-    # Splitset Ens App - Val - Test
-    print(f"Splitset Ens App - Val - Test {pcentSet}% or", end='')
-    indA, indV, indT = isetalea(Nimg_, pcentSet);
-    print(f" {(len(indA), len(indV), len(indT))} images par ensemble.")
-    if FLAG_STAT_BASE_BRUTE_SET :
-        print('Code for FLAG_STAT_BASE_BRUTE_SET not implemented yet in LOAD_DATA_BY_VAR_AND_RESOL mode!')
-    # Liste de données brutes separéee par set (A,T,V) pour OUT et pour IN
-    VAout_brute, VVout_brute, VTout_brute = data_repartition(V_data_list, couple_var_reso_list,
-                                                             varOut, ResoOut, indA, indV, indT)
-    VAin_brute, VVin_brute, VTin_brute = data_repartition(V_data_list, couple_var_reso_list,
-                                                          varIn, ResoIn, indA, indV, indT)
-    # Liste de dictionnaires de dimensions ('time','lat','lat_border', ...) separés pour OUT et pour IN
-    Din_dico_list = dic_dimension_repartition(D_dico_list, couple_var_reso_list, varIn, ResoIn) 
-    Dout_dico_list = dic_dimension_repartition(D_dico_list, couple_var_reso_list, varOut, ResoOut) 
-else:
-    FdataAllVar,varlue,diccoord = load_resac_data("natl60_htuv_01102012_01102013.npz")
-    #
-    time_axis = diccoord['time']    
-    Nvar_, Nimg_, _, _ = np.shape(FdataAllVar) #(4L, 366L, 1296L, 1377L)
-    #
-    if FLAG_STAT_BASE_BRUTE : # Statistiques de base sur les variables brutes lues (->PPT)
-        print("Statistique de base sur les variables brutes lues")
-        stat2base(FdataAllVar, varlue)
-        if LIMLAT_NORDSUD > 0 : # stat de base Nord-Sud
-            for i in np.arange(len(FdataAllVar)) :
-                XiNord_, XiSud_ = splitns(FdataAllVar[i], LIMLAT_NORDSUD)
-                print("%s Nord: "%varlue[i], end='')
-                statibase(XiNord_)
-                print("%s Sud : "%varlue[i], end='')
-                statibase(XiSud_)
-            del XiNord_, XiSud_
-    #
-    # Splitset Ens App - Val - Test
-    print("Splitset Ens App - Val - Test ...", end='')
-    indA, indV, indT = isetalea(Nimg_, pcentSet)
-    VA_brute = []
-    VV_brute = []
-    VT_brute = []
-    for i in np.arange(Nvar_) : # Pour chaque variable (i.e. liste) (dans l'ordre de tvwmm ...)
-        VA_brute.append(FdataAllVar[i][indA])
-        VV_brute.append(FdataAllVar[i][indV])
-        VT_brute.append(FdataAllVar[i][indT])
-    #
-    del FdataAllVar #<<<<<<<  
-
-
-
-    if FLAG_STAT_BASE_BRUTE_SET : #pass
-        # Stats de base en donn�es brute par ensemble
-        print("APP :") 
-        stat2base(VA_brute, varlue)
-        print("VAL :")
-        stat2base(VV_brute, varlue)
-        print("TEST:")
-        stat2base(VT_brute, varlue)
-    #
-    if FLAG_HISTO_VAR_BRUTE_SET : #pass
-        # Hist de comparaison des distributions par variable et par ensemble (->draft, ppt)
-        for i in np.arange(len(varlue)) :
-            plt.figure() 
-            plt.suptitle("Histo %s"%varlue[i])
-            
-            H_ = VA_brute[i]
-            plt.subplot(3,1,1) 
-            plt.hist(H_.ravel(), bins=50)
-            plt.title("APP")
-            
-            H_ = VV_brute[i]
-            plt.subplot(3,1,2)
-            plt.hist(H_.ravel(), bins=50)
-            plt.title("VAL")
-            
-            H_ = VT_brute[i]
-            plt.subplot(3,1,3) 
-            plt.hist(H_.ravel(), bins=50)
-            plt.title("TEST")
-        plt.show()
-    #
-    #
-
-    VAout_brute, VVout_brute, VTout_brute, VAin_brute, VVin_brute, VTin_brute \
-    = setresolution(VA_brute,VV_brute,VT_brute,varlue,ResoIn,ResoOut)
-
-    del VA_brute, VV_brute, VT_brute
-
-print("# Mise en forme") 
-for i in np.arange(NvarIn) :  # App In
-    NdonA, pixlinA, pixcinA  = np.shape(VAin_brute[i])   # Nombre de donn�es et tailles
-    VAin_brute[i] = VAin_brute[i].reshape(NdonA,1,pixlinA,pixcinA)
-for i in np.arange(NvarOut) : # App Out
-    NoutA, pixloutA, pixcoutA = np.shape(VAout_brute[i])
-    VAout_brute[i] = VAout_brute[i].reshape(NdonA,1,pixloutA,pixcoutA)   
-if NdonA != NoutA :
-    raise ValueError("Probl�me A") # ce n'est pas suffisant
-
-if TEST_ON :
-    for i in np.arange(NvarIn) :  # Tst In
-        NdonT, pixlinT, pixcinT  = np.shape(VTin_brute[i])     # Nombre de donn�es et tailles
-        VTin_brute[i] = VTin_brute[i].reshape(NdonT,1,pixlinT,pixcinT)
-    for i in np.arange(NvarOut) : # Tst Out       
-        NoutT, pixloutT, pixcoutT = np.shape(VTout_brute[i])
-        VTout_brute[i] = VTout_brute[i].reshape(NdonT,1,pixloutT,pixcoutT)
-    if NdonT != NoutT :
-        raise ValueError("Probl�me T") # ce n'est pas suffisant
-if VALID_ON : 
-    for i in np.arange(NvarIn) :  # Val In
-        NdonV, pixlinV, pixcinV  = np.shape(VVin_brute[i]) # Nombre de donn�es et tailles
-        VVin_brute[i] = VVin_brute[i].reshape(NdonV,1,pixlinV,pixcinV)
-    for i in np.arange(NvarOut) : # Val Out       
-        NoutV, pixloutV, pixcoutV = np.shape(VVout_brute[i])
-        VVout_brute[i] = VVout_brute[i].reshape(NdonV,1,pixloutV,pixcoutV)
-    if NdonV != NoutV :
-        raise ValueError("Probl�me V") # ce n'est pas suffisant
-
-#======================================================================
-#                   CODIFICATION / NORMALISATION
-#======================================================================
+# Lecture, repartition App/Val/Test et codage des données, ou attachement sans
+# copie aux données du scenario publiées en memoire partagée par resacserver.py
+scenario = get_resac_scenario(varIn,varOut,ResoIn,ResoOut)
+x_train, y_train = scenario['x_train'], scenario['y_train']
+x_valid, y_valid = scenario['x_valid'], scenario['y_valid']
+x_test,  y_test  = scenario['x_test'],  scenario['y_test']
+VAout_brute, VVout_brute, VTout_brute = scenario['VAout_brute'], scenario['VVout_brute'], scenario['VTout_brute']
+coparmAin, coparmAout = scenario['coparmAin'], scenario['coparmAout']
+if TIME_WINDOW > 1 : # entrées: fenetres de TIME_WINDOW jours consecutifs (vues, sans copie)
+  x_train, x_valid, x_test = windowed_sets((x_train, x_valid, x_test),
+                                           (scenario['indA'], scenario['indV'], scenario['indT']))
+NcanIn = len(x_train)
+NensA, NensV, NensT = len(y_train[0]), len(y_valid[0]), len(y_test[0])
 
 SSH_true = VAout_brute[-1]
-
-print("# Codification / Normalisation")
-# PLM, CE DOIT ETRE OBLIGATOIRE car la sauvegarde des param�tres n'est 
-# pas faite, Il faut repasser ici pour les recalculer � chaque fois
-VAin = []
-coparmAin = []
-for i in np.arange(NvarIn) :
-    VAin_,  coparmAin_  = codage(VAin_brute[i],  "fit01")
-    print(coparmAin_)
-    VAin.append(VAin_)
-    coparmAin.append(coparmAin_)
-del VAin_, coparmAin_
-x_train = VAin
-NcanIn  = len(x_train)
-#
-VAout = []
-coparmAout = []
-for i in np.arange(NvarOut) :
-    VAout_,  coparmAout_  = codage(VAout_brute[i],  "fit01")
-    print(coparmAout_)
-    VAout.append(VAout_)
-    coparmAout.append(coparmAout_)
-del VAout_, coparmAout_
 parametre = np.array([coparmAin,coparmAout],dtype=object)
 
-y_train = VAout
-NensA   = len(y_train[0])
-
-if TEST_ON : # Il faut appliquer le mï¿½me codage et dans les mï¿½mes conditions
-    # (i.e. avec les mï¿½mes paramï¿½tres) que ceux de l'apprentissage.
-    VTin = []
-    for i in np.arange(NvarIn) :
-        VTin_ = recodage(VTin_brute[i], coparmAin[i])
-        VTin.append(VTin_)
-    del VTin_
-    x_test = VTin
-    #
-    VTout = []
-    for i in np.arange(NvarOut) :
-        VTout_ =  recodage(VTout_brute[i], coparmAout[i])
-        VTout.append(VTout_)
-    del VTout_
-    #
-    y_test = VTout
-    NensT = len(y_test[0])
-
-if VALID_ON : # Il faut appliquer le mï¿½me codage et dans les mï¿½mes conditions
-    # (i.e. avec les mï¿½mes paramï¿½tre) que ceux de l'apprntissage.
-    VVin = []
-    for i in np.arange(NvarIn) :
-        VVin_ = recodage(VVin_brute[i], coparmAin[i])
-        VVin.append(VVin_)
-    del VVin_
-    x_valid = VVin
-    #
-    VVout = []
-    for i in np.arange(NvarOut) :
-        VVout_ =  recodage(VVout_brute[i], coparmAout[i])
-        VVout.append(VVout_)
-    del VVout_
-    #
-    y_valid = VVout
-    NensV   = len(y_valid[0])
-
 # POUR AVOIR CHANEL LAST, en Linux dans ~/.keras/keras.json
 # Windowd c:/Users/charles/.keras/keras.json
+# x_* et y_* du scenario sont deja en (N,H,W,1) (codage_nhwc)
 #y_test_brute=[]
 #y_train_brute=[]
-for i in np.arange(NvarIn):
-    x_train[i] = x_train[i].transpose(0,2,3,1)
-    x_valid[i] = x_valid[i].transpose(0,2,3,1)
-    x_test[i] = x_test[i].transpose(0,2,3,1)
-for i in np.arange(NvarOut):
-    y_train[i] = y_train[i].transpose(0,2,3,1)
-    y_valid[i] = y_valid[i].transpose(0,2,3,1)
-    y_test[i] = y_test[i].transpose(0,2,3,1)
 #    y_test_brute.append( VTout_brute[i].transpose(0,2,3,1))
 #    y_train_brute.append(VAout_brute[i].transpose(0,2,3,1))
 
@@ -372,9 +93,9 @@ class Resac(nn.Module):
     #UpSampling d'un facteur (3x3)
     self.Up = nn.Upsample(scale_factor=3, mode='bicubic', align_corners=True) #Agrandissemnt de la taille de l'image
 
-    #Couches d'input 
-    self.conv_inputR8127 = nn.Conv2d(in_channels=2,out_channels=32,kernel_size=(3,3), padding='same')#,padding_mode='replicate')
-    self.conv_inputR2709 = nn.Conv2d(in_channels=2,out_channels=16,kernel_size=(3,3), padding='same')#,padding_mode='replicate')
+    #Couches d'input (TIME_WINDOW canaux par entrée: fenetres temporelles)
+    self.conv_inputR8127 = nn.Conv2d(in_channels=2*TIME_WINDOW,out_channels=32,kernel_size=(3,3), padding='same')#,padding_mode='replicate')
+    self.conv_inputR2709 = nn.Conv2d(in_channels=1+TIME_WINDOW,out_channels=16,kernel_size=(3,3), padding='same')#,padding_mode='replicate')
 
     #Couches différentes à chaque résolution
     self.conv_32x32 = nn.Conv2d(32,32,kernel_size=(3,3), padding='same')#,padding_mode='replicate')
@@ -423,6 +144,9 @@ class Resac(nn.Module):
 def toTensor(x):
   X = []
   for idx in range(len(x)):
+    if isinstance(x[idx], WindowedSet): # fenetres (vues) sur le device, batchs (B,TIME_WINDOW,H,W) a la demande
+      X.append(WindowedTensorSet(x[idx], dev))
+      continue
     shape = (x[idx].shape[0],1,x[idx].shape[1],x[idx].shape[2]) #Channel first
     X_int = torch.Tensor([i for i in x[idx]]).view(shape).to(dev)
     #X_int = X_int.to(device)
@@ -452,10 +176,59 @@ def train_model(model, x_train,y_train,x_valid,y_valid,  EPOCHS=Niter, BATCH_SIZ
   criterion = custom_loss()
   optimizer = optim.Adam(model.parameters(), lr=lr)
   best_loss= 1000000
+  ckpt_writer = CheckpointWriter() # meilleur modele copié en memoire, ecrit en arriere plan (BACKGROUND_CHECKPOINT)
+  x_valid, y_valid = valid_subset(x_valid, y_valid) # VALID_SUBSET echantillons de validation (tous si 0)
+  validator = ThreadPoolExecutor(max_workers=1) if VALID_BACKGROUND else None # validation d'un snapshot
+  pending = None    # (epoch, etat, future) de la validation en arriere plan en cours
+  loss_valid = None # derniere loss de validation (affichage et attente de la premiere)
+  since_best = 0
+
+  def validate(m): # loss de validation du modele m (model, ou son snapshot en arriere plan)
+    training = m.training
+    m.eval()     # Optional when not using Model Specific layer
+    loss_valid = 0
+    with torch.no_grad(): # pas de graphe autograd (thread de validation)
+      for i in tqdm(range(0, len(y_valid[0]), BATCH_SIZE)): # x_valid, y_valid: listes des variables
+        #x_valid = Variable(x_valid)
+        batchv_X = []
+        batchv_y = []
+
+        for k in range (len(x_valid)):
+          batchv_X.append(Variable(x_valid[k][i:i+BATCH_SIZE]))
+        for k in range(len(y_valid)):
+          batchv_y.append(Variable(y_valid[k][i:i+BATCH_SIZE]))
+
+        target = m(batchv_X)
+        loss = criterion(target,batchv_y)
+        loss_valid += loss
+        print("\n","loss par Batch valid=",loss,"\n")
+    m.train(training)
+    return loss_valid.item()
+
+  def validated(epoch_v, state_v, loss_v): # meilleur modele et early stopping sur les validations
+    # state_v: (modele, etat de l'optimiseur) du moment de la validation, checkpoint coherent
+    nonlocal best_loss, since_best, loss_valid
+    loss_valid = loss_v
+    loss_list_valid[epoch_v] = loss_v # a l'epoch du modele validé (NaN aux epochs sans validation)
+    if best_loss > loss_v:
+      model_v, optimizer_state_v = state_v
+      checkpoint = {
+                'epoch': epoch_v,
+                'model_state': model_v.state_dict(),
+                'optimizer_state': optimizer_state_v,
+            }
+      ckpt_writer.submit(os.path.join(dir_model,f'Trained_model-E{Niter}-BS{Bsize}_1.pth'), torch.save, torch_snapshot(checkpoint))
+      best_loss = loss_v
+      since_best = 0
+    else:
+      since_best += 1
+
+  sigmas = noise_sigmas(varIn, coparmAin) # bruit des entrées SSH (TRAIN_NOISE_SIGMA), en unités codées
+  noises = input_noises(varIn, ResoIn, x_train) # bruit blanc, ou correlé (NOISE_CORR_LENGTH)
   for epoch in range(EPOCHS):
     print(f"Epoch n° : {epoch}/{Niter} commencée")
     loss_train = 0
-    loss_valid = 0
+    loss_list_valid.append(np.nan) # remplacé par validated() si cette epoch est validée
     
 
     for i in tqdm(range(0, len(x_train), BATCH_SIZE)):
@@ -463,6 +236,11 @@ def train_model(model, x_train,y_train,x_valid,y_valid,  EPOCHS=Niter, BATCH_SIZ
       batch_y = []
       for k in range (len(x_train)):
         batch_X.append(Variable(x_train[k][i:i+BATCH_SIZE]))
+      if TRAIN_NOISE_SIGMA > 0 : # bruit tiré par batch, cle (graine, indice, epoch) (sample_noise)
+        for k in range(len(batch_X)):
+          if sigmas[k] > 0 :
+            noise = noises[k](np.arange(i, i+len(batch_X[k])), batch_X[k].shape[1:], sigmas[k], epoch=epoch)
+            batch_X[k] = batch_X[k] + torch.from_numpy(noise).to(dev)
       for k in range(len(y_train)):
         batch_y.append(Variable(y_train[k][i:i+BATCH_SIZE]))
 
@@ -476,40 +254,28 @@ def train_model(model, x_train,y_train,x_valid,y_valid,  EPOCHS=Niter, BATCH_SIZ
       loss_train += loss
       print("\n","loss par Batch train=",loss,"\n")
     
-    model.eval()     # Optional when not using Model Specific layer
-    for i in tqdm(range(0, len(x_valid), 6)):
-      #x_valid = Variable(x_valid)
-      batchv_X = []
-      batchv_y = []
-
-      for k in range (len(x_valid)):
-        batchv_X.append(Variable(x_valid[k][i:i+BATCH_SIZE]))
-      for k in range(len(y_valid)):
-        batchv_y.append(Variable(y_valid[k][i:i+BATCH_SIZE]))
-
-      target = model(batchv_X)
-      loss = criterion(target,batchv_y)
-      loss_valid += loss
-      print("\n","loss par Batch valid=",loss,"\n")
+    if epoch % VALID_FREQ == 0: # validation toutes les VALID_FREQ epochs
+      if validator is None:
+        validated(epoch, (model, optimizer.state_dict()), validate(model))
+      elif pending is None: # sur un snapshot (modele et optimiseur), pendant les epochs suivantes
+        state = (deepcopy(model), torch_snapshot(optimizer.state_dict()))
+        pending = (epoch, state, validator.submit(validate, state[0]))
+    if pending is not None and (pending[2].done() or loss_valid is None): # la premiere est attendue
+      validated(pending[0], pending[1], pending[2].result())
+      pending = None
       
     print("\n","loss par epoch train =",loss_train)
     print("\n","loss par epoch valid =",loss_valid)
 
     
     loss_list_train.append(loss_train.item())
-    loss_list_valid.append(loss_valid.item())
-    
-    if best_loss > loss_valid.item(): 
-      checkpoint = {
-                'epoch': epoch,
-                'model_state': model.state_dict(),
-                'optimizer_state': optimizer.state_dict(),
-            }
-      torch.save(checkpoint ,os.path.join(dir_model,f'Trained_model-E{Niter}-BS{Bsize}_1.pth'))
-      
-      best_loss = loss_valid.item()
-      
+    if VALID_PATIENCE and since_best >= VALID_PATIENCE:
+      print(f"Early stopping: {VALID_PATIENCE} validations sans amelioration")
+      break
 
+  if pending is not None:
+    validated(pending[0], pending[1], pending[2].result())
+  ckpt_writer.wait()
   print('Finish training')
   return model, loss_list_train,loss_list_valid
 
@@ -534,9 +300,10 @@ print("loss valid", loss_list_valid,"\n")
 
 
 ############Loss Plot##############
-epochs = np.arange(Niter)
+epochs = np.arange(len(loss_list_train_1))
 plt.plot(epochs,loss_list_train_1, color='r', label='Training loss 1')
-plt.plot(epochs,loss_list_valid_1, color='b', label='Valid loss 1')
+valid = ~np.isnan(loss_list_valid_1) # epochs validées seulement (VALID_FREQ)
+plt.plot(epochs[valid],loss_list_valid_1[valid], color='b', marker='.', label='Valid loss 1')
 
 plt.yscale("log")
 
@@ -557,26 +324,19 @@ trained_model.to(device)
 ##############Prédictions##########
 #trained_model = Resac()
 #trained_model.load_state_dict(torch.load(os.path.join(dir_model,f'Trained_model-E{Niter}-BS{Bsize}_1.pt')))
-def decodage_sortie(predictions,parametre):
-  ''' 'Dé-normalisation' des prédictions pour les comparer aux données modèles'''
-  #SSH_R27_dec = decodage(predictions[0], parametre[1][0])
-  SSH_R09_dec = decodage(predictions, parametre[1][1])
-  #U_dec = decodage(predictions[2], parametre[1][2])
-  #V_dec = decodage(predictions[3], parametre[1][3])
-  return  SSH_R09_dec
-
 def predict(model,X):
   with torch.no_grad():
-     prediction = model(X)
+     prediction = model([x[:] for x in X])
   return prediction
 
 parametre = np.array([coparmAin,coparmAout],dtype=object)
 
-pred = predict(trained_model, x_trainPT)
-SSH_dec = decodage_sortie(pred,parametre).cpu().numpy()
+#Décodage de la sortie dans le graphe du modele (ResacWithCodage): une seule passe sur le device
+model_phys = ResacWithCodage(trained_model, coparmOut=coparmAout[1:2]).to(device)
+SSH_dec = predict(model_phys, x_trainPT).cpu().numpy()
 SSH_dec_flatten = SSH_dec.reshape(-1)
 
-SSH_true = decodage_sortie(y_trainPT[-1],parametre).cpu().detach().numpy()
+#SSH_true: sorties brutes du scenario (VAout_brute[-1]), sans décodage de y_trainPT
 print(SSH_true.shape)
 SSH_true_flatten = SSH_true.reshape(-1)
 from scipy.stats import linregress
@@ -542,7 +542,8 @@ os.makedirs(dir_model,exist_ok = True)
 
 np.save(os.path.join(dir_name,'train_loss'), loss_list_train)
 np.save(os.path.join(dir_name,'valid_loss'),loss_list_valid)
-torch.save(trained_model,os.path.join(dir_model,f'Trained_model-E{Niter}-BS{Bsize}.pt'))
+ckpt_writer = CheckpointWriter() # ecrit en arriere plan (BACKGROUND_CHECKPOINT) pendant les figures
+ckpt_writer.submit(os.path.join(dir_model,f'Trained_model-E{Niter}-BS{Bsize}.pt'), torch.save, trained_model)
 
 epochs = np.arange(Niter)
 
@@ -554,6 +555,7 @@ plt.title(f"Loss function avec {Niter} EPOCHS et {Bsize} Batch Size")
 plt.legend(fontsize=20)
 plt.grid()
 plt.savefig(os.path.join(dir_image, "loss function"))
+ckpt_writer.wait()
 model = torch.load(os.path.join(dir_model,f'Trained_model-E{Niter}-BS{Bsize}.pt'))
 #summary(model
 
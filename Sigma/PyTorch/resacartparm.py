@@ -5,6 +5,131 @@
 # LOAD_DATA_BY_VAR_AND_RESOL ... if True, reads data for specific variable/resolution
 #         instead of loading the huge R01 resolution 4 vars numpy array.
 #
+# LOAD_DATA_MMAP_MODE ... mmap_mode used by np.load() when reading the
+#         variable/resolution arrays ('r', 'c', ... or None). With 'r' the
+#         arrays are memory-mapped and only the pages needed by the zone,
+#         lat/lon or itime selection are actually read. None gives the old
+#         behaviour (full array loaded in memory).
+#
+# LOAD_DATA_NB_WORKERS ... number of threads used by load_resac_by_var_and_resol()
+#         to read the (variable, resolution) couples concurrently. 1 reads
+#         them one after another.
+#
+# LOAD_DATA_CATALOG ... if True, the loaders take coordinates and shapes from a
+#         persistent catalog, RESAC_CATALOG_FILE in RESAC_DATASETS_DIR (see
+#         ResacCatalog in resacartdef.py), and check the files before reading.
+#
+# LOAD_DATA_CHUNKED ... if True, the loaders read the data from the chunked
+#         store (NATL60_{VAR}_R{rr}.chunks folders, see convert_npy_to_chunked()
+#         in resacartdef.py) instead of the .npy/.npz files. Only the chunks
+#         touched by the selection are read. CHUNKED_DATA_CHUNKS gives the
+#         (time, lat, lon) chunk size used when converting and
+#         CHUNKED_DATA_COMPRESS activates zlib compression of each chunk.
+#
+# LOAD_DATA_NPZ_STREAM ... if True (with LOAD_DATA_BY_VAR_AND_RESOL), the arrays
+#         by variable/resolution are built from the huge R01 4 vars npz file,
+#         read one variable and NPZ_STREAM_TIME_CHUNK time steps at a time
+#         (see load_resac_data_by_var_and_resol() in resacartdef.py).
+#
+# LOAD_DATA_PYRAMID_CACHE ... if True (with LOAD_DATA_NPZ_STREAM), the lower
+#         resolutions (R03, R09, ...) of the huge R01 npz file are computed
+#         once and kept as .npy files in RESAC_DATASETS_DIR/PYRAMID_CACHE_SUBDIR
+#         (see build_resac_pyramid() in resacartdef.py), then memory-mapped.
+#
+# DATA_DTYPE ... type of the data arrays returned by the loaders and carried by
+#         codage, data_repartition, setresolution and setresult ('float32'
+#         halves the memory, the models train in float32 anyway). None keeps
+#         the stored type (float64). Stored files can be converted with
+#         convert_npy_dtype() (resacartdef.py) to be memory-mapped directly.
+#
+# DATA_SET_VIEWS ... if True, data_repartition() and splitset() (resacartdef.py)
+#         return the App/Val/Test sets as views (IndexedSet: one array by
+#         variable plus the indices of the set) instead of copies. The images
+#         are gathered only when used (codage, indexing, ...).
+#
+# CODAGE_STREAM ... if True, codage() and recodage() (resacartdef.py) read the
+#         data by blocks of CODAGE_TIME_CHUNK images: one pass to accumulate
+#         the statistics (StreamStats) giving the coparm, one pass to encode
+#         each block into the result. Works on memory-mapped or IndexedSet
+#         data without full size temporaries.
+#
+# BLOCK_REDUCE_TIME_CHUNK ... number of images reduced at a time by block_reduce()
+#         (and makemoy) in resacartdef.py: bounds the working memory when
+#         coarsening a long time series.
+#
+# NETCDF_VAR_MAP ... names of the variables in the NATL60 NetCDF outputs, used by
+#         ingest_netcdf() (resacartdef.py) to build the .npy files by
+#         variable/resolution directly from the NetCDF files.
+#
+# USE_SHARED_DATA ... if True, the training scripts (OB*.py, PTR*.py) first try
+#         to attach, without copy, to the arrays of their scenario published in
+#         shared memory by a server (resacserver.py, see serve_resac_scenario()
+#         in resacartdef.py), and read and encode the data themselves only if
+#         no server publishes it.
+#
+# USE_SCENARIO_CACHE ... if True, the encoded App/Val/Test tensors of a scenario,
+#         with their coparm, are kept in RESAC_DATASETS_DIR/SCENARIO_CACHE_SUBDIR
+#         (one .npy file by tensor, see save_scenario_cache() in resacartdef.py)
+#         under a key hashing the settings (variables, resolutions, codage,
+#         pcentSet, noise, zone, ...) and the fingerprint of the source files.
+#         The next runs (resacart.py, OB*.py trials, PTR*.py, resacserver.py)
+#         memory-map them and go straight to the model. resacart.py does not
+#         use the cache when figures, stats or noise on the brute data are asked.
+#
+# TRAIN_NOISE_SIGMA ... sigma (physical units) of the white gaussian noise added
+#         to the SSH inputs of each training batch (NoisyBatchSequence in
+#         resacartdef.py, and the PTR*.py training loops). The noise of a
+#         sample is drawn from a generator seeded by (NOISE_SEED, epoch, sample
+#         index): reproducible, different at each epoch, and never allocated at
+#         the size of the set. 0 disables it. The noise of the test set
+#         (SIGT_NOISE) is drawn the same way, without the epoch.
+#
+# NOISE_CORR_LENGTH ... if > 0, correlation length (m) of the training and test
+#         noise, which is then spatially correlated (CorrelatedNoise in
+#         resacartdef.py: white noise filtered by FFT, batch by batch) with the
+#         NOISE_COVARIANCE model ('gaussian' or 'exponential') instead of white.
+#
+# TIME_WINDOW ... number of consecutive days (t-TIME_WINDOW+1, ..., t) given as
+#         the channels of each input of day t (resacart.py, PTR*.py). The
+#         windows are strided views on one array of the days of the three sets
+#         (WindowedSet in resacartdef.py), never stacked copies: batches are
+#         gathered on demand, the memory is the one of the single day setup.
+#         1 gives back the single day inputs (N,H,W,1).
+#
+# USE_TF_DATA ... if True, Mdl.fit (resacart.py, OB*.py trials) is fed by a
+#         tf.data pipeline (resac_tf_dataset in resacartdef.py): shuffled
+#         indices, batches gathered (and noised) by a parallel map, prefetched
+#         while the model computes. With TFDATA_CACHE the gathered samples are
+#         cached (None: no cache, '': in memory, else a file path on disk for
+#         sets larger than the RAM) and shuffled in a buffer of
+#         TFDATA_SHUFFLE_BUFFER samples.
+#
+# BACKGROUND_CHECKPOINT ... if True, the best validation weights (resacart.py),
+#         the model exports and the torch.save of the PTR*.py scripts are
+#         snapshotted in memory and written by a background thread
+#         (CheckpointWriter in resacartdef.py), training goes on meanwhile.
+#         Either way they are written to a temporary file (or directory) and
+#         renamed: a crash during a write never leaves a corrupt checkpoint.
+#
+# VALID_FREQ ... validation every VALID_FREQ epochs (resacart.py, PTR*.py), on
+#         a fixed random subset of VALID_SUBSET samples (0: the whole set).
+#         With VALID_BACKGROUND the validation runs on a frozen snapshot of the
+#         weights in a worker thread while the training goes on (the first one
+#         excepted). The last results, repeated until the next ones, are the
+#         val_* of the history and drive the best weights checkpoint and the
+#         early stopping (EarlyStopping, or VALID_PATIENCE validations without
+#         improvement in the PTR*.py loops, 0: no early stopping).
+#         TENSORBOARD_HISTOGRAM_FREQ: epochs between TensorBoard histograms (0: none).
+#
+# XLA_JIT_COMPILE ... if True, the Keras train, test and predict steps are
+#         compiled with XLA (jit_compile of Mdl.compile, set_jit_compile for a
+#         reloaded model), the custom activations (sig01, sig17, swish) and the
+#         logcosh loss included: chains of small elementwise ops are fused.
+#         Results agree with the default within float round-off. The first
+#         epoch is slower (compilation). False disables XLA; None (default)
+#         passes nothing and keeps the Keras default ('auto' with Keras 3:
+#         XLA on GPU).
+#
 # CALENDAR_FROM_DATA ... if True, reads coords files to extract 'time' variable
 #         for calendar, or in case of LOAD_DATA_BY_VAR_AND_RESOL False, builds-it
 #         using pd.date_range(). Calendar is thus dtype='datetime64[ns]'.
@@ -16,6 +141,82 @@ RESAC_WITH_NOISE = False
 #----------------------------------------------------------------------
 LOAD_DATA_BY_VAR_AND_RESOL = True
 #----------------------------------------------------------------------
+LOAD_DATA_MMAP_MODE = 'r'
+#LOAD_DATA_MMAP_MODE = None
+#----------------------------------------------------------------------
+LOAD_DATA_NB_WORKERS = 4
+#LOAD_DATA_NB_WORKERS = 1
+#----------------------------------------------------------------------
+LOAD_DATA_CATALOG = True
+#LOAD_DATA_CATALOG = False
+RESAC_CATALOG_FILE = 'resac_catalog.pkl'
+#----------------------------------------------------------------------
+LOAD_DATA_CHUNKED = False
+#LOAD_DATA_CHUNKED = True
+CHUNKED_EXT           = '.chunks'
+CHUNKED_DATA_CHUNKS   = (1, 144, 153) # R01 (1296x1377) -> 9x9 morceaux par jour
+CHUNKED_DATA_COMPRESS = False
+#----------------------------------------------------------------------
+LOAD_DATA_NPZ_STREAM = False
+#LOAD_DATA_NPZ_STREAM = True
+NPZ_STREAM_TIME_CHUNK = 16
+LOAD_DATA_PYRAMID_CACHE = True
+#LOAD_DATA_PYRAMID_CACHE = False
+PYRAMID_CACHE_SUBDIR = 'pyramid_cache'
+#----------------------------------------------------------------------
+DATA_DTYPE = 'float32'
+#DATA_DTYPE = None
+#----------------------------------------------------------------------
+DATA_SET_VIEWS = True
+#DATA_SET_VIEWS = False
+#----------------------------------------------------------------------
+BLOCK_REDUCE_TIME_CHUNK = 16
+#----------------------------------------------------------------------
+CODAGE_STREAM = True
+#CODAGE_STREAM = False
+CODAGE_TIME_CHUNK = 16
+#----------------------------------------------------------------------
+NETCDF_VAR_MAP = { 'SSH': 'sossheig', 'SST': 'sosstsst', 'U': 'sozocrtx', 'V': 'somecrty' }
+#----------------------------------------------------------------------
+USE_SHARED_DATA = True
+#USE_SHARED_DATA = False
+#----------------------------------------------------------------------
+USE_SCENARIO_CACHE = True
+#USE_SCENARIO_CACHE = False
+SCENARIO_CACHE_SUBDIR = 'scenario_cache'
+#----------------------------------------------------------------------
+TRAIN_NOISE_SIGMA = 0.0
+#TRAIN_NOISE_SIGMA = 0.05
+NOISE_SEED = 0
+NOISE_CORR_LENGTH = 0.0
+#NOISE_CORR_LENGTH = 30000.0
+NOISE_COVARIANCE = 'gaussian'
+#----------------------------------------------------------------------
+TIME_WINDOW = 1
+#TIME_WINDOW = 3
+#----------------------------------------------------------------------
+USE_TF_DATA = False
+#USE_TF_DATA = True
+TFDATA_CACHE = None
+#TFDATA_CACHE = 'tfdata_cache'
+TFDATA_SHUFFLE_BUFFER = 1024
+#----------------------------------------------------------------------
+BACKGROUND_CHECKPOINT = True
+#BACKGROUND_CHECKPOINT = False
+#----------------------------------------------------------------------
+VALID_FREQ = 1
+#VALID_FREQ = 5
+VALID_SUBSET = 0
+#VALID_SUBSET = 32
+VALID_BACKGROUND = False
+#VALID_BACKGROUND = True
+VALID_PATIENCE = 0
+TENSORBOARD_HISTOGRAM_FREQ = 1
+#----------------------------------------------------------------------
+XLA_JIT_COMPILE = None
+#XLA_JIT_COMPILE = True
+#XLA_JIT_COMPILE = False
+#----------------------------------------------------------------------
 #CALENDAR_FROM_DATA = False
 CALENDAR_FROM_DATA = True
 #----------------------------------------------------------------------
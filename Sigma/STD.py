@@ -957,11 +957,8 @@ elif RUN_MODE=="REPRENDRE":
                                               mode='auto')
 
         callback_history = LossHistory(file=os.path.join(historique_dir,"modelkhistory.pkl"))
-        try:
-            os.remove(callback_history.file_name())
-        except OSError:
+        if not callback_history.remove():
             print("Le fichier Historique n'existe pas encore, il n'a pas pu être supprimé")
-            pass
 
         callbacks_list=[checkpoint_reprendre, callback_history,tensorboard_callback] # Sauvegarde de H.history à chaque epoch
 
@@ -1049,11 +1046,8 @@ elif RUN_MODE=="LEARN":
         #checkpoint= ModelCheckpoint(Mdl2save+"valid.ckpt", monitor='val_loss', verbose=2,
         #        save_best_only=True, save_weights_only=True, mode='auto')
         #
-        try:
-            os.remove(callback_history.file_name())
-        except OSError:
+        if not callback_history.remove():
             print("Le fichier n'existe pas encore, il n'a pas pu être supprimé")
-            pass
         #
         callbacks_list=[checkpoint, callback_history,tensorboard_callback] # Sauvegarde de H.history à chaque epoch
         #